@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import json
+import os
+
+from dotenv import load_dotenv
+from elasticsearch import NotFoundError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from batch_search import async_ndjson, BatchSearch, parse_batch_queries
+from chain import cached_chain
+from hybrid_search import async_hybrid_search
+from lexical_query import build_es_query, plan_es_query
+from local_index import LocalNotFoundError
+from metadata_store import open_metadata
+from metrics import create_search_metrics, METRICS_CONTENT_TYPE, RequestTimer, timed
+from pagination import async_search_page, InvalidCursorError, next_cursor, page_params, pagination_supported
+from result_cache import create_result_cache, normalize_cache_key
+from search_results import (add_spotify_info, create_async_search_client, format_results, group_search_hits,
+                            int_param, InvalidParameterError, options_key, search_args, search_options,
+                            snippet_document, SNIPPET_TEXT_FIELDS)
+from spotify import AsyncSpotifyClient
+from stitching import create_clip_stitcher, snippet_source
+from term_dictionary import TermDictionaries
+from vector_index import VectorIndices
+
+# The asyncio version of searcher.py with the same /search contract. One worker serves many concurrent requests,
+# because no request holds a thread while it waits for the LLM, Elasticsearch or Spotify.
+# Start with: uvicorn async_searcher:app
+
+load_dotenv()
+
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+
+index_prefix = "podcast_"
+
+client = create_async_search_client()
+
+spotify = AsyncSpotifyClient(
+    SPOTIFY_CLIENT_ID,
+    SPOTIFY_CLIENT_SECRET,
+    cache_path=os.getenv("SPOTIFY_CACHE_PATH", "../data/spotify-cache.sqlite"),
+    api_url=os.getenv("SPOTIFY_API_URL", "https://api.spotify.com"),
+    accounts_url=os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com"),
+)
+
+metadata = open_metadata()
+
+term_dictionaries = TermDictionaries(os.getenv("TERM_DICTIONARY_PATH", "../data/term-dictionary"))
+
+vector_indices = VectorIndices(os.getenv("VECTOR_INDEX_PATH", "../data/vector-index"))
+
+clip_stitcher = create_clip_stitcher()
+
+batch = BatchSearch(client, metadata, spotify, term_dictionaries, index_prefix, clip_stitcher,
+                    chunk_size=int(os.getenv("BATCH_CHUNK_SIZE", "100")),
+                    concurrency=int(os.getenv("BATCH_CONCURRENCY", "4")))
+
+result_cache = create_result_cache()
+
+search_metrics = create_search_metrics()
+
+
+def search_index(clip_length):
+    if clip_stitcher is not None:
+        return clip_stitcher.base_index
+    return index_prefix + clip_length
+
+
+def add_server_timing(response, timer):
+    if search_metrics.server_timing:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+async def search(request):
+    timer = RequestTimer()
+    try:
+        params, page = page_params(request.query_params)
+        nr_results = int_param(params, 'results', 10)
+        options = search_options(params)
+    except (InvalidCursorError, InvalidParameterError) as error:
+        return JSONResponse({"error": str(error)}, status_code=400)
+    search_query = params.get('q')
+    clip_length = params.get('length')
+    use_openai = params.get('openai')
+    index = search_index(clip_length)
+    stitched = clip_stitcher is not None and clip_stitcher.stitches(clip_length)
+    paginate = page is not None or (params.get('paginate') == "true" and pagination_supported(options)
+                                    and not stitched)
+
+    cache_key = normalize_cache_key(search_query, clip_length, nr_results, use_openai,
+                                    options_key(options))
+    cached_response = None
+    if not paginate:
+        with timer.span("cache"):
+            cached_response = result_cache.get(cache_key)
+    if cached_response is not None:
+        search_metrics.record(timer, True, index, search_query=search_query)
+        return add_server_timing(Response(cached_response, media_type="application/json"), timer)
+
+    # Refresh the Spotify token (if needed) while the query is generated and scored
+    token_task = asyncio.create_task(spotify.get_token())
+    spotify_task = None
+    try:
+        if use_openai == "true":
+            # The LangChain chain is synchronous, run it outside of the event loop
+            with timer.span("llm"):
+                invoke = await asyncio.to_thread(cached_chain.invoke, {"input": search_query})
+            query = invoke["query"]
+        else:
+            with timer.span("query"):
+                query = build_es_query(search_query, "transcript_text", term_dictionaries.get(index))["query"]
+        search_body = dict(search_args(nr_results, **options), query=query)
+
+        with timer.span("search"):
+            vector_index = vector_indices.get(index) if options["hybrid"] and not stitched else None
+            if stitched:
+                search_result = await clip_stitcher.async_search(client, query, clip_length, nr_results, options)
+            elif vector_index is not None:
+                search_result = await async_hybrid_search(client, vector_index, index, query, search_query, nr_results,
+                                                          options)
+            elif paginate:
+                try:
+                    search_result = await async_search_page(client, index, query, nr_results, options, page)
+                except (NotFoundError, LocalNotFoundError):
+                    if page is None:
+                        raise
+                    return JSONResponse({"error": "the cursor expired, search again"}, status_code=410)
+            else:
+                search_result = await client.search(index=index, **search_body)
+        hits = search_result["hits"]["hits"]
+
+        # Like the sync path, only episodes with metadata are looked up on Spotify. The lookup starts before the hits
+        # are grouped in a thread, so its requests are sent while the hits are grouped and the spans overlap
+        hit_episode_ids = list(dict.fromkeys(hit["_source"]["episode_id"] for hit in hits))
+        with timer.span("metadata"):
+            episode_metadata = await asyncio.to_thread(metadata.get_many, hit_episode_ids)
+        episode_ids = [episode_id for episode_id in hit_episode_ids if episode_id in episode_metadata]
+        spotify_task = asyncio.create_task(timed(timer, "spotify", spotify.get_episodes(episode_ids)))
+        with timer.span("group"):
+            episode_map, _ = await asyncio.to_thread(group_search_hits, hits, episode_metadata, options)
+
+        add_spotify_info(episode_map, await spotify_task)
+        await token_task
+    finally:
+        # A failed search does not wait for the refresh and the Spotify lookup, gathering them retrieves their
+        # exceptions, which would be logged as never retrieved otherwise
+        tasks = [task for task in (token_task, spotify_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    with timer.span("serialize"):
+        results = format_results(episode_map, search_result)
+        if paginate:
+            results["next_cursor"] = next_cursor(search_result, params, nr_results)
+        body = json.dumps(results).encode("utf-8")
+    if not paginate:
+        with timer.span("cache"):
+            result_cache.set(cache_key, body)
+    search_metrics.record(timer, False, index, search_body, search_result, search_query)
+    return add_server_timing(Response(body, media_type="application/json"), timer)
+
+
+async def search_batch(request):
+    try:
+        nr_results = int_param(request.query_params, 'results', 10)
+        options = search_options(request.query_params)
+    except InvalidParameterError as error:
+        return JSONResponse({"error": str(error)}, status_code=400)
+    body = (await request.body()).decode("utf-8")
+    queries = parse_batch_queries(body.splitlines(), request.query_params.get('length'), nr_results)
+    lines = batch.async_run(queries, options, request.query_params.get('spotify') != "false")
+    return StreamingResponse(async_ndjson(lines), media_type="application/x-ndjson")
+
+
+async def explain(request):
+    clip_length = request.query_params.get('length')
+    query_body, plan = plan_es_query(request.query_params.get('q'), "transcript_text",
+                                     term_dictionaries.get(search_index(clip_length)))
+    return JSONResponse({"query": query_body["query"], "plan": plan})
+
+
+async def snippet(request):
+    clip_length = request.path_params["clip_length"]
+    snippet_id = request.path_params["snippet_id"]
+    if clip_stitcher is not None and clip_stitcher.stitches(clip_length):
+        snippet_query = clip_stitcher.snippet_query(snippet_id)
+        document = snippet_source(await client.search(**snippet_query)) if snippet_query is not None else None
+        if document is None:
+            return JSONResponse({"error": "snippet not found"}, status_code=404)
+        return JSONResponse(dict(document, id=snippet_id))
+    try:
+        document = await client.get(index=search_index(clip_length), id=snippet_id, source=SNIPPET_TEXT_FIELDS)
+    except (NotFoundError, LocalNotFoundError):
+        return JSONResponse({"error": "snippet not found"}, status_code=404)
+    return JSONResponse(snippet_document(document))
+
+
+async def cache_stats(request):
+    return JSONResponse(dict(result_cache.stats(), llm=cached_chain.stats()))
+
+
+async def metrics(request):
+    return Response(search_metrics.render(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await client.close()
+    await spotify.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/search', search),
+        Route('/search/batch', search_batch, methods=["POST"]),
+        Route('/explain', explain),
+        Route('/snippet/{clip_length}/{snippet_id}', snippet),
+        Route('/cache/stats', cache_stats),
+        Route('/metrics', metrics),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"])],
+    lifespan=lifespan,
+)
@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from elasticsearch import ApiError, TransportError
+
+from lexical_query import build_es_query
+from local_index import LocalNotFoundError, UnsupportedQueryError
+from search_results import (add_spotify_info, format_results, group_search_hits, int_param, InvalidParameterError,
+                            search_args, search_options)
+
+# Batch search for evaluation jobs and backfills: a file of queries is searched in chunks of one _msearch request each,
+# with a bounded number of chunks in flight, and the results are streamed as NDJSON in the order of the queries. The
+# metadata and Spotify information of every episode is looked up once per batch, not once per query. Clips stitched
+# from base segments (see stitching.py) need two searches each and are searched one by one in their chunk.
+
+# Queries per _msearch request and _msearch requests in flight
+BATCH_CHUNK_SIZE = 100
+BATCH_CONCURRENCY = 4
+# Episode ids per metadata lookup, below the variable limit of SQLite
+METADATA_CHUNK_SIZE = 500
+
+# One query of a batch, error is set for lines that could not be parsed
+BatchQuery = namedtuple("BatchQuery", ["id", "q", "length", "results", "error"])
+
+
+def parse_batch_queries(lines, length=None, nr_results=10):
+    """Parses the lines of a batch. A line is the text of a query, or a JSON object with q and optionally id, length
+    and results. Blank lines are skipped.
+
+    Args:
+        lines (iterable): The lines of the batch.
+        length (str): The clip length of queries without one.
+        nr_results (int): The number of results of queries without one.
+
+    Yields:
+        BatchQuery: Every query, the id is the line number if the line has none.
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        entry = {"q": line}
+        if line.startswith("{"):
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry.get("q"), str):
+                    raise ValueError("no q")
+            except ValueError as error:
+                yield BatchQuery(number, None, length, nr_results, f"invalid query line: {error}")
+                continue
+        query_length = entry.get("length", length)
+        query = BatchQuery(entry.get("id", number), entry["q"], None if query_length is None else str(query_length),
+                           nr_results, None)
+        try:
+            query = query._replace(results=int_param(entry, "results", nr_results))
+        except InvalidParameterError as error:
+            query = query._replace(error=str(error))
+        if query.length is None:
+            query = query._replace(error="no clip length, pass length")
+        yield query
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+# A search body of _msearch from the arguments of client.search
+def msearch_body(args):
+    return {("_source" if key == "source" else key): value for key, value in args.items()}
+
+
+# A search response or the error of one query, as the items of an _msearch response
+def error_item(error, status=400):
+    return {"error": {"type": type(error).__name__, "reason": str(error)},
+            "status": getattr(error, "status_code", status)}
+
+
+def result_line(query, response, lookups, options):
+    # The NDJSON line of one query, its episodes like the /search response
+    if query.error is not None:
+        return {"id": query.id, "q": query.q, "error": query.error, "status": 400}
+    if "error" in response:
+        error = response["error"]
+        reason = error.get("reason", error.get("type")) if isinstance(error, dict) else str(error)
+        return {"id": query.id, "q": query.q, "error": reason, "status": response.get("status")}
+    hits = response["hits"]["hits"]
+    episode_metadata = {episode_id: lookups.metadata[episode_id]
+                        for episode_id in (hit["_source"]["episode_id"] for hit in hits)
+                        if lookups.metadata.get(episode_id) is not None}
+    episode_map, episode_ids = group_search_hits(hits, episode_metadata, options)
+    add_spotify_info(episode_map, {episode_id: lookups.spotify.get(episode_id) for episode_id in episode_ids})
+    return dict({"id": query.id, "q": query.q, "length": query.length, "took": response.get("took")},
+                **format_results(episode_map, response))
+
+
+class BatchLookups:
+    """
+    The metadata and Spotify information of the episodes found in one batch, every episode is looked up once.
+    """
+
+    def __init__(self):
+        # Per episode id the metadata (None without metadata) and the Spotify information
+        self.metadata = {}
+        self.spotify = {}
+
+    def new_episode_ids(self, responses):
+        episode_ids = dict.fromkeys(hit["_source"]["episode_id"] for response in responses if "hits" in response
+                                    for hit in response["hits"]["hits"])
+        return [episode_id for episode_id in episode_ids if episode_id not in self.metadata]
+
+    def add_metadata(self, episode_ids, found):
+        self.metadata.update(dict.fromkeys(episode_ids))
+        self.metadata.update(found)
+        return [episode_id for episode_id in episode_ids if found.get(episode_id) is not None]
+
+
+class BatchSearch:
+    """
+    Searches batches of queries with _msearch and formats every result like /search.
+    """
+
+    def __init__(self, client, metadata, spotify=None, term_dictionaries=None, index_prefix="podcast_",
+                 clip_stitcher=None, chunk_size=BATCH_CHUNK_SIZE, concurrency=BATCH_CONCURRENCY):
+        """Initializes a BatchSearch instance.
+
+        Args:
+            client: The search client (Elasticsearch or LocalSearchClient, their async versions for async_run).
+            metadata: The episode metadata, see open_metadata.
+            spotify (SpotifyClient): The Spotify client, None to return no Spotify information.
+            term_dictionaries (TermDictionaries): The term dictionaries expanding wildcards and planning the queries.
+            index_prefix (str): The prefix of the index names, followed by the clip length.
+            clip_stitcher (ClipStitcher): Stitches the clips of longer lengths from base segments, if set.
+            chunk_size (int): The number of queries per _msearch request.
+            concurrency (int): The number of _msearch requests in flight.
+        """
+        self.client = client
+        self.metadata = metadata
+        self.spotify = spotify
+        self.term_dictionaries = term_dictionaries
+        self.index_prefix = index_prefix
+        self.clip_stitcher = clip_stitcher
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def index(self, clip_length):
+        if self.clip_stitcher is not None:
+            return self.clip_stitcher.base_index
+        return self.index_prefix + str(clip_length)
+
+    def stitched(self, query):
+        return self.clip_stitcher is not None and self.clip_stitcher.stitches(query.length)
+
+    def build_query(self, query):
+        term_dictionary = self.term_dictionaries.get(self.index(query.length)) if self.term_dictionaries else None
+        return build_es_query(query.q, "transcript_text", term_dictionary)["query"]
+
+    def msearch_searches(self, chunk, options):
+        # The header and body lines of the _msearch request of the queries that are neither invalid nor stitched
+        searches = []
+        for query in chunk:
+            if query.error is None and not self.stitched(query):
+                searches.append({"index": self.index(query.length)})
+                searches.append(msearch_body(dict(search_args(query.results, **options),
+                                                  query=self.build_query(query))))
+        return searches
+
+    def search_stitched(self, query, options):
+        try:
+            return self.clip_stitcher.search(self.client, self.build_query(query), query.length, query.results, options)
+        except (ApiError, LocalNotFoundError, UnsupportedQueryError) as error:
+            return error_item(error)
+
+    def search_chunk(self, chunk, options):
+        """Searches the queries of a chunk, runs in the worker threads of run.
+
+        Args:
+            chunk (list): The BatchQuery of every query.
+            options (dict): The options of the /search modes, see search_options.
+
+        Returns:
+            list: The search response (or error item) of every query, an empty dictionary for invalid queries.
+        """
+        searches = self.msearch_searches(chunk, options)
+        try:
+            msearch_responses = iter(self.client.msearch(searches=searches)["responses"] if searches else [])
+        except (ApiError, TransportError) as error:
+            # The whole request failed (connection error, 5xx), every query of the chunk gets its error line
+            msearch_responses = itertools.repeat(error_item(error, 502))
+        responses = []
+        for query in chunk:
+            if query.error is not None:
+                responses.append({})
+            elif self.stitched(query):
+                responses.append(self.search_stitched(query, options))
+            else:
+                responses.append(next(msearch_responses))
+        return responses
+
+    def finish_chunk(self, chunk, responses, lookups, options, use_spotify):
+        # Looks up the episodes not seen in the batch before and formats the lines of the chunk
+        episode_ids = lookups.new_episode_ids(responses)
+        found = {}
+        for part in chunked(episode_ids, METADATA_CHUNK_SIZE):
+            found.update(self.metadata.get_many(part))
+        with_metadata = lookups.add_metadata(episode_ids, found)
+        if use_spotify and self.spotify is not None and with_metadata:
+            lookups.spotify.update(self.spotify.get_episodes(with_metadata))
+        return [result_line(query, response, lookups, options) for query, response in zip(chunk, responses)]
+
+    def run(self, queries, options=None, use_spotify=True):
+        """Searches a batch. At most concurrency chunks are searched at a time, so a batch of any size is streamed.
+
+        Args:
+            queries (iterable): The BatchQuery of every query, see parse_batch_queries.
+            options (dict): The options of the /search modes, see search_options. The hybrid mode is not supported.
+            use_spotify (bool): Whether to add the Spotify information to the episodes.
+
+        Yields:
+            dict: The result line of every query, in the order of the queries.
+        """
+        options = batch_options(options)
+        lookups = BatchLookups()
+        pending = deque()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            try:
+                for chunk in chunked(queries, self.chunk_size):
+                    pending.append((chunk, executor.submit(self.search_chunk, chunk, options)))
+                    if len(pending) >= self.concurrency:
+                        chunk, future = pending.popleft()
+                        yield from self.finish_chunk(chunk, future.result(), lookups, options, use_spotify)
+                while pending:
+                    chunk, future = pending.popleft()
+                    yield from self.finish_chunk(chunk, future.result(), lookups, options, use_spotify)
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    async def async_search_stitched(self, query, options):
+        try:
+            return await self.clip_stitcher.async_search(self.client, self.build_query(query), query.length,
+                                                         query.results, options)
+        except (ApiError, LocalNotFoundError, UnsupportedQueryError) as error:
+            return error_item(error)
+
+    async def async_search_chunk(self, chunk, options):
+        # search_chunk for the asyncio middle-ware
+        searches = self.msearch_searches(chunk, options)
+        try:
+            msearch_responses = iter((await self.client.msearch(searches=searches))["responses"] if searches else [])
+        except (ApiError, TransportError) as error:
+            msearch_responses = itertools.repeat(error_item(error, 502))
+        responses = []
+        for query in chunk:
+            if query.error is not None:
+                responses.append({})
+            elif self.stitched(query):
+                responses.append(await self.async_search_stitched(query, options))
+            else:
+                responses.append(next(msearch_responses))
+        return responses
+
+    async def async_finish_chunk(self, chunk, responses, lookups, options, use_spotify):
+        episode_ids = lookups.new_episode_ids(responses)
+        found = {}
+        for part in chunked(episode_ids, METADATA_CHUNK_SIZE):
+            found.update(await asyncio.to_thread(self.metadata.get_many, part))
+        with_metadata = lookups.add_metadata(episode_ids, found)
+        if use_spotify and self.spotify is not None and with_metadata:
+            lookups.spotify.update(await self.spotify.get_episodes(with_metadata))
+        return [result_line(query, response, lookups, options) for query, response in zip(chunk, responses)]
+
+    async def async_run(self, queries, options=None, use_spotify=True):
+        # run for the asyncio middle-ware, the chunks in flight are tasks of the event loop
+        options = batch_options(options)
+        lookups = BatchLookups()
+        pending = deque()
+        try:
+            for chunk in chunked(queries, self.chunk_size):
+                pending.append((chunk, asyncio.create_task(self.async_search_chunk(chunk, options))))
+                if len(pending) >= self.concurrency:
+                    chunk, task = pending.popleft()
+                    for line in await self.async_finish_chunk(chunk, await task, lookups, options, use_spotify):
+                        yield line
+            while pending:
+                chunk, task = pending.popleft()
+                for line in await self.async_finish_chunk(chunk, await task, lookups, options, use_spotify):
+                    yield line
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+
+# The options of a batch, the hybrid mode is not supported
+def batch_options(options):
+    return dict(options or search_options({}), hybrid=False)
+
+
+def ndjson(lines):
+    for line in lines:
+        yield json.dumps(line) + "\n"
+
+
+async def async_ndjson(lines):
+    async for line in lines:
+        yield json.dumps(line) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search a file of queries (one per line, or JSON objects with q, id, "
+                                                 "length and results) and write the results as NDJSON.")
+    parser.add_argument("queries", help="the file of queries, - for stdin")
+    parser.add_argument("--length", help="clip length of queries without one, e.g. 120")
+    parser.add_argument("--results", type=int, default=10, help="results of queries without a number of results")
+    parser.add_argument("--highlight", action="store_true", help="return the highlighted fragments of the clips")
+    parser.add_argument("--group", action="store_true", help="group the clips by episode, like group=true")
+    parser.add_argument("--snippets", type=int, default=3, help="clips per episode in the grouped mode")
+    parser.add_argument("--no-spotify", action="store_true", help="do not add the Spotify information")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="queries per _msearch request")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="_msearch requests in flight")
+    parser.add_argument("--output", help="the NDJSON file to write, stdout by default")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Imported here, the modules of the middle-ware are only needed by the command line
+    from metadata_store import open_metadata
+    from search_results import create_search_client
+    from spotify import SpotifyClient
+    from stitching import create_clip_stitcher
+    from term_dictionary import TermDictionaries
+
+    spotify = None
+    if not args.no_spotify and os.getenv("SPOTIFY_CLIENT_ID"):
+        spotify = SpotifyClient(
+            os.getenv("SPOTIFY_CLIENT_ID"),
+            os.getenv("SPOTIFY_CLIENT_SECRET"),
+            cache_path=os.getenv("SPOTIFY_CACHE_PATH", "../data/spotify-cache.sqlite"),
+            api_url=os.getenv("SPOTIFY_API_URL", "https://api.spotify.com"),
+            accounts_url=os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com"),
+        )
+    batch = BatchSearch(create_search_client(), open_metadata(), spotify,
+                        TermDictionaries(os.getenv("TERM_DICTIONARY_PATH", "../data/term-dictionary")),
+                        clip_stitcher=create_clip_stitcher(), chunk_size=args.chunk_size,
+                        concurrency=args.concurrency)
+    options = search_options({"highlight": str(args.highlight).lower(), "group": str(args.group).lower(),
+                              "snippets": args.snippets})
+
+    input_file = sys.stdin if args.queries == "-" else open(args.queries, encoding="utf-8")
+    output_file = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    with input_file, output_file:
+        queries = parse_batch_queries(input_file, args.length, args.results)
+        for line in ndjson(batch.run(queries, options, use_spotify=spotify is not None)):
+            output_file.write(line)
@@ -1,10 +1,10 @@
-from elasticsearch import Elasticsearch
 from langchain.output_parsers.json import SimpleJsonOutputParser
 from langchain_community.chat_models import ChatOpenAI
 from langchain_core.pydantic_v1 import BaseModel
 
-from elastic_index_info import get_indices_infos
+from llm_cache import CachedIndicesInfo, CachedQueryChain
 from prompts import DSL_PROMPT
+from search_results import create_search_client
 import os
 from dotenv import load_dotenv
 
@@ -12,13 +12,7 @@ import json
 
 load_dotenv()
 
-CLOUD_ID = os.getenv("CLOUD_ID")
-API_KEY = os.getenv("API_KEY")
-
-db = Elasticsearch(
-    cloud_id=CLOUD_ID,
-    api_key=API_KEY
-)
+db = create_search_client()
 
 # Specify indices to include
 INCLUDE_INDICES = ["podcast_120"]
@@ -27,21 +21,30 @@ INCLUDE_INDICES = ["podcast_120"]
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 _model = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY)
 
-chain = (
-        {
-            "input": lambda x: x["input"],
-            "indices_info": lambda _: get_indices_infos(db, include_indices=INCLUDE_INDICES),
-            "top_k": lambda x: x.get("top_k", 10),
-        }
-        | DSL_PROMPT
-        | _model
-        | SimpleJsonOutputParser()
-)
-
 
 class ChainInputs(BaseModel):
     input: str
     top_k: int = 10
 
 
-chain = chain.with_types(input_type=ChainInputs)
+# Build the query generation chain, model can be any LangChain model (e.g. a fake model in tests)
+def build_chain(model, indices_info):
+    return (
+            {
+                "input": lambda x: x["input"],
+                "indices_info": lambda _: indices_info(),
+                "top_k": lambda x: x.get("top_k", 10),
+            }
+            | DSL_PROMPT
+            | model
+            | SimpleJsonOutputParser()
+    ).with_types(input_type=ChainInputs)
+
+
+# The index information only changes with the mapping, the generated queries are cached on disk
+indices_info = CachedIndicesInfo(db, include_indices=INCLUDE_INDICES,
+                                 refresh_interval=float(os.getenv("INDICES_INFO_REFRESH", "3600")))
+chain = build_chain(_model, indices_info)
+cached_chain = CachedQueryChain(chain, cache_path=os.getenv("LLM_CACHE_PATH", "../data/llm-cache.sqlite"),
+                                ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                                version=indices_info.version)
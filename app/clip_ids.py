@@ -0,0 +1,19 @@
+# The ids of the base segments and stitched clips, shared by the indexer, which gives the base segments their ids, and
+# the clip stitcher of the middle-ware. A base segment has the id <episode id>-<ordinal>, a stitched clip of the
+# segments [first, last] the id <episode id>-<first>-<last>.
+
+
+def segment_id(episode_id, ordinal):
+    return f"{episode_id}-{ordinal}"
+
+
+def clip_id(clip):
+    return f"{clip.episode_id}-{clip.first}-{clip.last}"
+
+
+def parse_clip_id(value):
+    # Returns the episode id and the first and last ordinal of a clip id, None if it is not one
+    parts = value.rsplit("-", 2)
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit() or int(parts[1]) > int(parts[2]):
+        return None
+    return parts[0], int(parts[1]), int(parts[2])
@@ -2,10 +2,12 @@ from typing import List
 
 
 def _list_indices(database, include_indices=None, ignore_indices=None) -> List[str]:
-    all_indices = [index["index"] for index in database.cat.indices(format="json")]
-
     if include_indices:
-        all_indices = [i for i in all_indices if i in include_indices]
+        # Included indices may be aliases, e.g. of the indices swapped in by a bulk load of the indexer
+        all_indices = [i for i in include_indices if database.indices.exists(index=i)]
+    else:
+        all_indices = [index["index"] for index in database.cat.indices(format="json")]
+
     if ignore_indices:
         all_indices = [i for i in all_indices if i not in ignore_indices]
 
@@ -0,0 +1,122 @@
+import functools
+import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from lexical_query import STOPWORDS
+from local_index import tokenize
+
+# Sentence embeddings of the snippets (written by the indexer) and of the queries (computed by the middle-ware) for the
+# semantic search. Both have to use the same model, the vector index records the model it was built with.
+
+# A small sentence-transformers model that runs on the CPU, 384 dimensions
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+HASHING_MODEL = re.compile(r"hashing(?:-(\d+))?")
+
+
+def require_numpy():
+    if np is None:
+        raise ValueError("Embeddings and the vector index require the numpy package: pip install numpy")
+
+
+class HashingEmbedder:
+    """
+    Embeds texts without a model download by hashing their words and the character trigrams of the words into a
+    fixed number of dimensions. The vectors capture shared words and word stems, not meaning, so this embedder is meant
+    for offline setups, tests and benchmarks of the vector index.
+    """
+
+    def __init__(self, dimensions=384):
+        """Initializes a HashingEmbedder instance.
+
+        Args:
+            dimensions (int): The number of dimensions of the vectors.
+        """
+        require_numpy()
+        self.name = f"hashing-{dimensions}"
+        self.dimensions = dimensions
+        self.features = {}
+
+    def token_features(self, token):
+        # The dimensions and signs of the word and its trigrams, the trigrams together weigh as much as the word
+        features = self.features.get(token)
+        if features is None:
+            padded = f"<{token}>"
+            grams = [token] + [padded[start:start + 3] for start in range(len(padded) - 2)]
+            hashes = np.array([zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint64)
+            weights = np.full(len(grams), 1.0 / (len(grams) - 1), dtype=np.float32)
+            weights[0] = 1.0
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            features = self.features[token] = ((hashes % self.dimensions).astype(np.int64), weights * signs)
+        return features
+
+    def encode(self, texts):
+        """Embeds texts.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            numpy.ndarray: One L2 normalized float32 vector per text.
+        """
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                if token not in STOPWORDS:
+                    dimensions, weights = self.token_features(token)
+                    rows.append(np.full(len(dimensions), row))
+                    columns.append(dimensions)
+                    values.append(weights)
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if rows:
+            np.add.at(vectors, (np.concatenate(rows), np.concatenate(columns)), np.concatenate(values))
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Embeds texts with a sentence-transformers model on the CPU. The model is downloaded on first use.
+    """
+
+    def __init__(self, name=DEFAULT_MODEL, batch_size=64):
+        """Loads a model.
+
+        Args:
+            name (str): The name of the model on the Hugging Face hub or a local folder.
+            batch_size (int): The number of texts encoded at once.
+        """
+        require_numpy()
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError(f"The embedding model {name} requires the sentence-transformers package: "
+                             f"pip install sentence-transformers, or use the hashing embedder")
+        self.name = name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(name, device="cpu")
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                    normalize_embeddings=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# The embedder of a model name: hashing or hashing-<dimensions>, or a sentence-transformers model
+# Models are loaded once per process
+@functools.lru_cache(maxsize=None)
+def get_embedder(name):
+    hashing = HASHING_MODEL.fullmatch(name)
+    if hashing:
+        return HashingEmbedder(int(hashing.group(1) or 384))
+    return SentenceTransformerEmbedder(name)
@@ -0,0 +1,88 @@
+import asyncio
+
+from embeddings import get_embedder
+from search_results import search_args
+
+# The hybrid mode of /search: the snippets found by the lexical (BM25) query and the snippets closest to the embedding
+# of the query in the vector index are ranked together with reciprocal rank fusion, which only uses the ranks, so the
+# BM25 scores and the cosine similarities do not have to be normalized.
+
+# The constant of reciprocal rank fusion, higher values weigh the top ranks less
+RRF_K = 60
+# The snippets taken from each ranking
+HYBRID_CANDIDATES = 100
+
+
+# Reciprocal rank fusion: every snippet scores the sum of 1 / (k + rank) over the rankings it is in
+# Returns the best nr_results (snippet id, fused score) tuples
+def fuse_rankings(rankings, nr_results, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:nr_results]
+
+
+# The query fetching the snippets only found by the vector index, with the lexical query for their highlights
+def ids_query(doc_ids, query):
+    return {"bool": {"filter": [{"ids": {"values": doc_ids}}], "should": [query]}}
+
+
+def nearest_snippets(vector_index, search_query, size=HYBRID_CANDIDATES):
+    vector = get_embedder(vector_index.model).encode([search_query])[0]
+    return [doc_id for doc_id, _ in vector_index.search(vector, size)]
+
+
+# Replace the hits of the lexical search with the fused ranking, fetched are the hits of the ids query
+def fuse_hits(search_result, ranking, fetched=None):
+    hits_by_id = {hit["_id"]: hit for hit in search_result["hits"]["hits"]}
+    if fetched is not None:
+        hits_by_id.update((hit["_id"], hit) for hit in fetched["hits"]["hits"])
+    search_result["hits"]["hits"] = [dict(hits_by_id[doc_id], _score=score) for doc_id, score in ranking
+                                     if doc_id in hits_by_id]
+    return search_result
+
+
+def missing_ids(search_result, ranking):
+    found = {hit["_id"] for hit in search_result["hits"]["hits"]}
+    return [doc_id for doc_id, _ in ranking if doc_id not in found]
+
+
+def hybrid_search(client, vector_index, index, query, search_query, nr_results, options):
+    """Runs a search of the hybrid mode.
+
+    Args:
+        client: The search client (Elasticsearch or LocalSearchClient).
+        vector_index (VectorIndex): The vector index of the index.
+        index (str): The name of the index.
+        query (dict): The lexical query.
+        search_query (str): The text of the query, which is embedded.
+        nr_results (int): The number of snippets.
+        options (dict): The options of the /search modes, see search_options.
+
+    Returns:
+        dict: The search response with the fused hits, scored by reciprocal rank fusion.
+    """
+    search_result = client.search(index=index, query=query, **search_args(HYBRID_CANDIDATES, **options))
+    ranking = fuse_rankings([[hit["_id"] for hit in search_result["hits"]["hits"]],
+                             nearest_snippets(vector_index, search_query)], int(nr_results))
+    missing = missing_ids(search_result, ranking)
+    fetched = None
+    if missing:
+        fetched = client.search(index=index, query=ids_query(missing, query),
+                                **search_args(len(missing), **options))
+    return fuse_hits(search_result, ranking, fetched)
+
+
+async def async_hybrid_search(client, vector_index, index, query, search_query, nr_results, options):
+    # hybrid_search for the asyncio middle-ware, the query is embedded and searched while the lexical search runs
+    nearest_task = asyncio.create_task(asyncio.to_thread(nearest_snippets, vector_index, search_query))
+    search_result = await client.search(index=index, query=query, **search_args(HYBRID_CANDIDATES, **options))
+    ranking = fuse_rankings([[hit["_id"] for hit in search_result["hits"]["hits"]], await nearest_task],
+                            int(nr_results))
+    missing = missing_ids(search_result, ranking)
+    fetched = None
+    if missing:
+        fetched = await client.search(index=index, query=ids_query(missing, query),
+                                      **search_args(len(missing), **options))
+    return fuse_hits(search_result, ranking, fetched)
@@ -1,4 +1,80 @@
-def build_es_query(query_string, search_field):
+from local_index import tokenize
+
+HIGHLIGHT_PRE_TAG = "<em>"
+HIGHLIGHT_POST_TAG = "</em>"
+
+# Terms a wildcard is expanded to at most, like the default maximum clause count of Elasticsearch
+MAX_EXPANSIONS = 1024
+
+# The English stopwords of Elasticsearch, the planner drops them if they are frequent in the index
+STOPWORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the their then there these they "
+    "this to was will with".split()
+)
+
+# Share of the documents containing a term above which the planner does not score it, and drops it
+FILTER_RATIO = 0.1
+DROP_RATIO = 0.5
+
+
+def wildcard_query(pattern, search_field, term_dictionary=None, max_expansions=MAX_EXPANSIONS):
+    # With the term dictionary of the index the pattern is expanded to the terms it matches (the most frequent ones if
+    # there are more than max_expansions) before the query is sent, instead of letting Elasticsearch enumerate its
+    # term dictionary. Like wildcard queries, terms queries are not scored.
+    if term_dictionary is None:
+        return {"wildcard": {search_field: pattern}}
+    return {"terms": {search_field: term_dictionary.expand(pattern, max_expansions)}}
+
+
+def plan_intersection(terms, search_field, term_dictionary, filter_ratio=FILTER_RATIO, drop_ratio=DROP_RATIO):
+    # Plans an intersection with the document frequencies of the term dictionary:
+    # - terms in more than drop_ratio of the documents and frequent stopwords hardly restrict the hits, they are dropped
+    # - terms in more than filter_ratio of the documents have to match, but are not scored (filter context)
+    # - the other terms are scored, fused into one match clause with operator and, rarest first
+    # Returns the bool query and the plan of every term
+    nr_documents = term_dictionary.nr_documents or max(term_dictionary.document_frequencies, default=0)
+    plan = []
+    for term in dict.fromkeys(tokenize(" ".join(terms))):
+        frequency = term_dictionary.document_frequency(term)
+        ratio = frequency / nr_documents if nr_documents else 0.0
+        if ratio > drop_ratio or (term in STOPWORDS and ratio > filter_ratio):
+            action = "drop"
+        elif ratio > filter_ratio:
+            action = "filter"
+        else:
+            action = "score"
+        plan.append({"term": term, "document_frequency": frequency, "ratio": round(ratio, 4), "action": action})
+    plan.sort(key=lambda term_plan: term_plan["document_frequency"])
+    if not plan:
+        # Without a term (q=-) the planned query would match every document, the terms are matched like unplanned
+        return {"must": [{"match": {search_field: term}} for term in terms]}, plan
+
+    actions = {term_plan["action"] for term_plan in plan}
+    if plan and "score" not in actions:
+        # Without a scored term all hits would have the same score, the most selective terms are scored instead
+        promoted = "filter" if "filter" in actions else "drop"
+        for term_plan in plan:
+            if term_plan["action"] == promoted:
+                term_plan["action"] = "score"
+
+    def fused(action):
+        query_text = " ".join(term_plan["term"] for term_plan in plan if term_plan["action"] == action)
+        return [{"match": {search_field: {"query": query_text, "operator": "and"}}}] if query_text else []
+
+    bool_query = {"must": fused("score")}
+    if "filter" in {term_plan["action"] for term_plan in plan}:
+        bool_query["filter"] = fused("filter")
+    return bool_query, plan
+
+
+def build_es_query(query_string, search_field, term_dictionary=None):
+    return plan_es_query(query_string, search_field, term_dictionary)[0]
+
+
+def plan_es_query(query_string, search_field, term_dictionary=None):
+    # Builds the query, with the term dictionary of the index wildcards are expanded and intersections are planned
+    # Returns the query and an explanation of the plan
+    explain = {"planned": term_dictionary is not None}
     query = {
         "query": {
             "bool": {}
@@ -20,23 +96,70 @@ def build_es_query(query_string, search_field):
 
     if contains_wildcard:
         # Wildcard search: each term is processed for potential wildcards
+        explain["type"] = "wildcard"
         should_conditions = []
         for term in terms:
-            if "*" in term or "?" in term:
-                should_conditions.append({"wildcard": {search_field: term}})
+            if ("*" in term or "?" in term) and term_dictionary is not None:
+                expanded, nr_matching = term_dictionary.expand_counted(term, MAX_EXPANSIONS)
+                should_conditions.append({"terms": {search_field: expanded}})
+                explain.setdefault("expansions", {})[term] = len(expanded)
+                if nr_matching > len(expanded):
+                    # Only the most frequent terms are searched, the plan reports how many matched
+                    explain.setdefault("truncated", {})[term] = nr_matching
+            elif "*" in term or "?" in term:
+                should_conditions.append(wildcard_query(term, search_field))
             else:
                 should_conditions.append({"match": {search_field: term}})
         query['query']['bool']['should'] = should_conditions
         query['query']['bool']['minimum_should_match'] = 1
     elif query_type == "phrase":
         # Phrase query: exact phrase must appear in the given order
+        explain["type"] = "phrase"
         query['query']['bool']['must'] = [
             {"match_phrase": {search_field: query_context}}
         ]
+    elif query_type == "intersection" and term_dictionary is not None:
+        explain["type"] = "intersection"
+        query['query']['bool'], explain["terms"] = plan_intersection(terms, search_field, term_dictionary)
     elif query_type == "intersection":
         # Intersection query: all terms must appear, position does not matter
+        explain["type"] = "intersection"
         query['query']['bool']['must'] = [
             {"match": {search_field: term}} for term in terms
         ]
 
-    return query
+    return query, explain
+
+
+def build_highlight(search_field, fragment_size=150, number_of_fragments=3, no_match_size=None):
+    # Return only the matched fragments of the field instead of the whole transcript
+    # no_match_size returns the beginning of the text for hits that matched without a term in the field
+    return {
+        "pre_tags": [HIGHLIGHT_PRE_TAG],
+        "post_tags": [HIGHLIGHT_POST_TAG],
+        "fields": {
+            search_field: {
+                "fragment_size": fragment_size,
+                "number_of_fragments": number_of_fragments,
+                "no_match_size": fragment_size if no_match_size is None else no_match_size,
+            }
+        },
+    }
+
+
+def split_highlight(fragments, separator=" ... "):
+    # Join the highlight fragments to one text without the tags
+    # Returns the text and the [start, end] character offsets of the matches in it
+    text = ""
+    matches = []
+    for fragment_number, fragment in enumerate(fragments):
+        if fragment_number > 0:
+            text += separator
+        for part_number, part in enumerate(fragment.split(HIGHLIGHT_PRE_TAG)):
+            if part_number == 0:
+                text += part
+                continue
+            match, _, rest = part.partition(HIGHLIGHT_POST_TAG)
+            matches.append([len(text), len(text) + len(match)])
+            text += match + rest
+    return text, matches
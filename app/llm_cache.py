@@ -0,0 +1,142 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from elastic_index_info import _list_indices, get_indices_infos
+
+
+class CachedIndicesInfo:
+    """
+    Keeps the indices_info prompt section (mappings and sample documents) instead of building it for every request.
+    It is rebuilt after refresh_interval seconds, or earlier when the mapping changed, which is checked at most every
+    check_interval seconds.
+    """
+
+    def __init__(self, database, include_indices=None, ignore_indices=None, sample_documents_in_index_info=5,
+                 refresh_interval=3600, check_interval=60):
+        self.database = database
+        self.include_indices = include_indices
+        self.ignore_indices = ignore_indices
+        self.sample_documents_in_index_info = sample_documents_in_index_info
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        self.indices_info = None
+        self.mapping_hash = None
+        self.built_at = 0
+        self.checked_at = 0
+
+    def _current_mapping_hash(self):
+        indices = _list_indices(self.database, include_indices=self.include_indices,
+                                ignore_indices=self.ignore_indices)
+        mappings = self.database.indices.get_mapping(index=",".join(indices))
+        return hashlib.sha256(json.dumps(dict(mappings), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def version(self):
+        """Returns a hash of the current mappings, refreshing the cached information if needed.
+
+        Returns:
+            str: The mapping hash, which changes whenever a mapping changes.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.indices_info is not None and now - self.checked_at < self.check_interval \
+                    and now - self.built_at < self.refresh_interval:
+                return self.mapping_hash
+
+            mapping_hash = self._current_mapping_hash()
+            self.checked_at = now
+            if self.indices_info is None or mapping_hash != self.mapping_hash \
+                    or now - self.built_at >= self.refresh_interval:
+                self.indices_info = get_indices_infos(
+                    self.database,
+                    sample_documents_in_index_info=self.sample_documents_in_index_info,
+                    include_indices=self.include_indices,
+                    ignore_indices=self.ignore_indices,
+                )
+                self.mapping_hash = mapping_hash
+                self.built_at = now
+            return self.mapping_hash
+
+    def __call__(self):
+        self.version()
+        return self.indices_info
+
+
+# Normalize a natural language question, so that trivially different inputs share a cache entry
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
+
+class CachedQueryChain:
+    """
+    Wraps the query generation chain with a persistent cache of question -> generated Elasticsearch query. Entries
+    expire after ttl seconds and are keyed on the mapping version, so a changed mapping generates new queries.
+    """
+
+    def __init__(self, chain, cache_path=":memory:", ttl=7 * 24 * 3600, version=None):
+        """
+        Args:
+            chain: The chain (or any object with an invoke method, e.g. a stub in tests) that generates the query.
+            cache_path (str): The path of the SQLite file of the cache.
+            ttl (float): Seconds a generated query is reused.
+            version (callable): Returns the current mapping version, None if queries do not depend on it.
+        """
+        self.chain = chain
+        self.ttl = ttl
+        self.version = version
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS generated_queries (
+                question TEXT NOT NULL,
+                top_k INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (question, top_k, version)
+            )
+            """
+        )
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def invoke(self, inputs):
+        """Returns the generated query for the inputs, from the cache if it was generated before.
+
+        Args:
+            inputs (dict): The chain inputs, "input" (the question) and optionally "top_k".
+
+        Returns:
+            dict: The output of the chain, a JSON Elasticsearch query.
+        """
+        key = (normalize_question(inputs["input"]), inputs.get("top_k", 10),
+               self.version() if self.version is not None else "")
+
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT query, created_at FROM generated_queries WHERE question = ? AND top_k = ? AND version = ?",
+                key,
+            ).fetchone()
+        if row is not None and time.time() - row[1] < self.ttl:
+            self.hits += 1
+            return json.loads(row[0])
+
+        self.misses += 1
+        generated_query = self.chain.invoke(inputs)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO generated_queries (question, top_k, version, query, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                key + (json.dumps(generated_query), time.time()),
+            )
+            self.connection.commit()
+        return generated_query
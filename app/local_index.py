@@ -0,0 +1,858 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import heapq
+import itertools
+import json
+import math
+import mmap
+import os
+import re
+import secrets
+import shutil
+import struct
+import sys
+import threading
+import time
+from array import array
+from fnmatch import fnmatchcase
+
+from term_dictionary import TermDictionary
+
+# A local search backend for deployments without an Elasticsearch cluster (edge, CI). Every index is a folder with a
+# compact inverted index of the text field, written by the indexer (--local-index) and memory-mapped by the
+# middle-ware (LOCAL_INDEX_PATH). Files of an index folder:
+#   meta.json       number of documents, summed length of the text field, whether it is stored, mapping and byte order
+#   terms.txt       the sorted terms of the text field, one per line
+#   terms.bin       per term (plus an end record) the document frequency and the offsets of its postings and positions
+#   postings.bin    per term the varint encoded (document number delta, term frequency) pairs
+#   positions.bin   per term and document the varint encoded deltas of the positions of the term
+#   lengths.bin     the number of tokens of the text field of every document
+#   documents.bin   the JSON sources (without the text field if it is not stored), concatenated, with their offsets
+#                   in documents.idx
+#   ids.txt         the document ids, one per line
+#   <field>.values  per keyword field the sorted distinct values, <field>.ords the value ordinal of every document
+# The arrays are written in the byte order of the machine, which is recorded in meta.json.
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+TERM_RECORD = struct.Struct("<IQQ")
+# Documents without a value of a keyword field
+MISSING_ORDINAL = 0xFFFFFFFF
+
+# The tokens of the standard analyzer for the transcripts: lowercase words, with inner apostrophes ("don't")
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)?")
+
+# The BM25 parameters of Elasticsearch
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# The only sort order of the local index, the ranking by score with ties broken by the document number, which is the
+# _shard_doc tiebreaker of a point in time
+RANKING_SORT = [("_score", "desc"), ("_shard_doc", "asc")]
+TIME_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class LocalNotFoundError(LookupError):
+    """
+    A local index or document does not exist.
+    """
+
+
+class UnsupportedQueryError(ValueError):
+    """
+    The query uses a query type or option the local backend does not implement.
+    """
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def encode_varints(values, out):
+    # 7 bits per byte, the high bit marks that more bytes follow
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            values.append(value | byte << shift)
+            value = shift = 0
+    return values
+
+
+def query_terms(query, field):
+    """Collects the terms and wildcard patterns a query searches for in a field, for highlighting."""
+    (query_type, clause), = query.items()
+    if query_type == "bool":
+        terms = []
+        for key in ("must", "filter", "should"):
+            for sub_query in _clauses(clause, key):
+                terms.extend(query_terms(sub_query, field))
+        return terms
+    if query_type not in ("match", "match_phrase", "wildcard", "terms") or field not in clause:
+        return []
+    value = clause[field]
+    if query_type == "terms":
+        return [str(term).lower() for term in value]
+    if isinstance(value, dict):
+        value = value.get("query", value.get("value"))
+    if query_type == "wildcard":
+        return [str(value).lower()]
+    return tokenize(str(value))
+
+
+def highlight_fragments(text, terms, options):
+    """Returns fragments of the text around the terms, with the matches wrapped in the pre and post tags."""
+    fragment_size = options.get("fragment_size", 100)
+    number_of_fragments = options.get("number_of_fragments", 5)
+    pre_tag = options.get("pre_tags", ["<em>"])[0]
+    post_tag = options.get("post_tags", ["</em>"])[0]
+
+    matches = [match for match in TOKEN_PATTERN.finditer(text)
+               if any(fnmatchcase(match.group().lower(), term) for term in terms)]
+    if not matches:
+        no_match_size = options.get("no_match_size", 0)
+        return [text[:text.rfind(" ", 0, no_match_size + 1) if len(text) > no_match_size else len(text)]] \
+            if no_match_size else []
+
+    fragments = []
+    position = 0
+    while position < len(matches) and len(fragments) < number_of_fragments:
+        # Start the fragment at the word boundary before the first match that is not in a fragment yet
+        start = text.rfind(" ", 0, max(0, matches[position].start() - fragment_size // 4)) + 1
+        end = text.find(" ", min(len(text), start + fragment_size))
+        end = len(text) if end < 0 else end
+        pieces = []
+        last = start
+        while position < len(matches) and matches[position].end() <= end:
+            match = matches[position]
+            pieces.append(text[last:match.start()] + pre_tag + match.group() + post_tag)
+            last = match.end()
+            position += 1
+        pieces.append(text[last:end])
+        fragments.append("".join(pieces))
+    return fragments
+
+
+def filter_source(source, source_filter):
+    """Applies the _source parameter of a search (False, a list of fields or includes and excludes) to a source."""
+    if source_filter is None or source_filter is True:
+        return source
+    if isinstance(source_filter, dict):
+        includes = source_filter.get("includes")
+        excludes = source_filter.get("excludes", [])
+    else:
+        includes, excludes = source_filter, []
+    return {field: value for field, value in source.items()
+            if (includes is None or field in includes) and field not in excludes}
+
+
+# Seconds of an Elasticsearch time value like "5m"
+def parse_time_value(value):
+    match = re.fullmatch(r"(\d+)(ms|s|m|h|d)", str(value))
+    if match is None:
+        raise UnsupportedQueryError(f"Cannot parse the time value {value!r}")
+    return int(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
+# Checks that a sort of a search request is the ranking of the local index (or a prefix of it)
+def check_sort(sort):
+    keys = []
+    for entry in sort:
+        if isinstance(entry, str):
+            field, order = entry, "desc" if entry == "_score" else "asc"
+        else:
+            (field, order), = entry.items()
+            if isinstance(order, dict):
+                order = order.get("order", "desc" if field == "_score" else "asc")
+        keys.append(("_shard_doc" if field == "_doc" else field, order))
+    if keys != RANKING_SORT[:len(keys)]:
+        raise UnsupportedQueryError("The local index can only sort by _score and then _shard_doc")
+
+
+def _clauses(clause, key):
+    # Bool clauses can be a single query or a list of queries
+    queries = clause.get(key, [])
+    return [queries] if isinstance(queries, dict) else queries
+
+
+def _map(path, type_code=None):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be memory-mapped
+            data = b""
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(data).cast(type_code) if type_code else data
+
+
+def _read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    return content.split("\n") if content else []
+
+
+def index_exists(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+# Yields a temporary folder to write a new version of a folder to, which then replaces the folder. Readers keep using
+# the files they mapped until they reopen the folder. Shared by the writers of the local index, the vector index and
+# the text store.
+@contextlib.contextmanager
+def replace_folder(path):
+    path = path.rstrip(os.sep)
+    tmp_path = path + ".tmp"
+    old_path = path + ".old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+class LocalIndexWriter:
+    """
+    Builds a local index in memory and writes it on commit. An existing index is loaded first, so documents can be
+    added, replaced and deleted like in Elasticsearch. Every commit writes the whole index to a new folder that
+    replaces the old one, readers keep using the files they mapped until they reopen the index.
+    """
+
+    def __init__(self, path, field="transcript_text", keyword_fields=("episode_id",), store_field=True):
+        """Opens a writer.
+
+        Args:
+            path (str): The folder of the index.
+            field (str): The text field that is indexed for full text search.
+            keyword_fields (tuple): Fields whose values are kept per document, for collapsing and aggregations.
+            store_field (bool): Whether the text field is kept in the sources. Without it, only its tokens are kept,
+                e.g. when the text is in a text store (app/text_store.py).
+        """
+        self.path = path
+        self.field = field
+        self.keyword_fields = list(keyword_fields)
+        self.store_field = store_field
+        self.documents = {}
+        # The tokens of the documents whose text field is not stored
+        self.tokens = {}
+        if index_exists(path):
+            index = LocalIndex(path)
+            self.field = index.field
+            self.keyword_fields = list(index.keyword_values)
+            self.store_field = index.store_field
+            self.documents = {doc_id: index.source(doc_number) for doc_number, doc_id in enumerate(index.ids)}
+            if not self.store_field:
+                self.tokens = dict(zip(index.ids, index.document_tokens()))
+
+    def add(self, doc_id, source):
+        if self.store_field:
+            self.tokens.pop(doc_id, None)
+        else:
+            self.tokens[doc_id] = tokenize(str(source.get(self.field, "")))
+            source = {field: value for field, value in source.items() if field != self.field}
+        self.documents[doc_id] = source
+
+    def delete(self, doc_id):
+        self.tokens.pop(doc_id, None)
+        return self.documents.pop(doc_id, None) is not None
+
+    def commit(self):
+        """
+        Writes the index and replaces the previous version of the folder.
+        """
+        with replace_folder(self.path) as tmp_path:
+            postings = {}
+            lengths = array("I")
+            offsets = array("Q", [0])
+            with open(os.path.join(tmp_path, "documents.bin"), "wb") as f:
+                for doc_number, (doc_id, source) in enumerate(self.documents.items()):
+                    encoded = json.dumps(source, separators=(",", ":")).encode("utf-8")
+                    f.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+
+                    term_positions = {}
+                    tokens = self.tokens[doc_id] if doc_id in self.tokens else tokenize(str(source.get(self.field, "")))
+                    for position, token in enumerate(tokens):
+                        term_positions.setdefault(token, []).append(position)
+                    for term, positions in term_positions.items():
+                        postings.setdefault(term, []).append((doc_number, positions))
+                    lengths.append(len(tokens))
+
+            terms = sorted(postings)
+            term_records = bytearray()
+            postings_data = bytearray()
+            positions_data = bytearray()
+            for term in terms:
+                term_records += TERM_RECORD.pack(len(postings[term]), len(postings_data), len(positions_data))
+                previous = 0
+                for doc_number, positions in postings[term]:
+                    encode_varints((doc_number - previous, len(positions)), postings_data)
+                    encode_varints([positions[0]] + [b - a for a, b in zip(positions, positions[1:])], positions_data)
+                    previous = doc_number
+            term_records += TERM_RECORD.pack(0, len(postings_data), len(positions_data))
+
+            files = {
+                "terms.txt": "\n".join(terms).encode("utf-8"),
+                "terms.bin": term_records,
+                "postings.bin": postings_data,
+                "positions.bin": positions_data,
+                "lengths.bin": lengths.tobytes(),
+                "documents.idx": offsets.tobytes(),
+                "ids.txt": "\n".join(self.documents).encode("utf-8"),
+            }
+            for field in self.keyword_fields:
+                values = [source.get(field) for source in self.documents.values()]
+                distinct = sorted({str(value) for value in values if value is not None})
+                ordinals = {value: ordinal for ordinal, value in enumerate(distinct)}
+                files[f"{field}.values"] = json.dumps(distinct).encode("utf-8")
+                files[f"{field}.ords"] = array("I", (MISSING_ORDINAL if value is None else ordinals[str(value)]
+                                                     for value in values)).tobytes()
+            for file_name, data in files.items():
+                with open(os.path.join(tmp_path, file_name), "wb") as f:
+                    f.write(data)
+
+            meta = {
+                "format": FORMAT_VERSION,
+                "byteorder": sys.byteorder,
+                "field": self.field,
+                "store_field": self.store_field,
+                "keyword_fields": self.keyword_fields,
+                "documents": len(self.documents),
+                "total_length": sum(lengths),
+                "mapping": self.mapping(),
+            }
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump(meta, f)
+
+    def mapping(self):
+        # The mapping reported by get_mapping, derived from the first document like a dynamic mapping
+        properties = {}
+        for source in itertools.islice(self.documents.values(), 1):
+            if not self.store_field:
+                properties[self.field] = {"type": "text"}
+            for field, value in source.items():
+                if field == self.field:
+                    properties[field] = {"type": "text"}
+                elif field in self.keyword_fields:
+                    properties[field] = {"type": "keyword"}
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    properties[field] = {"type": "float", "index": False}
+                else:
+                    properties[field] = {"type": "keyword", "index": False}
+        return {"properties": properties}
+
+
+class LocalIndex:
+    """
+    Searches one local index with BM25 scoring. All files are memory-mapped, so opening an index only reads its term
+    list and ids, and the page cache is shared between worker processes. Decoded postings of frequent query terms are
+    kept in an LRU cache.
+    """
+
+    def __init__(self, path, postings_cache_size=1024):
+        """Opens an index.
+
+        Args:
+            path (str): The folder of the index.
+            postings_cache_size (int): The number of terms whose decoded postings are cached.
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["format"] != FORMAT_VERSION or meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written in an incompatible format, rebuild it with the indexer")
+
+        self.name = os.path.basename(os.path.normpath(path))
+        self.field = meta["field"]
+        self.store_field = meta.get("store_field", True)
+        self.nr_documents = meta["documents"]
+        self.average_length = meta["total_length"] / self.nr_documents if self.nr_documents else 1.0
+        self.mapping = meta["mapping"]
+
+        self.terms = _read_lines(os.path.join(path, "terms.txt"))
+        self.term_records = _map(os.path.join(path, "terms.bin"))
+        document_frequencies = [record[0] for record in TERM_RECORD.iter_unpack(self.term_records)][:-1]
+        self.dictionary = TermDictionary(self.terms, document_frequencies, self.nr_documents)
+        self.postings_data = _map(os.path.join(path, "postings.bin"))
+        self.positions_data = _map(os.path.join(path, "positions.bin"))
+        self.lengths = _map(os.path.join(path, "lengths.bin"), "I")
+        self.document_offsets = _map(os.path.join(path, "documents.idx"), "Q")
+        self.documents = _map(os.path.join(path, "documents.bin"))
+        self.ids = _read_lines(os.path.join(path, "ids.txt"))
+        self.doc_numbers = None
+
+        self.keyword_values = {}
+        self.keyword_ords = {}
+        for field in meta["keyword_fields"]:
+            with open(os.path.join(path, f"{field}.values")) as f:
+                self.keyword_values[field] = json.load(f)
+            self.keyword_ords[field] = _map(os.path.join(path, f"{field}.ords"), "I")
+
+        self.postings = functools.lru_cache(maxsize=postings_cache_size)(self._read_postings)
+        self.positions = functools.lru_cache(maxsize=postings_cache_size // 4)(self._read_positions)
+
+    def term_ordinal(self, term):
+        ordinal = bisect.bisect_left(self.terms, term)
+        return ordinal if ordinal < len(self.terms) and self.terms[ordinal] == term else None
+
+    def document_frequency(self, ordinal):
+        return self.dictionary.document_frequencies[ordinal]
+
+    def _read_postings(self, ordinal):
+        # The document numbers and term frequencies of a term
+        _, start, _ = TERM_RECORD.unpack_from(self.term_records, ordinal * TERM_RECORD.size)
+        _, end, _ = TERM_RECORD.unpack_from(self.term_records, (ordinal + 1) * TERM_RECORD.size)
+        values = decode_varints(self.postings_data[start:end])
+        return list(itertools.accumulate(values[0::2])), values[1::2]
+
+    def _read_positions(self, ordinal):
+        # Map of document number to the positions of a term
+        doc_numbers, frequencies = self.postings(ordinal)
+        _, _, start = TERM_RECORD.unpack_from(self.term_records, ordinal * TERM_RECORD.size)
+        _, _, end = TERM_RECORD.unpack_from(self.term_records, (ordinal + 1) * TERM_RECORD.size)
+        deltas = decode_varints(self.positions_data[start:end])
+        positions = {}
+        offset = 0
+        for doc_number, frequency in zip(doc_numbers, frequencies):
+            positions[doc_number] = set(itertools.accumulate(deltas[offset:offset + frequency]))
+            offset += frequency
+        return positions
+
+    def document_tokens(self):
+        # The tokens of every document, rebuilt from the positions of the terms for indices without the text field
+        tokens = [[None] * self.lengths[doc_number] for doc_number in range(self.nr_documents)]
+        for ordinal, term in enumerate(self.terms):
+            for doc_number, positions in self._read_positions(ordinal).items():
+                for position in positions:
+                    tokens[doc_number][position] = term
+        return tokens
+
+    def idf(self, document_frequency):
+        return math.log(1 + (self.nr_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def bm25(self, idf, frequencies):
+        """Scores documents by BM25.
+
+        Args:
+            idf (float): The inverse document frequency of the term (summed over the terms of a phrase).
+            frequencies (dict): The term (or phrase) frequency per document number.
+
+        Returns:
+            dict: The score per document number.
+        """
+        length_free = BM25_K1 * (1 - BM25_B)
+        per_token = BM25_K1 * BM25_B / self.average_length
+        lengths = self.lengths
+        return {doc_number: idf * frequency * (BM25_K1 + 1)
+                / (frequency + length_free + per_token * lengths[doc_number])
+                for doc_number, frequency in frequencies.items()}
+
+    def term_scores(self, ordinal):
+        doc_numbers, frequencies = self.postings(ordinal)
+        return self.bm25(self.idf(len(doc_numbers)), dict(zip(doc_numbers, frequencies)))
+
+    def evaluate(self, query):
+        """Finds and scores the documents matching a query.
+
+        Args:
+            query (dict): A query of the Query DSL: bool, match, match_phrase, wildcard, term, terms, ids or
+                match_all.
+
+        Returns:
+            dict: The score per matching document number.
+        """
+        (query_type, clause), = query.items()
+        if query_type == "match_all":
+            return dict.fromkeys(range(self.nr_documents), 1.0)
+        if query_type == "bool":
+            return self._evaluate_bool(clause)
+        if query_type == "ids":
+            doc_numbers = (self.doc_number(doc_id) for doc_id in clause["values"])
+            return {doc_number: 1.0 for doc_number in doc_numbers if doc_number is not None}
+        if query_type not in ("match", "match_phrase", "wildcard", "term", "terms"):
+            raise UnsupportedQueryError(f"{query_type} queries are not supported by the local index")
+
+        (field, value), = clause.items()
+        options = value if isinstance(value, dict) else {}
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        if field in self.keyword_ords and query_type in ("match", "term"):
+            return self._evaluate_keyword(field, value)
+        if field != self.field:
+            return {}
+
+        if query_type == "wildcard":
+            doc_numbers = set()
+            for ordinal in self.dictionary.matching_ordinals(str(value)):
+                doc_numbers.update(self.postings(ordinal)[0])
+            # Like Elasticsearch, wildcard and terms queries are not scored
+            return dict.fromkeys(doc_numbers, 1.0)
+        if query_type == "terms":
+            doc_numbers = set()
+            for ordinal in map(self.term_ordinal, (str(term).lower() for term in value)):
+                if ordinal is not None:
+                    doc_numbers.update(self.postings(ordinal)[0])
+            return dict.fromkeys(doc_numbers, 1.0)
+
+        ordinals = [self.term_ordinal(term) for term in tokenize(str(value))]
+        if query_type == "match_phrase" and len(ordinals) > 1:
+            return self._evaluate_phrase(ordinals)
+        if options.get("operator", "or").lower() == "and":
+            if not ordinals or None in ordinals:
+                return {}
+            required = sorted((self.term_scores(ordinal) for ordinal in ordinals), key=len)
+            return {doc_number: sum(scores[doc_number] for scores in required)
+                    for doc_number in required[0] if all(doc_number in scores for scores in required[1:])}
+
+        scores = {}
+        for ordinal in ordinals:
+            if ordinal is not None:
+                for doc_number, score in self.term_scores(ordinal).items():
+                    scores[doc_number] = scores.get(doc_number, 0.0) + score
+        return scores
+
+    def _evaluate_phrase(self, ordinals):
+        if None in ordinals:
+            return {}
+        # Only documents containing all terms are checked, starting from the rarest term
+        doc_sets = sorted((set(self.postings(ordinal)[0]) for ordinal in ordinals), key=len)
+        candidates = doc_sets[0].intersection(*doc_sets[1:])
+        positions = [self.positions(ordinal) for ordinal in ordinals]
+
+        frequencies = {}
+        for doc_number in candidates:
+            following = [term_positions[doc_number] for term_positions in positions[1:]]
+            frequency = sum(1 for start in positions[0][doc_number]
+                            if all(start + offset in term_positions
+                                   for offset, term_positions in enumerate(following, start=1)))
+            if frequency:
+                frequencies[doc_number] = frequency
+        idf = sum(self.idf(self.document_frequency(ordinal)) for ordinal in ordinals)
+        return self.bm25(idf, frequencies)
+
+    def _evaluate_keyword(self, field, value):
+        values = self.keyword_values[field]
+        ordinal = bisect.bisect_left(values, str(value))
+        if ordinal == len(values) or values[ordinal] != str(value):
+            return {}
+        return {doc_number: 1.0 for doc_number, document_ordinal in enumerate(self.keyword_ords[field])
+                if document_ordinal == ordinal}
+
+    def _evaluate_bool(self, clause):
+        must = [self.evaluate(query) for query in _clauses(clause, "must")]
+        filters = [self.evaluate(query) for query in _clauses(clause, "filter")]
+        should = [self.evaluate(query) for query in _clauses(clause, "should")]
+        must_not = [self.evaluate(query) for query in _clauses(clause, "must_not")]
+        required = must + filters
+        minimum_should_match = int(clause.get("minimum_should_match", 0 if required else 1)) if should else 0
+
+        if required:
+            smallest = min(required, key=len)
+            scores = {doc_number: sum(scores[doc_number] for scores in must) for doc_number in smallest
+                      if all(doc_number in scores for scores in required)}
+        elif should:
+            scores = {}
+        else:
+            scores = dict.fromkeys(range(self.nr_documents), 0.0)
+
+        matched = {}
+        for should_scores in should:
+            for doc_number, score in should_scores.items():
+                if required and doc_number not in scores:
+                    continue
+                scores[doc_number] = scores.get(doc_number, 0.0) + score
+                matched[doc_number] = matched.get(doc_number, 0) + 1
+        if minimum_should_match > 0:
+            scores = {doc_number: score for doc_number, score in scores.items()
+                      if matched.get(doc_number, 0) >= minimum_should_match}
+        for excluded in must_not:
+            for doc_number in excluded:
+                scores.pop(doc_number, None)
+        return scores
+
+    def source(self, doc_number):
+        start, end = self.document_offsets[doc_number], self.document_offsets[doc_number + 1]
+        return json.loads(self.documents[start:end])
+
+    def doc_number(self, doc_id):
+        if self.doc_numbers is None:
+            self.doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(self.ids)}
+        return self.doc_numbers.get(doc_id)
+
+    def hit(self, doc_number, score, source_filter=None, highlight=None, query=None):
+        """Builds a search hit like Elasticsearch, with _source filtering and highlighting."""
+        source = self.source(doc_number)
+        hit = {"_index": self.name, "_id": self.ids[doc_number], "_score": score}
+        if highlight is not None:
+            highlighted = {}
+            for field, options in highlight["fields"].items():
+                options = dict(highlight, **options)
+                fragments = highlight_fragments(str(source.get(field, "")), query_terms(query, field), options)
+                if fragments:
+                    highlighted[field] = fragments
+            if highlighted:
+                hit["highlight"] = highlighted
+        if source_filter is not False:
+            hit["_source"] = filter_source(source, source_filter)
+        return hit
+
+    def search(self, query=None, size=10, source=None, highlight=None, collapse=None, aggs=None, sort=None,
+               search_after=None):
+        """Runs a search, with the arguments and the response format of Elasticsearch.
+
+        Args:
+            query (dict): The query, match_all by default.
+            size (int): The number of hits (of groups when collapsing).
+            source: The _source filter of the hits.
+            highlight (dict): The highlight options.
+            collapse (dict): Collapses the hits on a keyword field, optionally with inner hits.
+            aggs (dict): Cardinality aggregations on keyword fields.
+            sort (list): The sort of the hits, only the ranking (_score, then _shard_doc) is supported. The hits then
+                have their sort values.
+            search_after (list): The sort values of the last hit of the previous page, only hits ranked after it are
+                returned.
+
+        Returns:
+            dict: The search response.
+        """
+        start = time.perf_counter()
+        query = query or {"match_all": {}}
+        scores = self.evaluate(query)
+        response = {"timed_out": False}
+        if sort is not None:
+            check_sort(sort)
+        if search_after is not None:
+            if collapse is not None:
+                raise UnsupportedQueryError("The local index cannot page through collapsed hits")
+            after = (-float(search_after[0]), int(search_after[1]))
+            ranked = {doc_number: score for doc_number, score in scores.items() if (-score, doc_number) > after}
+        else:
+            ranked = scores
+
+        if aggs:
+            response["aggregations"] = {name: self.aggregate(aggregation, scores) for name, aggregation in aggs.items()}
+
+        def rank(item):
+            return -item[1], item[0]
+
+        if collapse is None:
+            best = heapq.nsmallest(size, ranked.items(), key=rank)
+            hits = [self.hit(doc_number, score, source, highlight, query) for doc_number, score in best]
+            if sort is not None:
+                for hit, (doc_number, score) in zip(hits, best):
+                    hit["sort"] = [score, doc_number]
+        else:
+            hits = self.collapse(sorted(scores.items(), key=rank), collapse, size, source, highlight, query)
+
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        response["hits"] = {"total": {"value": len(scores), "relation": "eq"},
+                            "max_score": max(scores.values()) if scores else None, "hits": hits}
+        return response
+
+    def aggregate(self, aggregation, scores):
+        if "cardinality" not in aggregation or aggregation["cardinality"]["field"] not in self.keyword_ords:
+            raise UnsupportedQueryError("The local index supports cardinality aggregations on keyword fields only")
+        ords = self.keyword_ords[aggregation["cardinality"]["field"]]
+        return {"value": len({ords[doc_number] for doc_number in scores} - {MISSING_ORDINAL})}
+
+    def collapse(self, ranked, collapse, size, source_filter, highlight, query):
+        # Keeps the best hit of the best size groups, with the best hits of every group as inner hits
+        field = collapse["field"]
+        if field not in self.keyword_ords:
+            raise UnsupportedQueryError(f"Cannot collapse on {field}, it is not a keyword field of the local index")
+        ords = self.keyword_ords[field]
+        groups = {}
+        for doc_number, score in ranked:
+            groups.setdefault(ords[doc_number], []).append((doc_number, score))
+
+        hits = []
+        inner_hits = collapse.get("inner_hits")
+        for ordinal, group in itertools.islice(groups.items(), size):
+            value = None if ordinal == MISSING_ORDINAL else self.keyword_values[field][ordinal]
+            hit = dict(self.hit(*group[0], source_filter, None, query), fields={field: [value]})
+            if inner_hits is not None:
+                members = [self.hit(doc_number, score, inner_hits.get("_source"), inner_hits.get("highlight"), query)
+                           for doc_number, score in group[:inner_hits.get("size", 3)]]
+                hit["inner_hits"] = {inner_hits["name"]: {"hits": {
+                    "total": {"value": len(group), "relation": "eq"},
+                    "max_score": group[0][1],
+                    "hits": members,
+                }}}
+            hits.append(hit)
+        return hits
+
+
+class _LocalIndices:
+    # client.indices of LocalSearchClient
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, index):
+        return all(index_exists(os.path.join(self.client.path, name)) for name in index.split(","))
+
+    def get_mapping(self, index):
+        return {name: {"mappings": self.client.index(name).mapping} for name in index.split(",")}
+
+
+class _LocalCat:
+    # client.cat of LocalSearchClient
+    def __init__(self, client):
+        self.client = client
+
+    def indices(self, format="json"):
+        names = sorted(name for name in os.listdir(self.client.path)
+                       if index_exists(os.path.join(self.client.path, name)))
+        return [{"index": name, "docs.count": str(self.client.index(name).nr_documents)} for name in names]
+
+
+class LocalSearchClient:
+    """
+    The part of the Elasticsearch client used by the middle-ware and the LLM chain (search, msearch, get,
+    indices.exists, indices.get_mapping, cat.indices and points in time), served by the local indices in one folder.
+    An index is reopened when the indexer replaced it. A point in time keeps the version of the index it was opened on.
+    """
+
+    def __init__(self, path):
+        """Initializes a LocalSearchClient instance.
+
+        Args:
+            path (str): The folder containing one folder per index.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.opened = {}
+        # Per point in time id the opened index and the expiry time
+        self.points_in_time = {}
+        self.indices = _LocalIndices(self)
+        self.cat = _LocalCat(self)
+
+    def index(self, name):
+        try:
+            stat = os.stat(os.path.join(self.path, name, META_FILE))
+        except FileNotFoundError:
+            raise LocalNotFoundError(f"no such index [{name}]")
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            opened = self.opened.get(name)
+            if opened is None or opened[0] != version:
+                opened = self.opened[name] = (version, LocalIndex(os.path.join(self.path, name)))
+        return opened[1]
+
+    def open_point_in_time(self, index, keep_alive):
+        local_index = self.index(index)
+        now = time.monotonic()
+        pit_id = secrets.token_urlsafe(16)
+        with self.lock:
+            self.points_in_time = {key: value for key, value in self.points_in_time.items() if value[1] > now}
+            self.points_in_time[pit_id] = (local_index, now + parse_time_value(keep_alive))
+        return {"id": pit_id}
+
+    def close_point_in_time(self, id):
+        with self.lock:
+            freed = self.points_in_time.pop(id, None) is not None
+        return {"succeeded": True, "num_freed": int(freed)}
+
+    def point_in_time(self, pit):
+        # The index of a point in time, a search extends its keep alive like in Elasticsearch
+        now = time.monotonic()
+        with self.lock:
+            opened = self.points_in_time.get(pit["id"])
+            if opened is None or opened[1] <= now:
+                self.points_in_time.pop(pit["id"], None)
+                raise LocalNotFoundError(f"no point in time [{pit['id']}], it expired or was closed")
+            if "keep_alive" in pit:
+                self.points_in_time[pit["id"]] = (opened[0], now + parse_time_value(pit["keep_alive"]))
+        return opened[0]
+
+    def search(self, index=None, query=None, size=10, source=None, highlight=None, collapse=None, aggs=None, pit=None,
+               sort=None, search_after=None, track_total_hits=None):
+        # The total is always counted, track_total_hits is accepted for compatibility
+        local_index = self.index(index) if pit is None else self.point_in_time(pit)
+        response = local_index.search(query=query, size=int(size), source=source, highlight=highlight,
+                                      collapse=collapse, aggs=aggs, sort=sort, search_after=search_after)
+        if pit is not None:
+            response["pit_id"] = pit["id"]
+        return response
+
+    def msearch(self, searches, index=None):
+        """Runs the searches of an _msearch request one after the other.
+
+        Args:
+            searches (list): The header (with the index) and the body of every search, alternating.
+            index (str): The index of searches whose header has none.
+
+        Returns:
+            dict: The response of every search in "responses", or its error and status.
+        """
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            args = {("source" if key == "_source" else key): value for key, value in body.items()}
+            try:
+                response = self.search(index=header.get("index", index), **args)
+            except LocalNotFoundError as error:
+                response = {"error": {"type": "index_not_found_exception", "reason": str(error)}, "status": 404}
+            except UnsupportedQueryError as error:
+                response = {"error": {"type": "parsing_exception", "reason": str(error)}, "status": 400}
+            else:
+                response["status"] = 200
+            responses.append(response)
+        return {"took": sum(response.get("took", 0) for response in responses), "responses": responses}
+
+    def get(self, index, id, source=None):
+        local_index = self.index(index)
+        doc_number = local_index.doc_number(id)
+        if doc_number is None:
+            raise LocalNotFoundError(f"no document [{id}] in [{index}]")
+        hit = local_index.hit(doc_number, None, source)
+        del hit["_score"]
+        return dict(hit, found=True)
+
+    def close(self):
+        pass
+
+
+class AsyncLocalSearchClient:
+    """
+    LocalSearchClient for the asyncio middle-ware. Searches run in a worker thread, so the event loop keeps serving
+    other requests.
+    """
+
+    def __init__(self, path):
+        self.client = LocalSearchClient(path)
+
+    async def search(self, **kwargs):
+        return await asyncio.to_thread(self.client.search, **kwargs)
+
+    async def msearch(self, **kwargs):
+        return await asyncio.to_thread(self.client.msearch, **kwargs)
+
+    async def get(self, **kwargs):
+        return await asyncio.to_thread(self.client.get, **kwargs)
+
+    async def open_point_in_time(self, **kwargs):
+        return await asyncio.to_thread(self.client.open_point_in_time, **kwargs)
+
+    async def close_point_in_time(self, **kwargs):
+        return self.client.close_point_in_time(**kwargs)
+
+    async def close(self):
+        pass
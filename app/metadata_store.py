@@ -0,0 +1,135 @@
+import argparse
+import os
+import sqlite3
+import threading
+
+METADATA_FIELDS = [
+    "show_name",
+    "show_description",
+    "publisher",
+    "language",
+    "rss_link",
+    "episode_uri",
+    "episode_name",
+    "episode_description",
+    "duration",
+]
+
+
+# Read metadata.tsv file
+# Returns map of episode_filename_prefix to metadata
+def read_metadata(path="../data/metadata.tsv"):
+    metadata = {}
+    with open(path, "r") as file:
+        lines = file.readlines()
+        for line in lines:
+            episode_info = line.strip().split("\t")
+            episode_filename_prefix = episode_info[-1]
+            metadata[episode_filename_prefix] = {
+                "show_name": episode_info[1],
+                "show_description": episode_info[2],
+                "publisher": episode_info[3],
+                "language": episode_info[4],
+                "rss_link": episode_info[5],
+                "episode_uri": episode_info[6],
+                "episode_name": episode_info[7],
+                "episode_description": episode_info[8],
+                "duration": episode_info[9],
+            }
+    return metadata
+
+
+# Build the SQLite metadata store from metadata.tsv, one row per episode
+def build_metadata_store(tsv_path, db_path):
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    columns = ", ".join(f"{field} TEXT" for field in METADATA_FIELDS)
+    connection.execute(f"CREATE TABLE metadata (episode_id TEXT PRIMARY KEY, {columns}) WITHOUT ROWID")
+
+    def rows():
+        with open(tsv_path, "r") as file:
+            next(file)  # header
+            for line in file:
+                episode_info = line.strip().split("\t")
+                yield [episode_info[-1]] + episode_info[1:10]
+
+    placeholders = ", ".join("?" for _ in range(len(METADATA_FIELDS) + 1))
+    connection.executemany(f"INSERT OR REPLACE INTO metadata VALUES ({placeholders})", rows())
+    connection.commit()
+    count = connection.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+    connection.close()
+
+    # Replace atomically, so running workers never see a half written store
+    os.replace(tmp_path, db_path)
+    return count
+
+
+class MetadataStore:
+    """
+    Read-only episode metadata in a SQLite file. Every thread opens its own connection on first use, so forking
+    workers is cheap and the file is shared between all workers through the page cache.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self.local.connection = connection
+        return connection
+
+    def get_many(self, episode_ids):
+        """Looks up the metadata of several episodes with one query.
+
+        Args:
+            episode_ids (iterable): The episode ids (episode_filename_prefix).
+
+        Returns:
+            dict: Map of episode id to its metadata, episodes without metadata are left out.
+        """
+        episode_ids = list(set(episode_ids))
+        if len(episode_ids) == 0:
+            return {}
+
+        placeholders = ", ".join("?" for _ in episode_ids)
+        rows = self._connection().execute(
+            f"SELECT episode_id, {', '.join(METADATA_FIELDS)} FROM metadata WHERE episode_id IN ({placeholders})",
+            episode_ids,
+        )
+        return {row[0]: dict(zip(METADATA_FIELDS, row[1:])) for row in rows}
+
+
+class InMemoryMetadata:
+    """
+    The metadata dict read from metadata.tsv, with the interface of MetadataStore.
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def get_many(self, episode_ids):
+        return {episode_id: self.metadata[episode_id] for episode_id in episode_ids if episode_id in self.metadata}
+
+
+# Open the SQLite store if it was built, otherwise fall back to reading metadata.tsv into memory
+def open_metadata(db_path="../data/metadata.sqlite", tsv_path="../data/metadata.tsv"):
+    if os.path.exists(db_path):
+        return MetadataStore(db_path)
+    print(f"No metadata store at {db_path}, reading {tsv_path} into memory. "
+          f"Build the store with: python metadata_store.py {tsv_path} {db_path}")
+    return InMemoryMetadata(read_metadata(tsv_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the SQLite metadata store from metadata.tsv.")
+    parser.add_argument("tsv", nargs="?", default="../data/metadata.tsv")
+    parser.add_argument("db", nargs="?", default="../data/metadata.sqlite")
+    args = parser.parse_args()
+
+    print(f"Stored metadata of {build_metadata_store(args.tsv, args.db)} episodes in {args.db}")
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency metrics of the middle-ware: every /search request is timed per stage (cache lookup, query generation,
+# search, metadata, Spotify, grouping and serialization). The timings are collected in histograms served in the
+# Prometheus text format at /metrics, can be returned in a Server-Timing header, and slow requests are logged with
+# the search body and the "took" time Elasticsearch reported. Every worker process has its own metrics.
+
+# Upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Content type of the Prometheus text format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one label, e.g. the stage of a request.
+    """
+
+    def __init__(self, name, description, label, buckets=LATENCY_BUCKETS):
+        """Creates an empty histogram.
+
+        Args:
+            name (str): The name of the metric.
+            description (str): The help text of the metric.
+            label (str): The name of the label distinguishing the series.
+            buckets (tuple): The upper bounds of the buckets, in increasing order.
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.lock = threading.Lock()
+        # Per label value: the count of every bucket (not cumulative), the sum and the count of the observations
+        self.series = {}
+
+    def observe(self, label_value, value):
+        with self.lock:
+            counts, total, count = self.series.get(label_value) or ([0] * len(self.buckets), 0.0, 0)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            self.series[label_value] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted(self.series.items())
+        for label_value, (counts, total, count) in series:
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{format_value(bound)}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return "\n".join(lines)
+
+
+class RequestTimer:
+    """
+    The time spent in every stage of one request. Stages may be timed several times (the time adds up) and may overlap
+    in the asyncio middle-ware.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Formats the stages as the value of a Server-Timing header, e.g. "search;dur=12.3, total;dur=15.0".
+
+        Returns:
+            str: The header value, durations in milliseconds.
+        """
+        stages = list(self.stages.items()) + [("total", self.elapsed())]
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages)
+
+
+# Awaits a coroutine or task and adds the time until it finished to a stage of the timer
+async def timed(timer, stage, awaitable):
+    with timer.span(stage):
+        return await awaitable
+
+
+class SearchMetrics:
+    """
+    The latency histograms of the /search requests of one worker and the slow query log.
+    """
+
+    def __init__(self, slow_query_seconds=1.0, slow_query_log=None, server_timing=False):
+        """Creates empty metrics.
+
+        Args:
+            slow_query_seconds (float): Requests taking at least this long are logged, None to log none.
+            slow_query_log (str): The file the slow queries are appended to as JSON lines, None to print them.
+            server_timing (bool): Whether responses get a Server-Timing header with the stage timings.
+        """
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_query_log = slow_query_log
+        self.server_timing = server_timing
+        self.lock = threading.Lock()
+        self.slow_queries = 0
+        self.stages = Histogram("search_stage_seconds", "Time spent in each stage of /search.", "stage")
+        self.requests = Histogram("search_request_seconds", "Time to answer /search, from the result cache or not.",
+                                  "cache")
+        self.took = Histogram("search_took_seconds", "Search time reported by the search backend (took).", "index")
+
+    def record(self, timer, cached, index=None, query=None, search_result=None, search_query=None):
+        """Adds the timings of a finished request and logs it if it was slow.
+
+        Args:
+            timer (RequestTimer): The timings of the request.
+            cached (bool): Whether the response came from the result cache.
+            index (str): The searched index.
+            query (dict): The body of the search request, logged for slow queries.
+            search_result (dict): The response of the search backend, for its "took" time in milliseconds.
+            search_query (str): The text of the query.
+        """
+        total = timer.elapsed()
+        for stage, seconds in timer.stages.items():
+            self.stages.observe(stage, seconds)
+        self.requests.observe("hit" if cached else "miss", total)
+        took = search_result.get("took") if search_result is not None else None
+        if took is not None:
+            self.took.observe(index, took / 1000)
+        if self.slow_query_seconds is not None and total >= self.slow_query_seconds:
+            self.log_slow_query({
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "q": search_query,
+                "index": index,
+                "cached": cached,
+                "total_ms": round(total * 1000, 1),
+                "took_ms": took,
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timer.stages.items()},
+                "body": query,
+            })
+
+    def log_slow_query(self, entry):
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            self.slow_queries += 1
+            if self.slow_query_log is None:
+                print(f"Slow query: {line}")
+                return
+            with open(self.slow_query_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def render(self):
+        """Formats all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The body of the /metrics response.
+        """
+        return "\n".join([
+            self.stages.render(),
+            self.requests.render(),
+            self.took.render(),
+            "# HELP search_slow_queries_total Requests logged as slow queries.",
+            "# TYPE search_slow_queries_total counter",
+            f"search_slow_queries_total {self.slow_queries}",
+        ]) + "\n"
+
+
+def create_search_metrics():
+    slow_query_ms = os.getenv("SLOW_QUERY_MS", "1000")
+    return SearchMetrics(
+        slow_query_seconds=float(slow_query_ms) / 1000 if slow_query_ms != "off" else None,
+        slow_query_log=os.getenv("SLOW_QUERY_LOG") or None,
+        server_timing=os.getenv("SERVER_TIMING", "false") == "true",
+    )
+
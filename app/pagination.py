@@ -0,0 +1,114 @@
+import base64
+import binascii
+import json
+import zlib
+
+from search_results import search_args
+
+# Cursor-based pagination of /search: the first page (paginate=true) opens a point in time (PIT) of the index, a
+# snapshot the following pages search with search_after on the sort values of the last hit of the previous page,
+# the score and then _shard_doc, the tiebreaker of PITs. A page therefore only fetches its own hits, instead of
+# searching again for all hits up to the page. The cursor of a page is opaque to the client: it encodes the PIT, the
+# sort values and the request parameters, so the query is built the same way for every page. The grouped and hybrid
+# modes rank episodes or fused snippets and are not paginated.
+
+# How long the PIT is kept after a page, the time a client has to request the next page
+PIT_KEEP_ALIVE = "5m"
+# Ranking by score, ties broken by the position of the hit in its shard
+PAGE_SORT = ["_score", {"_shard_doc": "asc"}]
+# The request parameters of /search a cursor repeats for the following pages
+CURSOR_PARAMS = ("q", "length", "results", "openai", "highlight", "fragment_size", "fragments")
+
+
+class InvalidCursorError(ValueError):
+    """
+    A cursor could not be decoded.
+    """
+
+
+def pagination_supported(options):
+    return not options["grouped"] and not options["hybrid"]
+
+
+def encode_cursor(state):
+    data = zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(zlib.decompress(data))
+    except (binascii.Error, zlib.error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorError("invalid cursor")
+    if not isinstance(state, dict) or not isinstance(state.get("after"), list) or \
+            not isinstance(state.get("params"), dict) or "pit" not in state:
+        raise InvalidCursorError("invalid cursor")
+    return state
+
+
+# The request parameters of a page: those of the first request, or those encoded in the cursor
+def page_params(params):
+    cursor = params.get("cursor")
+    if cursor is None:
+        return params, None
+    page = decode_cursor(cursor)
+    return page["params"], page
+
+
+# Arguments of client.search for a page, the total is only counted on the first page
+def page_args(pit_id, nr_results, options, search_after=None):
+    args = dict(search_args(nr_results, **options), pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}, sort=PAGE_SORT)
+    if search_after is not None:
+        args.update(search_after=search_after, track_total_hits=False)
+    return args
+
+
+# The cursor of the page following a search result, None after the last page
+def next_cursor(search_result, params, nr_results):
+    hits = search_result["hits"]["hits"]
+    if len(hits) < int(nr_results):
+        return None
+    return encode_cursor({
+        "pit": search_result["pit_id"],
+        "after": hits[-1]["sort"],
+        "params": {name: params[name] for name in CURSOR_PARAMS if params.get(name) is not None},
+    })
+
+
+def search_page(client, index, query, nr_results, options, page=None):
+    """Searches a page of hits with a point in time.
+
+    Args:
+        client: The search client (Elasticsearch or LocalSearchClient).
+        index (str): The name of the index.
+        query (dict): The query.
+        nr_results (int): The number of hits per page.
+        options (dict): The options of the /search modes, see search_options.
+        page (dict): The decoded cursor of the page, None for the first page.
+
+    Returns:
+        dict: The search response, with the id of the PIT in "pit_id" and the sort values of every hit. The PIT is
+            closed after the last page.
+    """
+    if page is None:
+        pit_id = client.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+        search_result = client.search(query=query, **page_args(pit_id, nr_results, options))
+    else:
+        search_result = client.search(query=query, **page_args(page["pit"], nr_results, options, page["after"]))
+    if len(search_result["hits"]["hits"]) < int(nr_results):
+        client.close_point_in_time(id=search_result["pit_id"])
+    return search_result
+
+
+async def async_search_page(client, index, query, nr_results, options, page=None):
+    # search_page for the asyncio middle-ware
+    if page is None:
+        pit_id = (await client.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+        search_result = await client.search(query=query, **page_args(pit_id, nr_results, options))
+    else:
+        search_result = await client.search(query=query,
+                                            **page_args(page["pit"], nr_results, options, page["after"]))
+    if len(search_result["hits"]["hits"]) < int(nr_results):
+        await client.close_point_in_time(id=search_result["pit_id"])
+    return search_result
@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Normalize the parameters of a /search request into a cache key
+def normalize_cache_key(search_query, clip_length, nr_results, use_openai, mode=""):
+    query = re.sub(r"\s+", " ", (search_query or "").strip())
+    # Matching is case insensitive, but wildcard terms are not analyzed and the LLM may treat case differently
+    if use_openai != "true" and "*" not in query and "?" not in query:
+        query = query.lower()
+    return f"{query}\x1f{clip_length}\x1f{nr_results}\x1f{use_openai == 'true'}\x1f{mode}"
+
+
+class IndexGeneration:
+    """
+    Reads the generation file the indexer rewrites at the end of every run. Results cached for another generation
+    are outdated. The file is checked at most once per second.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.checked_at = 0
+        self.value = ""
+
+    def current(self):
+        now = time.monotonic()
+        if now - self.checked_at >= self.check_interval:
+            self.checked_at = now
+            try:
+                with open(self.path) as f:
+                    self.value = f.read().strip()
+            except FileNotFoundError:
+                self.value = ""
+        return self.value
+
+
+class ResultCache:
+    """
+    Base class of the /search result caches. Values are the serialized JSON responses.
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, value):
+        pass
+
+
+class InProcessResultCache(ResultCache):
+    """
+    LRU cache with a TTL in the memory of the worker, bounded by number of entries and total bytes.
+    """
+
+    def __init__(self, generation, ttl=300, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        super().__init__(generation)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.cached_generation = None
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self._check_generation()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if now - stored_at >= self.ttl:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            self._check_generation()
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic())
+            self.size += len(value)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        value, _ = self.entries.pop(key)
+        self.size -= len(value)
+
+    def _check_generation(self):
+        # Drop everything once the indexer finished a new run
+        generation = self.generation.current()
+        if generation != self.cached_generation:
+            self.entries.clear()
+            self.size = 0
+            self.cached_generation = generation
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(entries=len(self.entries), bytes=self.size)
+        return stats
+
+
+class RedisResultCache(ResultCache):
+    """
+    Cache shared by all workers in Redis. Entries expire after the TTL, the memory bound and LRU eviction are
+    configured on the Redis server (maxmemory and maxmemory-policy allkeys-lru). The index generation is part of the
+    key, so entries of older generations are never read again and expire.
+    """
+
+    def __init__(self, generation, url, ttl=300, prefix="podcast-search:"):
+        if redis is None:
+            raise ValueError("The redis result cache requires the redis package: pip install redis")
+        super().__init__(generation)
+        self.client = redis.Redis.from_url(url)
+        # Redis expires keys after whole seconds
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}{self.generation.current()}:{key}"
+
+    def _get(self, key):
+        return self.client.get(self._key(key))
+
+    def _set(self, key, value):
+        self.client.set(self._key(key), value, ex=self.ttl)
+
+
+# Create the result cache configured in the environment: RESULT_CACHE=memory (default), redis or off
+def create_result_cache():
+    generation = IndexGeneration(os.getenv("INDEX_GENERATION_FILE", "../data/index-generation"))
+    ttl = float(os.getenv("RESULT_CACHE_TTL", "300"))
+    backend = os.getenv("RESULT_CACHE", "memory")
+
+    if backend == "redis":
+        return RedisResultCache(generation, os.getenv("RESULT_CACHE_URL", "redis://localhost:6379/0"), ttl=ttl)
+    if backend == "off":
+        return ResultCache(generation)
+    return InProcessResultCache(
+        generation,
+        ttl=ttl,
+        max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000")),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    )
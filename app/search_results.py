@@ -0,0 +1,195 @@
+import os
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+from lexical_query import build_highlight, split_highlight
+from local_index import AsyncLocalSearchClient, LocalSearchClient
+from text_store import AsyncTextStoreClient, TextStoreClient
+
+# Fields of the snippets in the grouped and highlight modes, the transcript is replaced by highlight fragments
+SNIPPET_FIELDS = ["show_id", "episode_id", "start_time", "end_time"]
+
+# Fields returned by /snippet, the full transcript of a snippet from the highlight mode
+SNIPPET_TEXT_FIELDS = ["episode_id", "transcript_text", "start_time", "end_time"]
+
+
+# Connection arguments of the Elasticsearch clients, ELASTICSEARCH_URL (e.g. a local stand-in) replaces the cloud
+# Concurrent requests of a worker are limited by ELASTICSEARCH_CONNECTIONS pooled connections
+def elasticsearch_args():
+    connections = {"connections_per_node": int(os.getenv("ELASTICSEARCH_CONNECTIONS", "10"))}
+    url = os.getenv("ELASTICSEARCH_URL")
+    if url:
+        return dict(connections, hosts=url)
+    return dict(connections, cloud_id=os.getenv("CLOUD_ID"), api_key=os.getenv("API_KEY"))
+
+
+# The search backend: the local indices in LOCAL_INDEX_PATH (written by indexer.py --local-index) or Elasticsearch
+# With TEXT_STORE_PATH (written by indexer.py --text-store), the texts of the snippets are rebuilt from the text store
+def create_search_client():
+    path = os.getenv("LOCAL_INDEX_PATH")
+    client = LocalSearchClient(path) if path else Elasticsearch(**elasticsearch_args())
+    text_store_path = os.getenv("TEXT_STORE_PATH")
+    return TextStoreClient(client, text_store_path) if text_store_path else client
+
+
+def create_async_search_client():
+    path = os.getenv("LOCAL_INDEX_PATH")
+    client = AsyncLocalSearchClient(path) if path else AsyncElasticsearch(**elasticsearch_args())
+    text_store_path = os.getenv("TEXT_STORE_PATH")
+    return AsyncTextStoreClient(client, text_store_path) if text_store_path else client
+
+
+# The episode of a hit as returned by /search, without snippets
+def episode_entry(source, episode_info):
+    return {
+        "show_id": source["show_id"],
+        "episode_id": source["episode_id"],
+        "show_name": episode_info["show_name"],
+        "show_description": episode_info["show_description"],
+        "publisher": episode_info["publisher"],
+        "episode_name": episode_info["episode_name"],
+        "episode_description": episode_info["episode_description"],
+        "language": episode_info["language"],
+        "rss_link": episode_info["rss_link"],
+        "duration": episode_info["duration"],
+        "snippets": []
+    }
+
+
+class InvalidParameterError(ValueError):
+    """
+    A request parameter has an invalid value, the middle-wares answer with 400.
+    """
+
+
+# A positive integer request parameter, e.g. results
+def int_param(params, name, default):
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        raise InvalidParameterError(f"{name} must be an integer")
+    if value < 1:
+        raise InvalidParameterError(f"{name} must be positive")
+    return value
+
+
+# Options of the /search modes from the request parameters (request.args or query_params)
+# The hybrid mode ranks snippets, it cannot be grouped
+def search_options(params):
+    hybrid = params.get("hybrid") == "true"
+    return {
+        "grouped": params.get("group") == "true" and not hybrid,
+        "nr_snippets": int_param(params, "snippets", 3),
+        "highlight": params.get("highlight") == "true",
+        "fragment_size": int_param(params, "fragment_size", 150),
+        "nr_fragments": int_param(params, "fragments", 3),
+        "hybrid": hybrid,
+    }
+
+
+# The part of the result cache key for the options
+def options_key(options):
+    return ",".join(f"{name}={value}" for name, value in sorted(options.items()))
+
+
+# Arguments of client.search for the requested mode
+# The highlight mode returns only the matched fragments of each snippet, the full text is fetched from /snippet
+# The grouped mode collapses the hits on episode_id: the best nr_results episodes with their best nr_snippets
+# snippets each, always with highlight fragments
+# The hybrid mode sets its own sizes, see hybrid_search
+def search_args(nr_results, grouped=False, nr_snippets=3, highlight=False, fragment_size=150, nr_fragments=3,
+                hybrid=False, search_field="transcript_text"):
+    if grouped:
+        return {
+            "size": nr_results,
+            "source": ["show_id", "episode_id"],
+            "collapse": {
+                "field": "episode_id",
+                "inner_hits": {
+                    "name": "snippets",
+                    "size": nr_snippets,
+                    "_source": SNIPPET_FIELDS,
+                    "highlight": build_highlight(search_field, fragment_size, nr_fragments),
+                },
+            },
+            "aggs": {"episodes": {"cardinality": {"field": "episode_id"}}},
+        }
+    if highlight:
+        return {
+            "size": nr_results,
+            "source": SNIPPET_FIELDS,
+            "highlight": build_highlight(search_field, fragment_size, nr_fragments),
+        }
+    return {"size": nr_results}
+
+
+# A snippet of the /search response, with the whole transcript or the highlighted fragments and their match offsets
+def snippet_entry(hit, search_field="transcript_text"):
+    source = hit["_source"]
+    snippet = {"id": hit["_id"]}
+    if search_field in source:
+        snippet["transcript_text"] = source[search_field]
+    else:
+        snippet["transcript_text"], snippet["matches"] = split_highlight(hit.get("highlight", {}).get(search_field, []))
+    snippet.update(start_time=source["start_time"], end_time=source["end_time"], score=hit["_score"])
+    return snippet
+
+
+# The /snippet response body for a document from client.get
+def snippet_document(document):
+    return dict(document["_source"], id=document["_id"])
+
+
+# Map the collapsed hits of the grouped mode to episodes, in the same format as group_hits
+def group_collapsed_hits(hits, episode_metadata, search_field="transcript_text"):
+    episode_map = {}
+    episode_ids = []
+    for hit in hits:
+        episode_id = hit["_source"]["episode_id"]
+        if episode_id not in episode_metadata:
+            continue
+        episode_ids.append(episode_id)
+        episode = episode_map[episode_id] = episode_entry(hit["_source"], episode_metadata[episode_id])
+
+        for inner_hit in hit["inner_hits"]["snippets"]["hits"]["hits"]:
+            episode["snippets"].append(snippet_entry(inner_hit, search_field))
+    return episode_map, episode_ids
+
+
+# Map all hits from the same show and episode to the same dictionary
+# Returns the episode map and the ids of the episodes with metadata, in order of the hits
+def group_hits(hits, episode_metadata, search_field="transcript_text"):
+    episode_map = {}
+    episode_ids = []
+    for hit in hits:
+        episode_id = hit["_source"]["episode_id"]
+        if episode_id in episode_metadata:
+            episode_ids.append(episode_id)
+
+            if episode_id not in episode_map:
+                episode_map[episode_id] = episode_entry(hit["_source"], episode_metadata[episode_id])
+
+            episode_map[episode_id]["snippets"].append(snippet_entry(hit, search_field))
+    return episode_map, episode_ids
+
+
+# Add the Spotify information (picture uri, release date, duration) to the grouped episodes
+def add_spotify_info(episode_map, spotify_episodes):
+    for episode_id, spotify_info in spotify_episodes.items():
+        if spotify_info is not None and episode_id in episode_map:
+            episode_map[episode_id].update(spotify_info)
+
+
+# Map the hits of any mode to episodes
+def group_search_hits(hits, episode_metadata, options):
+    if options["grouped"]:
+        return group_collapsed_hits(hits, episode_metadata)
+    return group_hits(hits, episode_metadata)
+
+
+# The /search response body, the grouped mode adds the (approximate) number of matching episodes
+def format_results(episode_map, search_result=None):
+    results = {"episodes": list(episode_map.values())}
+    if search_result is not None and "aggregations" in search_result:
+        results["total_episodes"] = search_result["aggregations"]["episodes"]["value"]
+    return results
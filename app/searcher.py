@@ -1,156 +1,236 @@
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import NotFoundError
 from dotenv import load_dotenv
 import os
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, stream_with_context
 from flask_cors import CORS, cross_origin
-import requests
 import json
 
-from chain import chain
-from lexical_query import build_es_query
+from batch_search import BatchSearch, ndjson, parse_batch_queries
+from chain import cached_chain
+from hybrid_search import hybrid_search
+from lexical_query import build_es_query, plan_es_query
+from local_index import LocalNotFoundError
+from metadata_store import open_metadata
+from metrics import create_search_metrics, METRICS_CONTENT_TYPE, RequestTimer
+from pagination import InvalidCursorError, next_cursor, page_params, pagination_supported, search_page
+from result_cache import create_result_cache, normalize_cache_key
+from search_results import (add_spotify_info, create_search_client, format_results, group_search_hits, int_param,
+                            InvalidParameterError, options_key, search_args, search_options, snippet_document,
+                            SNIPPET_TEXT_FIELDS)
+from spotify import SpotifyClient
+from stitching import create_clip_stitcher, snippet_source
+from term_dictionary import TermDictionaries
+from vector_index import VectorIndices
 
 app = Flask(__name__)
 
 load_dotenv()
 
-CLOUD_ID = os.getenv("CLOUD_ID")
-API_KEY = os.getenv("API_KEY")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
 index_prefix = "podcast_"
 
-client = Elasticsearch(
-    cloud_id=CLOUD_ID,
-    api_key=API_KEY
-)
+client = create_search_client()
 
 index_name = "podcast_30"
 
-# Get Token for Spotify API (valid for 1h)
-response = requests.post("https://accounts.spotify.com/api/token",
-                         data={"grant_type": "client_credentials", "client_id": SPOTIFY_CLIENT_ID,
-                               "client_secret": SPOTIFY_CLIENT_SECRET})
-if response.status_code == 404:
-    print("Could not get spotify access token.")
-    print(response.text)
-    exit()
-
-SPOTIFY_ACCESS_TOKEN = response.json()["access_token"]
-
-
-# Read metadata.tsv file
-# Returns map of episode_filename_prefix to metadata
-def read_metadata():
-    metadata = {}
-    with open("../data/metadata.tsv", "r") as file:
-        lines = file.readlines()
-        for line in lines:
-            episode_info = line.strip().split("\t")
-            episode_filename_prefix = episode_info[-1]
-            metadata[episode_filename_prefix] = {
-                "show_name": episode_info[1],
-                "show_description": episode_info[2],
-                "publisher": episode_info[3],
-                "language": episode_info[4],
-                "rss_link": episode_info[5],
-                "episode_uri": episode_info[6],
-                "episode_name": episode_info[7],
-                "episode_description": episode_info[8],
-                "duration": episode_info[9],
-            }
-    return metadata
-
-
-metadata = read_metadata()
+# Spotify API client, the token is requested on first use and refreshed when it expires (valid for 1h)
+spotify = SpotifyClient(
+    SPOTIFY_CLIENT_ID,
+    SPOTIFY_CLIENT_SECRET,
+    cache_path=os.getenv("SPOTIFY_CACHE_PATH", "../data/spotify-cache.sqlite"),
+    api_url=os.getenv("SPOTIFY_API_URL", "https://api.spotify.com"),
+    accounts_url=os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com"),
+)
+
+
+# Episode metadata, from the SQLite store if it was built with metadata_store.py
+metadata = open_metadata()
+
+# Term dictionaries written by the indexer, wildcards are expanded with them before the query is sent
+term_dictionaries = TermDictionaries(os.getenv("TERM_DICTIONARY_PATH", "../data/term-dictionary"))
+
+# Vector indices of the snippet embeddings written by the indexer, for the hybrid mode
+vector_indices = VectorIndices(os.getenv("VECTOR_INDEX_PATH", "../data/vector-index"))
+
+# Clips longer than the base segments are stitched from them at query time, if STITCH_BASE_INDEX is set
+clip_stitcher = create_clip_stitcher()
+
+# Batches of queries searched with _msearch, BATCH_CHUNK_SIZE queries per request and BATCH_CONCURRENCY in flight
+batch = BatchSearch(client, metadata, spotify, term_dictionaries, index_prefix, clip_stitcher,
+                    chunk_size=int(os.getenv("BATCH_CHUNK_SIZE", "100")),
+                    concurrency=int(os.getenv("BATCH_CONCURRENCY", "4")))
+
+# Cache of complete /search responses, invalidated when the indexer finishes a run
+result_cache = create_result_cache()
+
+# Latency histograms per stage of /search (served at /metrics), Server-Timing headers and the slow query log
+search_metrics = create_search_metrics()
+
+
+# The index searched for a clip length, the index of the base segments when clips are stitched
+def search_index(clip_length):
+    if clip_stitcher is not None:
+        return clip_stitcher.base_index
+    return index_prefix + clip_length
+
+
+# Adds the Server-Timing header with the stage timings of the request, if enabled
+def add_server_timing(response, timer):
+    if search_metrics.server_timing:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
 
 
 @app.route('/search')
 @cross_origin(origin='*')
 def search():
-    search_query = request.args.get('q')
-    clip_length = request.args.get('length')
-    nr_results = request.args.get('results')
-    use_openai = request.args.get('openai')
+    timer = RequestTimer()
+    # The following pages of a paginated search repeat the parameters of the first page from the cursor
+    # Highlight, grouped (results is then the number of episodes) and hybrid modes, see search_options
+    try:
+        params, page = page_params(request.args)
+        nr_results = int_param(params, 'results', 10)
+        options = search_options(params)
+    except (InvalidCursorError, InvalidParameterError) as error:
+        return jsonify({"error": str(error)}), 400
+    search_query = params.get('q')
+    clip_length = params.get('length')
+    use_openai = params.get('openai')
     # print(use_openai)
+    index = search_index(clip_length)
+    stitched = clip_stitcher is not None and clip_stitcher.stitches(clip_length)
+    # Pages hold a point in time of the index, they are not cached. Stitched clips are not paginated.
+    paginate = page is not None or (params.get('paginate') == "true" and pagination_supported(options)
+                                    and not stitched)
+
+    cache_key = normalize_cache_key(search_query, clip_length, nr_results, use_openai,
+                                    options_key(options))
+    cached_response = None
+    if not paginate:
+        with timer.span("cache"):
+            cached_response = result_cache.get(cache_key)
+    if cached_response is not None:
+        search_metrics.record(timer, True, index, search_query=search_query)
+        return add_server_timing(app.response_class(cached_response, mimetype="application/json"), timer)
 
     if use_openai == "true":
         print("Using OpenAI")
-        invoke = chain.invoke({"input": search_query})
+        with timer.span("llm"):
+            invoke = cached_chain.invoke({"input": search_query})
         print(invoke)
-
-        search_result = client.search(index=index_prefix + clip_length, query=invoke["query"], size=nr_results)
+        query = invoke["query"]
     else:
         print("Not using OpenAI")
-        query_body = build_es_query(search_query, "transcript_text")
+        with timer.span("query"):
+            query_body = build_es_query(search_query, "transcript_text", term_dictionaries.get(index))
         print(query_body)
         print(nr_results)
-        search_result = client.search(index=index_prefix + clip_length, body=query_body, size=nr_results)
+        query = query_body["query"]
+    search_body = dict(search_args(nr_results, **options), query=query)
+
+    # The hybrid mode fuses the lexical hits with the nearest snippets of the vector index, if the indexer wrote one
+    with timer.span("search"):
+        vector_index = vector_indices.get(index) if options["hybrid"] and not stitched else None
+        if stitched:
+            search_result = clip_stitcher.search(client, query, clip_length, nr_results, options)
+        elif vector_index is not None:
+            search_result = hybrid_search(client, vector_index, index, query, search_query, nr_results, options)
+        elif paginate:
+            try:
+                search_result = search_page(client, index, query, nr_results, options, page)
+            except (NotFoundError, LocalNotFoundError):
+                if page is None:
+                    raise
+                return jsonify({"error": "the cursor expired, search again"}), 410
+        else:
+            search_result = client.search(index=index, **search_body)
 
     # search_result = client.search(index=index_prefix + clip_length, query={"match": {"transcript_text":
     # search_query}}, _source={"includes": ["show_id", "episode_id", "transcript_text", "start_time", "end_time"]},
     # size=10)
     hits = search_result["hits"]["hits"]
 
-    # Map all hits from the same show and episode to the same dictionary
-    episode_map = {}
-    episode_ids = []
-    for hit in hits:
-        episode_id = hit["_source"]["episode_id"]
-        if episode_id in metadata:
-            episode_ids.append(episode_id)
-
-            if episode_id not in episode_map:
-                episode_map[episode_id] = {
-                    "show_id": hit["_source"]["show_id"],
-                    "episode_id": episode_id,
-                    "show_name": metadata[episode_id]["show_name"],
-                    "show_description": metadata[episode_id]["show_description"],
-                    "publisher": metadata[episode_id]["publisher"],
-                    "episode_name": metadata[episode_id]["episode_name"],
-                    "episode_description": metadata[episode_id]["episode_description"],
-                    "language": metadata[episode_id]["language"],
-                    "rss_link": metadata[episode_id]["rss_link"],
-                    "duration": metadata[episode_id]["duration"],
-                    "snippets": []
-                }
-
-            snippet = {
-                "transcript_text": hit["_source"]["transcript_text"],
-                "start_time": hit["_source"]["start_time"],
-                "end_time": hit["_source"]["end_time"],
-                "score": hit["_score"],
-            }
-            episode_map[episode_id]["snippets"].append(snippet)
-
-    # Get Spotify episodes for each episode_id (get picture uri)
-    if len(episode_ids) > 0:
-        episodes_response = requests.get("https://api.spotify.com/v1/episodes?market=SE&ids=" + ",".join(episode_ids),
-                                         headers={"Authorization": "Bearer " + SPOTIFY_ACCESS_TOKEN})
-        if episodes_response.status_code == 404:
-            print("Could not get spotify episodes.")
-            print(episodes_response.text)
-            exit()
-
-        episodes = episodes_response.json()["episodes"]
-        for episode in episodes:
-            if episode is None:
-                continue
-
-            episode_id = episode["id"]
-            if episode_id in episode_map:
-                episode_map[episode_id]["picture_uri"] = episode["images"][1]["url"]
-                episode_map[episode_id]["release_date"] = episode["release_date"]
-                episode_map[episode_id]["duration_ms"] = episode["duration_ms"]
-
-    formatted_results = {"episodes": []}
-    for episode_id, episode in episode_map.items():
-        formatted_results["episodes"].append(episode)
-
-    response = jsonify(formatted_results)
+    # Look up the metadata of all hit episodes at once
+    with timer.span("metadata"):
+        episode_metadata = metadata.get_many(hit["_source"]["episode_id"] for hit in hits)
+
+    with timer.span("group"):
+        episode_map, episode_ids = group_search_hits(hits, episode_metadata, options)
+
+    # Get Spotify episodes for each episode_id (get picture uri), only episodes that are not cached are requested
+    with timer.span("spotify"):
+        add_spotify_info(episode_map, spotify.get_episodes(episode_ids))
+
+    with timer.span("serialize"):
+        formatted_results = format_results(episode_map, search_result)
+        if paginate:
+            formatted_results["next_cursor"] = next_cursor(search_result, params, nr_results)
+        response = jsonify(formatted_results)
+    if not paginate:
+        with timer.span("cache"):
+            result_cache.set(cache_key, response.get_data())
+    search_metrics.record(timer, False, index, search_body, search_result, search_query)
     # response.headers.add("Access-Control-Allow-Origin", "*")
     # response.headers.add("Access-Control-Allow-Headers", "Origin, X-Requested-With, Content-Type, Accept")
-    return response
+    return add_server_timing(response, timer)
+
+
+# Searches the queries in the body (one per line, or JSON objects with q, id, length and results) and streams the
+# results as NDJSON, one line per query in their order. The parameters of /search apply to all queries, spotify=false
+# leaves out the Spotify information.
+@app.route('/search/batch', methods=['POST'])
+@cross_origin(origin='*')
+def search_batch():
+    try:
+        nr_results = int_param(request.args, 'results', 10)
+        options = search_options(request.args)
+    except InvalidParameterError as error:
+        return jsonify({"error": str(error)}), 400
+    queries = parse_batch_queries(request.get_data(as_text=True).splitlines(), request.args.get('length'), nr_results)
+    lines = batch.run(queries, options, request.args.get('spotify') != "false")
+    return app.response_class(stream_with_context(ndjson(lines)), mimetype="application/x-ndjson")
+
+
+# The lexical query /search sends for q, with the plan of the query planner
+@app.route('/explain')
+@cross_origin(origin='*')
+def explain():
+    clip_length = request.args.get('length')
+    query_body, plan = plan_es_query(request.args.get('q'), "transcript_text",
+                                     term_dictionaries.get(search_index(clip_length)))
+    return jsonify(query=query_body["query"], plan=plan)
+
+
+# Full transcript of one snippet, e.g. of a snippet returned in the highlight mode
+# A stitched clip is merged from its base segments again
+@app.route('/snippet/<clip_length>/<snippet_id>')
+@cross_origin(origin='*')
+def snippet(clip_length, snippet_id):
+    if clip_stitcher is not None and clip_stitcher.stitches(clip_length):
+        snippet_query = clip_stitcher.snippet_query(snippet_id)
+        document = snippet_source(client.search(**snippet_query)) if snippet_query is not None else None
+        if document is None:
+            return jsonify({"error": "snippet not found"}), 404
+        return jsonify(dict(document, id=snippet_id))
+    try:
+        document = client.get(index=search_index(clip_length), id=snippet_id, source=SNIPPET_TEXT_FIELDS)
+    except (NotFoundError, LocalNotFoundError):
+        return jsonify({"error": "snippet not found"}), 404
+    return jsonify(snippet_document(document))
+
+
+@app.route('/cache/stats')
+@cross_origin(origin='*')
+def cache_stats():
+    return jsonify(dict(result_cache.stats(), llm=cached_chain.stats()))
+
+
+# Latency histograms of /search in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    return app.response_class(search_metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == '__main__':
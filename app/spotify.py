@@ -0,0 +1,256 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# The Spotify API returns at most 50 episodes per request
+MAX_IDS_PER_REQUEST = 50
+
+
+class SpotifyClient:
+    """
+    Fetches the episode information shown in the UI (picture, release date, duration) from the Spotify Web API.
+    Results are cached in memory (LRU with TTL) and on disk, so that only episodes that were not seen recently are
+    requested. The access token is requested on first use and refreshed before it expires.
+    """
+
+    def __init__(self, client_id, client_secret, cache_path=None, ttl=7 * 24 * 3600, max_entries=10000, market="SE",
+                 api_url="https://api.spotify.com", accounts_url="https://accounts.spotify.com"):
+        """Initializes a SpotifyClient instance.
+
+        Args:
+            client_id (str): The client id of the Spotify application.
+            client_secret (str): The client secret of the Spotify application.
+            cache_path (str): The path of a SQLite file to persist the cache in, None to cache in memory only.
+            ttl (float): Seconds an episode is cached before it is requested again.
+            max_entries (int): The maximum number of episodes kept in memory.
+            market (str): The market of the episodes.
+            api_url (str): The base URL of the Web API, e.g. a local fake for tests.
+            accounts_url (str): The base URL of the accounts service that issues access tokens.
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.market = market
+        self.api_url = api_url.rstrip("/")
+        self.accounts_url = accounts_url.rstrip("/")
+
+        # One pooled session for all requests, shared by the worker threads
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+        self.lock = threading.Lock()
+        self.token_lock = threading.Lock()
+        self.access_token = None
+        self.token_expires_at = 0
+        self.memory_cache = OrderedDict()
+        self.requests_sent = 0
+
+        self.disk_cache = None
+        if cache_path is not None:
+            self.disk_cache = sqlite3.connect(cache_path, check_same_thread=False)
+            self.disk_cache.execute(
+                "CREATE TABLE IF NOT EXISTS episodes (episode_id TEXT PRIMARY KEY, info TEXT, fetched_at REAL)"
+            )
+
+    def get_token(self, refresh=False):
+        """Returns a valid access token, requesting a new one if there is none or it expires within a minute.
+
+        Args:
+            refresh (bool): Request a new token even if the current one did not expire, e.g. after a 401.
+
+        Returns:
+            str: The access token, None if it could not be requested.
+        """
+        with self.token_lock:
+            if not refresh and self._token_valid():
+                return self.access_token
+
+            response = self.session.post(self.accounts_url + "/api/token", data=self._token_request())
+            self.requests_sent += 1
+            return self._store_token(response)
+
+    def _token_valid(self):
+        return self.access_token is not None and time.time() < self.token_expires_at - 60
+
+    def _token_request(self):
+        return {"grant_type": "client_credentials", "client_id": self.client_id, "client_secret": self.client_secret}
+
+    def _store_token(self, response):
+        if response.status_code != 200:
+            print("Could not get spotify access token.")
+            print(response.text)
+            return None
+
+        token = response.json()
+        self.access_token = token["access_token"]
+        self.token_expires_at = time.time() + token.get("expires_in", 3600)
+        return self.access_token
+
+    def get_episodes(self, episode_ids):
+        """Returns the Spotify information of episodes, requesting only those that are not cached.
+
+        Args:
+            episode_ids (iterable): The Spotify episode ids.
+
+        Returns:
+            dict: Map of episode id to a dictionary with picture_uri, release_date and duration_ms. Episodes that
+                Spotify does not know map to None.
+        """
+        episodes, missing = self._lookup_cached(episode_ids)
+        for start in range(0, len(missing), MAX_IDS_PER_REQUEST):
+            fetched = self._fetch(missing[start:start + MAX_IDS_PER_REQUEST])
+            self._put_cached(fetched)
+            episodes.update(fetched)
+        return episodes
+
+    def _lookup_cached(self, episode_ids):
+        # Returns the cached episodes and the ids that have to be requested
+        episodes = {}
+        missing = []
+        for episode_id in dict.fromkeys(episode_ids):
+            cached = self._get_cached(episode_id)
+            if cached is not None:
+                episodes[episode_id] = cached[0]
+            else:
+                missing.append(episode_id)
+        return episodes, missing
+
+    def _fetch(self, episode_ids):
+        # Request one chunk of at most 50 episodes, retrying once with a new token if the token was rejected
+        token = self.get_token()
+        for attempt in range(2):
+            if token is None:
+                return {}
+            response = self.session.get(self.api_url + "/v1/episodes",
+                                        params={"market": self.market, "ids": ",".join(episode_ids)},
+                                        headers={"Authorization": "Bearer " + token})
+            self.requests_sent += 1
+            if response.status_code == 401 and attempt == 0:
+                token = self.get_token(refresh=True)
+                continue
+            break
+        return self._parse_episodes(episode_ids, response)
+
+    @staticmethod
+    def _parse_episodes(episode_ids, response):
+        if response.status_code != 200:
+            print("Could not get spotify episodes.")
+            print(response.text)
+            return {}
+
+        fetched = {episode_id: None for episode_id in episode_ids}
+        for episode in response.json()["episodes"]:
+            if episode is None:
+                continue
+            fetched[episode["id"]] = {
+                "picture_uri": episode["images"][1]["url"],
+                "release_date": episode["release_date"],
+                "duration_ms": episode["duration_ms"],
+            }
+        return fetched
+
+    def _get_cached(self, episode_id):
+        # Returns a 1-tuple with the cached information (which may be None), or None if the episode is not cached
+        now = time.time()
+        with self.lock:
+            entry = self.memory_cache.get(episode_id)
+            if entry is not None:
+                info, fetched_at = entry
+                if now - fetched_at < self.ttl:
+                    self.memory_cache.move_to_end(episode_id)
+                    return (info,)
+                del self.memory_cache[episode_id]
+
+            if self.disk_cache is None:
+                return None
+            row = self.disk_cache.execute(
+                "SELECT info, fetched_at FROM episodes WHERE episode_id = ?", (episode_id,)
+            ).fetchone()
+        if row is None or now - row[1] >= self.ttl:
+            return None
+
+        info = json.loads(row[0])
+        self._remember(episode_id, info, row[1])
+        return (info,)
+
+    def _put_cached(self, fetched):
+        fetched_at = time.time()
+        for episode_id, info in fetched.items():
+            self._remember(episode_id, info, fetched_at)
+        if self.disk_cache is not None and len(fetched) > 0:
+            with self.lock:
+                self.disk_cache.executemany("INSERT OR REPLACE INTO episodes VALUES (?, ?, ?)",
+                                            [(episode_id, json.dumps(info), fetched_at)
+                                             for episode_id, info in fetched.items()])
+                self.disk_cache.commit()
+
+    def _remember(self, episode_id, info, fetched_at):
+        with self.lock:
+            self.memory_cache[episode_id] = (info, fetched_at)
+            self.memory_cache.move_to_end(episode_id)
+            while len(self.memory_cache) > self.max_entries:
+                self.memory_cache.popitem(last=False)
+
+
+class AsyncSpotifyClient(SpotifyClient):
+    """
+    SpotifyClient for the asyncio middle-ware. It shares the caches of SpotifyClient, but sends the requests with a
+    pooled httpx.AsyncClient and fetches the chunks of one lookup concurrently.
+    """
+
+    def __init__(self, client_id, client_secret, max_connections=64, **kwargs):
+        if httpx is None:
+            raise ValueError("The async Spotify client requires the httpx package: pip install httpx")
+        super().__init__(client_id, client_secret, **kwargs)
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections),
+                                        timeout=10)
+        self.async_token_lock = asyncio.Lock()
+
+    async def get_token(self, refresh=False):
+        async with self.async_token_lock:
+            if not refresh and self._token_valid():
+                return self.access_token
+
+            response = await self.client.post(self.accounts_url + "/api/token", data=self._token_request())
+            self.requests_sent += 1
+            return self._store_token(response)
+
+    async def get_episodes(self, episode_ids):
+        episodes, missing = self._lookup_cached(episode_ids)
+        chunks = [missing[start:start + MAX_IDS_PER_REQUEST] for start in range(0, len(missing), MAX_IDS_PER_REQUEST)]
+        for fetched in await asyncio.gather(*(self._fetch(chunk) for chunk in chunks)):
+            self._put_cached(fetched)
+            episodes.update(fetched)
+        return episodes
+
+    async def _fetch(self, episode_ids):
+        token = await self.get_token()
+        for attempt in range(2):
+            if token is None:
+                return {}
+            response = await self.client.get(self.api_url + "/v1/episodes",
+                                             params={"market": self.market, "ids": ",".join(episode_ids)},
+                                             headers={"Authorization": "Bearer " + token})
+            self.requests_sent += 1
+            if response.status_code == 401 and attempt == 0:
+                token = await self.get_token(refresh=True)
+                continue
+            break
+        return self._parse_episodes(episode_ids, response)
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,234 @@
+import os
+from collections import namedtuple
+
+from clip_ids import clip_id, parse_clip_id, segment_id
+from search_results import search_args
+
+# Clips stitched at query time: instead of one index per clip length, only short base segments (e.g. 30 s, without
+# overlap) are indexed with their position in the episode (ordinal). A search for longer clips fetches the best base
+# segments, scores every window of consecutive segments of an episode by the sum of the scores of its segments, and
+# takes the best windows that do not overlap. The segments of the chosen windows are then fetched by their ids
+# (<episode id>-<ordinal>) and merged into one clip each.
+
+# A window of consecutive base segments [first, last] of an episode, the score is the sum of its segment scores
+Clip = namedtuple("Clip", ["show_id", "episode_id", "first", "last", "score"])
+
+# The base segments scored to find the windows, at least
+STITCH_CANDIDATES = 200
+
+
+def rank_windows(hits, segments_per_clip):
+    """Scores the windows of segments_per_clip consecutive segments around the hits and picks the best ones that do not
+    overlap, like the clips of an index without overlap. Of windows with the same score, the one with its hits
+    closest to its middle wins.
+
+    Args:
+        hits (list): The hits of the base segments, with show_id, episode_id and ordinal in their _source.
+        segments_per_clip (int): The number of base segments of a clip.
+
+    Returns:
+        list: The Clip of every chosen window, best first.
+    """
+    episodes = {}
+    for hit in hits:
+        source = hit["_source"]
+        episode = episodes.setdefault(source["episode_id"], (source["show_id"], {}))
+        episode[1][source["ordinal"]] = hit["_score"]
+
+    windows = []
+    for episode_id, (show_id, scores) in episodes.items():
+        starts = {start for ordinal in scores for start in range(max(0, ordinal - segments_per_clip + 1), ordinal + 1)}
+        for start in starts:
+            last = start + segments_per_clip - 1
+            inside = [ordinal for ordinal in scores if start <= ordinal <= last]
+            score = sum(scores[ordinal] for ordinal in inside)
+            offset = abs(sum(inside) / len(inside) - (start + last) / 2)
+            windows.append((-score, offset, episode_id, start, Clip(show_id, episode_id, start, last, score)))
+    windows.sort(key=lambda window: window[:4])
+
+    chosen = []
+    taken = {}
+    for *_, clip in windows:
+        spans = taken.setdefault(clip.episode_id, [])
+        if any(clip.first <= last and first <= clip.last for first, last in spans):
+            continue
+        spans.append((clip.first, clip.last))
+        chosen.append(clip)
+    return chosen
+
+
+def select_clips(clips, nr_results, options):
+    # The best nr_results clips, in the grouped mode the clips of the best nr_results episodes (nr_snippets each)
+    if not options["grouped"]:
+        return clips[:nr_results]
+    episodes = {}
+    for clip in clips:
+        if clip.episode_id not in episodes and len(episodes) == nr_results:
+            continue
+        episode_clips = episodes.setdefault(clip.episode_id, [])
+        if len(episode_clips) < options["nr_snippets"]:
+            episode_clips.append(clip)
+    return [clip for episode_clips in episodes.values() for clip in episode_clips]
+
+
+def segment_ids(clips):
+    return [segment_id(clip.episode_id, ordinal) for clip in clips for ordinal in range(clip.first, clip.last + 1)]
+
+
+def candidate_args(nr_results, segments_per_clip, options):
+    # Arguments of the search for the base segments, enough to fill every clip with hits
+    size = nr_results * segments_per_clip * (options["nr_snippets"] if options["grouped"] else 1)
+    return {"size": max(STITCH_CANDIDATES, size), "source": ["show_id", "episode_id", "ordinal"]}
+
+
+def fetch_args(ids, query, options):
+    # Arguments of the search fetching the segments of the chosen clips, with highlights of the query
+    highlight = options["highlight"] or options["grouped"]
+    return dict(search_args(len(ids), highlight=highlight, fragment_size=options["fragment_size"],
+                            nr_fragments=options["nr_fragments"]),
+                query={"bool": {"filter": [{"ids": {"values": ids}}], "should": [query]}})
+
+
+def merge_segments(clip, segments, nr_fragments):
+    """Merges the fetched base segments of a clip into one hit.
+
+    Args:
+        clip (Clip): The clip.
+        segments (dict): The hits of the fetched segments by id.
+        nr_fragments (int): The maximum number of highlight fragments of the clip.
+
+    Returns:
+        dict: The hit of the clip like a hit of a clip index, None if none of its segments exists anymore.
+    """
+    parts = [segments[doc_id] for doc_id in segment_ids([clip]) if doc_id in segments]
+    if not parts:
+        return None
+    source = {
+        "show_id": clip.show_id,
+        "episode_id": clip.episode_id,
+        "start_time": parts[0]["_source"]["start_time"],
+        "end_time": parts[-1]["_source"]["end_time"],
+    }
+    hit = {"_id": clip_id(clip), "_score": clip.score, "_source": source}
+    if "transcript_text" in parts[0]["_source"]:
+        source["transcript_text"] = "".join(part["_source"]["transcript_text"] for part in parts)
+    else:
+        # The fragments of the best matching segments, the segments without a match only have their beginning
+        matched = sorted((part for part in parts if part["_score"]), key=lambda part: -part["_score"]) or parts[:1]
+        fragments = [fragment for part in matched for fragment in part.get("highlight", {}).get("transcript_text", [])]
+        hit["highlight"] = {"transcript_text": fragments[:nr_fragments]}
+    return hit
+
+
+def stitch_hits(clips, fetched, options):
+    # The hits of the chosen clips, in the grouped mode collapsed on the episode with the clips as inner hits
+    segments = {hit["_id"]: hit for hit in fetched["hits"]["hits"]}
+    hits = [hit for hit in (merge_segments(clip, segments, options["nr_fragments"]) for clip in clips)
+            if hit is not None]
+    if not options["grouped"]:
+        return hits
+    episodes = {}
+    for hit in hits:
+        episode_id = hit["_source"]["episode_id"]
+        if episode_id not in episodes:
+            episodes[episode_id] = {
+                "_id": hit["_id"],
+                "_score": hit["_score"],
+                "_source": {"show_id": hit["_source"]["show_id"], "episode_id": episode_id},
+                "inner_hits": {"snippets": {"hits": {"hits": []}}},
+            }
+        episodes[episode_id]["inner_hits"]["snippets"]["hits"]["hits"].append(hit)
+    return list(episodes.values())
+
+
+def stitched_result(candidates, clips, fetched, options):
+    # A search response with the stitched hits, took is the time of both searches
+    took = candidates.get("took", 0) + (fetched.get("took", 0) if fetched is not None else 0)
+    hits = stitch_hits(clips, fetched, options) if fetched is not None else []
+    return {"took": took, "hits": {"total": candidates["hits"].get("total"), "hits": hits}}
+
+
+def snippet_source(segments):
+    # The /snippet document of a clip from its fetched segments, None if none of them exists
+    parts = sorted(segments["hits"]["hits"], key=lambda part: part["_source"]["ordinal"])
+    if not parts:
+        return None
+    return {
+        "episode_id": parts[0]["_source"]["episode_id"],
+        "transcript_text": "".join(part["_source"]["transcript_text"] for part in parts),
+        "start_time": parts[0]["_source"]["start_time"],
+        "end_time": parts[-1]["_source"]["end_time"],
+    }
+
+
+class ClipStitcher:
+    """
+    Serves the clip lengths of /search from one index of base segments written by indexer.py --base-target.
+    """
+
+    def __init__(self, base_index, base_seconds=30):
+        """Initializes a ClipStitcher instance.
+
+        Args:
+            base_index (str): The index of the base segments, with their ordinal in the episode.
+            base_seconds (int): The length in seconds of the base segments.
+        """
+        self.base_index = base_index
+        self.base_seconds = base_seconds
+
+    def stitches(self, clip_length):
+        return int(clip_length) > self.base_seconds
+
+    def segments_per_clip(self, clip_length):
+        return max(1, round(int(clip_length) / self.base_seconds))
+
+    def search(self, client, query, clip_length, nr_results, options):
+        """Searches clips of a length by stitching base segments.
+
+        Args:
+            client: The search client (Elasticsearch or LocalSearchClient).
+            query (dict): The query.
+            clip_length (str): The length of the clips in seconds.
+            nr_results (int): The number of clips (of episodes in the grouped mode).
+            options (dict): The options of the /search modes, see search_options.
+
+        Returns:
+            dict: A search response with one hit per clip, like the search of an index of that clip length.
+        """
+        segments_per_clip = self.segments_per_clip(clip_length)
+        candidates = client.search(index=self.base_index, query=query,
+                                   **candidate_args(int(nr_results), segments_per_clip, options))
+        clips = select_clips(rank_windows(candidates["hits"]["hits"], segments_per_clip), int(nr_results), options)
+        fetched = None
+        if clips:
+            fetched = client.search(index=self.base_index, **fetch_args(segment_ids(clips), query, options))
+        return stitched_result(candidates, clips, fetched, options)
+
+    async def async_search(self, client, query, clip_length, nr_results, options):
+        # search for the asyncio middle-ware
+        segments_per_clip = self.segments_per_clip(clip_length)
+        candidates = await client.search(index=self.base_index, query=query,
+                                         **candidate_args(int(nr_results), segments_per_clip, options))
+        clips = select_clips(rank_windows(candidates["hits"]["hits"], segments_per_clip), int(nr_results), options)
+        fetched = None
+        if clips:
+            fetched = await client.search(index=self.base_index, **fetch_args(segment_ids(clips), query, options))
+        return stitched_result(candidates, clips, fetched, options)
+
+    def snippet_query(self, snippet_id):
+        # The search for the segments of a clip id, None if it is not a clip id
+        parsed = parse_clip_id(snippet_id)
+        if parsed is None:
+            return None
+        episode_id, first, last = parsed
+        ids = [segment_id(episode_id, ordinal) for ordinal in range(first, last + 1)]
+        return {"index": self.base_index, "query": {"ids": {"values": ids}}, "size": len(ids),
+                "source": ["episode_id", "transcript_text", "start_time", "end_time", "ordinal"]}
+
+
+# Stitching of the clip lengths from the base segments in STITCH_BASE_INDEX (STITCH_BASE_SECONDS long), None if unset
+def create_clip_stitcher():
+    base_index = os.getenv("STITCH_BASE_INDEX")
+    if not base_index:
+        return None
+    return ClipStitcher(base_index, int(os.getenv("STITCH_BASE_SECONDS", "30")))
@@ -0,0 +1,172 @@
+import bisect
+import os
+import re
+import threading
+from fnmatch import fnmatchcase
+
+# The term dictionary of an index: its sorted terms with their document frequencies, written by the indexer to
+# <folder>/<index name>.tsv. Wildcard patterns are expanded with it before a query is sent, so Elasticsearch does not
+# have to enumerate its own term dictionary, which leading wildcards (*earth) visit completely.
+
+WILDCARD_PATTERN = re.compile(r"[*?]")
+
+
+def _prefix_range(sorted_terms, prefix):
+    # The range of the terms starting with prefix
+    start = bisect.bisect_left(sorted_terms, prefix)
+    end = bisect.bisect_left(sorted_terms, prefix + "\U0010ffff") if prefix else len(sorted_terms)
+    return start, end
+
+
+class TermDictionary:
+    """
+    Sorted terms with their document frequencies. Patterns with a literal prefix are matched in the prefix range of
+    the terms, patterns with a leading wildcard in the suffix range of the reversed terms, so only patterns without
+    a literal prefix or suffix (*ea*) compare every term.
+    """
+
+    def __init__(self, terms, document_frequencies, nr_documents=None):
+        """Initializes a TermDictionary instance.
+
+        Args:
+            terms (list): The sorted terms.
+            document_frequencies (sequence): The number of documents containing every term.
+            nr_documents (int): The number of documents of the index, if known.
+        """
+        self.terms = terms
+        self.document_frequencies = document_frequencies
+        self.nr_documents = nr_documents
+        self.lock = threading.Lock()
+        self.reversed_terms = None
+        self.reversed_ordinals = None
+
+    @classmethod
+    def load(cls, path):
+        terms = []
+        document_frequencies = []
+        nr_documents = None
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                term, _, value = line.rstrip("\n").partition("\t")
+                if term == "#documents":
+                    nr_documents = int(value)
+                    continue
+                terms.append(term)
+                document_frequencies.append(int(value))
+        return cls(terms, document_frequencies, nr_documents)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def document_frequency(self, term):
+        ordinal = bisect.bisect_left(self.terms, term)
+        if ordinal < len(self.terms) and self.terms[ordinal] == term:
+            return self.document_frequencies[ordinal]
+        return 0
+
+    def _reversed(self):
+        # The terms reversed and sorted, built on the first pattern with a leading wildcard
+        with self.lock:
+            if self.reversed_terms is None:
+                ordinals = sorted(range(len(self.terms)), key=lambda ordinal: self.terms[ordinal][::-1])
+                self.reversed_terms = [self.terms[ordinal][::-1] for ordinal in ordinals]
+                self.reversed_ordinals = ordinals
+        return self.reversed_terms, self.reversed_ordinals
+
+    def matching_ordinals(self, pattern):
+        """Finds the terms matching a wildcard pattern (* for any characters, ? for one character).
+
+        Args:
+            pattern (str): The pattern, matched in lower case like the analyzed terms.
+
+        Returns:
+            list: The sorted ordinals of the matching terms.
+        """
+        pattern = pattern.lower()
+        literals = WILDCARD_PATTERN.split(pattern)
+        prefix, suffix = literals[0], literals[-1] if len(literals) > 1 else ""
+        start, end = _prefix_range(self.terms, prefix)
+        candidates = range(start, end)
+        if suffix and end - start > 1:
+            reversed_terms, reversed_ordinals = self._reversed()
+            suffix_start, suffix_end = _prefix_range(reversed_terms, suffix[::-1])
+            if suffix_end - suffix_start < end - start:
+                candidates = sorted(reversed_ordinals[suffix_start:suffix_end])
+        return [ordinal for ordinal in candidates if fnmatchcase(self.terms[ordinal], pattern)]
+
+    def expand(self, pattern, max_expansions=1024):
+        """Expands a wildcard pattern into the terms it matches.
+
+        Args:
+            pattern (str): The wildcard pattern.
+            max_expansions (int): The maximum number of terms, the most frequent terms are kept.
+
+        Returns:
+            list: The matching terms, most frequent first.
+        """
+        return self.expand_counted(pattern, max_expansions)[0]
+
+    def expand_counted(self, pattern, max_expansions=1024):
+        """Expands a wildcard pattern like expand and counts all terms it matches, to tell if the terms were cut off.
+
+        Args:
+            pattern (str): The wildcard pattern.
+            max_expansions (int): The maximum number of terms, the most frequent terms are kept.
+
+        Returns:
+            tuple: The matching terms, most frequent first, and the number of all matching terms.
+        """
+        ordinals = self.matching_ordinals(pattern)
+        ordinals.sort(key=lambda ordinal: -self.document_frequencies[ordinal])
+        return [self.terms[ordinal] for ordinal in ordinals[:max_expansions]], len(ordinals)
+
+
+def write_term_dictionary(path, document_frequencies, nr_documents):
+    """Writes a term dictionary, replacing the previous version atomically.
+
+    Args:
+        path (str): The .tsv file.
+        document_frequencies (dict): The document frequency of every term.
+        nr_documents (int): The number of documents of the index.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"#documents\t{nr_documents}\n")
+        for term in sorted(document_frequencies):
+            f.write(f"{term}\t{document_frequencies[term]}\n")
+    os.replace(tmp_path, path)
+
+
+class TermDictionaries:
+    """
+    The term dictionaries of the indices in one folder, loaded on first use and reloaded when the indexer rewrote
+    them.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.loaded = {}
+
+    def get(self, index_name):
+        """Returns the term dictionary of an index.
+
+        Args:
+            index_name (str): The name of the index.
+
+        Returns:
+            TermDictionary: The dictionary, None if the indexer did not write one.
+        """
+        path = os.path.join(self.folder, index_name + ".tsv")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            loaded = self.loaded.get(index_name)
+            if loaded is None or loaded[0] != mtime:
+                loaded = self.loaded[index_name] = (mtime, TermDictionary.load(path))
+        return loaded[1]
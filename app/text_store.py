@@ -0,0 +1,372 @@
+import bisect
+import functools
+import json
+import mmap
+import os
+import sys
+import threading
+import zlib
+from array import array
+
+from local_index import highlight_fragments, query_terms, replace_folder
+
+# The texts of the episodes, compressed once and shared by all indices of the transcripts. With indexer.py
+# --text-store, the snippets only store the position of their text in the text of their episode (text_start and
+# text_end), not the text itself, which the overlapping snippets of an index repeat many times. The text is still
+# indexed for full text search. The middle-ware (TEXT_STORE_PATH) rebuilds the text and the highlights of the hits
+# from the memory-mapped store, whose pages are shared between worker processes. Files of a text store folder:
+#   meta.json      format, byte order, compression and number of episodes
+#   episodes.txt   the sorted episode ids, one per line
+#   offsets.bin    the offset of the compressed text of every episode in texts.bin, plus the end offset
+#   texts.bin      the zlib compressed texts, in the order of the episode ids
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+TEXT_FIELD = "transcript_text"
+
+# The fields of a snippet locating its text in the store, added to the _source filters of the searches
+LOCATION_FIELDS = ["episode_id", "text_start", "text_end"]
+
+
+def text_store_exists(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def text_offsets(episode_text, snippets, field=TEXT_FIELD):
+    """Sets the position of the text of every snippet in the text of its episode.
+
+    Args:
+        episode_text (str): The text of the episode, its segment texts joined.
+        snippets (list): The snippets of one index of the episode, in the order of their start time.
+        field (str): The text field of the snippets.
+    """
+    start = 0
+    for snippet in snippets:
+        # The snippets of an index start in order, a repeated text may be found earlier, which is the same text
+        start = episode_text.find(snippet[field], start)
+        snippet.update(text_start=start, text_end=start + len(snippet[field]))
+
+
+def merge_pieces(pieces):
+    # The text of an episode from (start, text) pieces of its snippets, text no snippet covers is left blank
+    text = []
+    length = 0
+    for start, piece in sorted(pieces):
+        if start > length:
+            text.append(" " * (start - length))
+            length = start
+        if start + len(piece) > length:
+            text.append(piece[length - start:])
+            length = start + len(piece)
+    return "".join(text)
+
+
+class TextStoreWriter:
+    """
+    Collects the texts of episodes and writes them as a text store on commit. The texts of an existing store are kept
+    unless an episode is added again. Like the local index, every commit writes a new folder that replaces the old
+    one, readers keep using the files they mapped until they reopen the store.
+    """
+
+    def __init__(self, path, level=6):
+        """Opens a writer.
+
+        Args:
+            path (str): The folder of the text store.
+            level (int): The zlib compression level.
+        """
+        self.path = path
+        self.level = level
+        self.texts = {}
+        self.previous = TextStore(path) if text_store_exists(path) else None
+
+    def add(self, episode_id, text):
+        self.texts[episode_id] = zlib.compress(text.encode("utf-8"), self.level)
+
+    def commit(self):
+        """
+        Writes the store and replaces the previous version of the folder.
+        """
+        with replace_folder(self.path) as tmp_path:
+            episode_ids = set(self.texts)
+            if self.previous is not None:
+                episode_ids.update(self.previous.episode_ids)
+            episode_ids = sorted(episode_ids)
+            offsets = array("Q", [0])
+            with open(os.path.join(tmp_path, "texts.bin"), "wb") as f:
+                for episode_id in episode_ids:
+                    compressed = self.texts.get(episode_id)
+                    if compressed is None:
+                        compressed = self.previous.compressed(episode_id)
+                    f.write(compressed)
+                    offsets.append(offsets[-1] + len(compressed))
+            with open(os.path.join(tmp_path, "offsets.bin"), "wb") as f:
+                f.write(offsets.tobytes())
+            with open(os.path.join(tmp_path, "episodes.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(episode_ids))
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump({"format": FORMAT_VERSION, "byteorder": sys.byteorder, "compression": "zlib",
+                           "episodes": len(episode_ids)}, f)
+        self.previous = None
+
+
+class TextStore:
+    """
+    Reads the texts of a text store. The files are memory-mapped and the decompressed texts of the most recently used
+    episodes are cached, the snippets of a search often come from the same episodes.
+    """
+
+    def __init__(self, path, cache_size=64):
+        """Opens a text store.
+
+        Args:
+            path (str): The folder of the text store.
+            cache_size (int): The number of decompressed episode texts that are cached.
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["format"] != FORMAT_VERSION or meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written in an incompatible format, rebuild it with the indexer")
+        with open(os.path.join(path, "episodes.txt"), encoding="utf-8") as f:
+            content = f.read()
+        self.episode_ids = content.split("\n") if content else []
+        with open(os.path.join(path, "offsets.bin"), "rb") as f:
+            self.offsets = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("Q")
+        with open(os.path.join(path, "texts.bin"), "rb") as f:
+            # Empty files cannot be memory-mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        self.episode_text = functools.lru_cache(maxsize=cache_size)(self._episode_text)
+
+    def compressed(self, episode_id):
+        position = bisect.bisect_left(self.episode_ids, episode_id)
+        if position == len(self.episode_ids) or self.episode_ids[position] != episode_id:
+            return None
+        return self.data[self.offsets[position]:self.offsets[position + 1]]
+
+    def _episode_text(self, episode_id):
+        compressed = self.compressed(episode_id)
+        return None if compressed is None else zlib.decompress(compressed).decode("utf-8")
+
+    def text(self, episode_id, start, end):
+        """Returns the text of a snippet.
+
+        Args:
+            episode_id (str): The episode of the snippet.
+            start (int): The position of the first character of the snippet in the text of the episode.
+            end (int): The position after the last character.
+
+        Returns:
+            str: The text, None if the episode is not in the store.
+        """
+        episode_text = self.episode_text(episode_id)
+        return None if episode_text is None else episode_text[start:end]
+
+
+def wants_text(source_filter, field=TEXT_FIELD):
+    # Whether a _source filter (None, True, False, a field, a list of fields or includes and excludes) returns the text
+    if source_filter is None or source_filter is True:
+        return True
+    if source_filter is False:
+        return False
+    if isinstance(source_filter, str):
+        return source_filter == field
+    if isinstance(source_filter, dict):
+        includes = source_filter.get("includes")
+        return (includes is None or field in includes) and field not in source_filter.get("excludes", [])
+    return field in source_filter
+
+
+def with_location(source_filter):
+    # The _source filter extended by the location fields, and the fields that were added
+    if source_filter is None or source_filter is True:
+        return source_filter, []
+    if source_filter is False:
+        return list(LOCATION_FIELDS), list(LOCATION_FIELDS)
+    if isinstance(source_filter, dict):
+        includes = source_filter.get("includes")
+        if includes is None:
+            return source_filter, []
+        added = [field for field in LOCATION_FIELDS if field not in includes]
+        return dict(source_filter, includes=list(includes) + added), added
+    fields = [source_filter] if isinstance(source_filter, str) else list(source_filter)
+    added = [field for field in LOCATION_FIELDS if field not in fields]
+    return fields + added, added
+
+
+class TextRequest:
+    """
+    What the hits of a search (or its inner hits) need from the text store: the text and the highlight fragments of
+    the text field, and the location fields that were only added to the _source filter to find the text.
+    """
+
+    def __init__(self, source_filter, highlight, query, field=TEXT_FIELD):
+        """Initializes a TextRequest instance.
+
+        Args:
+            source_filter: The _source filter of the search.
+            highlight (dict): The highlight options of the search, None without highlighting.
+            query (dict): The query, for the terms to highlight.
+            field (str): The text field.
+        """
+        self.field = field
+        self.text = wants_text(source_filter, field)
+        self.highlight = None
+        if highlight is not None and field in highlight.get("fields", {}):
+            self.highlight = {key: value for key, value in highlight.items() if key != "fields"}
+            self.highlight.update(highlight["fields"][field])
+        self.terms = query_terms(query or {"match_all": {}}, field) if self.highlight is not None else []
+        self.source_filter, self.added = source_filter, []
+        if self.text or self.highlight is not None:
+            self.source_filter, self.added = with_location(source_filter)
+        self.keep_source = source_filter is not False
+
+    def fill(self, hit, store):
+        """Adds the text (or its highlight fragments) of a hit of a text store index, hits with the text are kept.
+
+        Args:
+            hit (dict): The hit, changed in place.
+            store (TextStore): The text store, None if there is none.
+        """
+        source = hit.get("_source")
+        if source is None:
+            return
+        if "text_start" in source and self.field not in source and store is not None:
+            text = store.text(source["episode_id"], source["text_start"], source["text_end"])
+            if text is not None and self.highlight is not None:
+                fragments = highlight_fragments(text, self.terms, self.highlight)
+                if fragments:
+                    hit.setdefault("highlight", {})[self.field] = fragments
+            if text is not None and self.text:
+                source[self.field] = text
+        for field in self.added:
+            source.pop(field, None)
+        if not self.keep_source:
+            del hit["_source"]
+
+
+def search_requests(args):
+    """Prepares the arguments of a search for an index whose snippets may only store the location of their text.
+
+    Args:
+        args (dict): The arguments of client.search (or an _msearch body with _source).
+
+    Returns:
+        tuple: The arguments with the location fields added to the _source filters, and the TextRequest of the hits
+            and of the inner hits of a collapse (None without).
+    """
+    source_key = "_source" if "_source" in args else "source"
+    args = dict(args)
+    hits = TextRequest(args.get(source_key), args.get("highlight"), args.get("query"))
+    if hits.added:
+        args[source_key] = hits.source_filter
+    inner_hits = None
+    collapse = args.get("collapse")
+    if collapse is not None and "inner_hits" in collapse:
+        inner = collapse["inner_hits"]
+        inner_hits = TextRequest(inner.get("_source"), inner.get("highlight"), args.get("query"))
+        if inner_hits.added:
+            args["collapse"] = dict(collapse, inner_hits=dict(inner, _source=inner_hits.source_filter))
+    return args, (hits, inner_hits)
+
+
+def fill_response(response, requests, store):
+    # Adds the texts to the hits (and inner hits) of a search response
+    hits_request, inner_request = requests
+    for hit in response["hits"]["hits"]:
+        hits_request.fill(hit, store)
+        if inner_request is not None:
+            for inner_hits in hit.get("inner_hits", {}).values():
+                for inner_hit in inner_hits["hits"]["hits"]:
+                    inner_request.fill(inner_hit, store)
+    return response
+
+
+class TextStoreClient:
+    """
+    Wraps a search client (Elasticsearch or LocalSearchClient) to rebuild the texts and the highlights of the snippets
+    of indices written with a text store (indexer.py --text-store), which only store the location of their text. The
+    store is reopened when the indexer replaced it. Hits of indices with the text are returned unchanged, all other
+    calls are passed to the wrapped client. The highlights are made by the highlighter of the local index, which only
+    knows the queries of build_es_query.
+    """
+
+    def __init__(self, client, path):
+        """Initializes a TextStoreClient instance.
+
+        Args:
+            client: The wrapped search client.
+            path (str): The folder of the text store.
+        """
+        self.client = client
+        self.path = path
+        self.lock = threading.Lock()
+        self.opened = None
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def store(self):
+        # The current version of the text store, None if it was not written yet
+        try:
+            stat = os.stat(os.path.join(self.path, META_FILE))
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if self.opened is None or self.opened[0] != version:
+                self.opened = (version, TextStore(self.path))
+        return self.opened[1]
+
+    def search(self, **kwargs):
+        kwargs, requests = search_requests(kwargs)
+        return fill_response(self.client.search(**kwargs), requests, self.store())
+
+    def msearch(self, searches, **kwargs):
+        """Runs an _msearch request, with the texts of the hits of every search.
+
+        Args:
+            searches (list): The header and the body of every search, alternating.
+
+        Returns:
+            dict: The _msearch response.
+        """
+        prepared = [search_requests(body) for body in searches[1::2]]
+        searches = [part for header, (body, _) in zip(searches[::2], prepared) for part in (header, body)]
+        response = self.client.msearch(searches=searches, **kwargs)
+        store = self.store()
+        for item, (_, requests) in zip(response["responses"], prepared):
+            if "hits" in item:
+                fill_response(item, requests, store)
+        return response
+
+    def get(self, index, id, source=None, **kwargs):
+        request = TextRequest(source, None, None)
+        document = self.client.get(index=index, id=id, source=request.source_filter, **kwargs)
+        request.fill(document, self.store())
+        return document
+
+
+class AsyncTextStoreClient(TextStoreClient):
+    """
+    TextStoreClient for the asyncio middle-ware, wrapping AsyncElasticsearch or AsyncLocalSearchClient.
+    """
+
+    async def search(self, **kwargs):
+        kwargs, requests = search_requests(kwargs)
+        return fill_response(await self.client.search(**kwargs), requests, self.store())
+
+    async def msearch(self, searches, **kwargs):
+        prepared = [search_requests(body) for body in searches[1::2]]
+        searches = [part for header, (body, _) in zip(searches[::2], prepared) for part in (header, body)]
+        response = await self.client.msearch(searches=searches, **kwargs)
+        store = self.store()
+        for item, (_, requests) in zip(response["responses"], prepared):
+            if "hits" in item:
+                fill_response(item, requests, store)
+        return response
+
+    async def get(self, index, id, source=None, **kwargs):
+        request = TextRequest(source, None, None)
+        document = await self.client.get(index=index, id=id, source=request.source_filter, **kwargs)
+        request.fill(document, self.store())
+        return document
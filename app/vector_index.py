@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+
+from embeddings import np, require_numpy
+from local_index import replace_folder
+
+# A local approximate nearest neighbour index of the snippet embeddings, an inverted file (IVF) index: the vectors are
+# clustered with k-means and stored grouped by cluster, a search compares the query with the cluster centroids and
+# then only with the vectors of the nprobe closest clusters. Small indices have a single cluster and are searched
+# exhaustively. Every index is a folder written by the indexer (--vector-index) and memory-mapped by the middle-ware
+# (VECTOR_INDEX_PATH). Files of an index folder:
+#   meta.json       embedding model, dimensions, number of vectors and clusters
+#   vectors.npy     the L2 normalized float32 vectors, grouped by cluster
+#   ids.txt         the snippet id of every vector, one per line
+#   centroids.npy   the normalized centroid of every cluster
+#   offsets.npy     the first vector of every cluster, plus the number of vectors
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+# Indices with fewer vectors are searched exhaustively, larger ones get about sqrt(vectors) clusters
+MIN_CLUSTERED_VECTORS = 50000
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_CLUSTER = 64
+# Clusters compared with the query, the trade-off between recall and latency
+DEFAULT_NPROBE = 16
+# Vectors compared with the centroids at once when assigning them to clusters
+ASSIGN_BATCH = 65536
+
+
+def vector_index_exists(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def assign_clusters(vectors, centroids):
+    # The closest centroid (highest cosine similarity) of every vector
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        assignments[start:start + ASSIGN_BATCH] = np.argmax(vectors[start:start + ASSIGN_BATCH] @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, nr_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Clusters normalized vectors with spherical k-means on a sample of the vectors.
+
+    Args:
+        vectors (numpy.ndarray): The vectors.
+        nr_clusters (int): The number of clusters.
+        iterations (int): The number of k-means iterations.
+        seed (int): The seed of the sample and the initial centroids.
+
+    Returns:
+        numpy.ndarray: The normalized centroids.
+    """
+    rnd = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nr_clusters * KMEANS_SAMPLE_PER_CLUSTER)
+    sample = vectors[np.sort(rnd.choice(len(vectors), sample_size, replace=False))]
+    centroids = sample[rnd.choice(sample_size, nr_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_clusters(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        # Empty clusters restart at random sample vectors
+        sums[empty] = sample[rnd.choice(sample_size, int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+class VectorIndexWriter:
+    """
+    Collects the vectors of an index and writes it on commit. An existing index is loaded first, so vectors can be
+    added, replaced and deleted between runs, like the documents of a LocalIndexWriter. The clusters are trained again
+    on every commit.
+    """
+
+    def __init__(self, path, model, dimensions, nr_clusters=None):
+        """Opens a writer.
+
+        Args:
+            path (str): The folder of the index.
+            model (str): The name of the embedding model of the vectors.
+            dimensions (int): The number of dimensions of the vectors.
+            nr_clusters (int): The number of clusters, by default 1 for small indices and sqrt(vectors) otherwise.
+        """
+        require_numpy()
+        self.path = path
+        self.model = model
+        self.dimensions = dimensions
+        self.nr_clusters = nr_clusters
+        self.vectors = {}
+        if vector_index_exists(path):
+            index = VectorIndex(path)
+            if index.model != model:
+                raise ValueError(f"{path} was built with the embedding model {index.model}, delete it to rebuild it "
+                                 f"with {model}")
+            self.vectors = dict(zip(index.ids, np.array(index.vectors)))
+
+    def add(self, doc_id, vector):
+        self.vectors[doc_id] = vector
+
+    def delete(self, doc_id):
+        return self.vectors.pop(doc_id, None) is not None
+
+    def commit(self):
+        """
+        Clusters the vectors, writes the index and replaces the previous version of the folder.
+        """
+        ids = list(self.vectors)
+        vectors = np.array(list(self.vectors.values()), dtype=np.float32).reshape(len(ids), self.dimensions)
+        nr_clusters = self.nr_clusters
+        if nr_clusters is None:
+            nr_clusters = int(np.sqrt(len(ids))) if len(ids) >= MIN_CLUSTERED_VECTORS else 1
+        nr_clusters = min(nr_clusters, len(ids))
+        if nr_clusters > 1:
+            centroids = train_centroids(vectors, nr_clusters)
+            assignments = assign_clusters(vectors, centroids)
+        else:
+            centroids = np.zeros((1, self.dimensions), dtype=np.float32)
+            assignments = np.zeros(len(ids), dtype=np.int64)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+
+        with replace_folder(self.path) as tmp_path:
+            np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order])
+            np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+            np.save(os.path.join(tmp_path, "offsets.npy"), offsets.astype(np.int64))
+            with open(os.path.join(tmp_path, "ids.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(ids[position] for position in order))
+            meta = {
+                "format": FORMAT_VERSION,
+                "model": self.model,
+                "dimensions": self.dimensions,
+                "vectors": len(ids),
+                "clusters": len(centroids),
+            }
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump(meta, f)
+
+
+class VectorIndex:
+    """
+    Searches one vector index by cosine similarity. The vectors are memory-mapped, so opening an index only reads the
+    ids and the centroids.
+    """
+
+    def __init__(self, path):
+        """Opens an index.
+
+        Args:
+            path (str): The folder of the index.
+        """
+        require_numpy()
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"{path} was written in an incompatible format, rebuild it with the indexer")
+        self.model = meta["model"]
+        self.dimensions = meta["dimensions"]
+        self.nr_vectors = meta["vectors"]
+        # Empty arrays cannot be memory-mapped
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if self.nr_vectors else None)
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        with open(os.path.join(path, "ids.txt"), encoding="utf-8") as f:
+            content = f.read()
+        self.ids = content.split("\n") if content else []
+
+    def search(self, vector, size=10, nprobe=DEFAULT_NPROBE):
+        """Finds the nearest vectors of a query vector.
+
+        Args:
+            vector (numpy.ndarray): The normalized query vector.
+            size (int): The number of results.
+            nprobe (int): The number of clusters searched, all clusters are searched if it is at least the number of
+                clusters.
+
+        Returns:
+            list: (snippet id, cosine similarity) tuples, the most similar first.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        if len(self.centroids) <= nprobe:
+            positions = np.arange(self.nr_vectors)
+            scores = self.vectors @ vector if self.nr_vectors else np.zeros(0, dtype=np.float32)
+        else:
+            clusters = np.argpartition(-(self.centroids @ vector), nprobe)[:nprobe]
+            ranges = [(self.offsets[cluster], self.offsets[cluster + 1]) for cluster in np.sort(clusters)]
+            positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([self.vectors[start:end] @ vector for start, end in ranges])
+        if len(scores) > size:
+            best = np.argpartition(-scores, size)[:size]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.lexsort((positions[best], -scores[best]))]
+        return [(self.ids[positions[position]], float(scores[position])) for position in best]
+
+
+class VectorIndices:
+    """
+    The vector indices in one folder, opened on first use and reopened when the indexer replaced them.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.opened = {}
+
+    def get(self, index_name):
+        """Returns the vector index of an index.
+
+        Args:
+            index_name (str): The name of the index.
+
+        Returns:
+            VectorIndex: The vector index, None if the indexer did not write one.
+        """
+        try:
+            stat = os.stat(os.path.join(self.folder, index_name, META_FILE))
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            opened = self.opened.get(index_name)
+            if opened is None or opened[0] != version:
+                opened = self.opened[index_name] = (version, VectorIndex(os.path.join(self.folder, index_name)))
+        return opened[1]
@@ -0,0 +1,134 @@
+"""
+Compares searching a query set one /search request at a time with one POST /search/batch request, like an offline
+evaluation of a query set. Both run in the Flask middle-ware (its test client, without a server) against the
+Elasticsearch and Spotify stand-ins with added latency, or with --es-url against a cluster. Reports the queries per
+second, the Spotify requests and looked up ids of both, and checks that both return the same episodes.
+
+    python bench_batch.py --queries 500 --es-latency 0.005 --spotify-latency 0.05
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from elasticsearch import Elasticsearch, helpers
+
+from bench_local_index import SnippetCollector
+from fake_elasticsearch import FakeElasticsearch
+from fake_spotify import FakeSpotify
+from load_test import QUERY_TERMS, index_snippets
+from metadata_store import build_metadata_store
+from synthetic import write_metadata
+
+
+def reset_spotify(searcher, url):
+    # A new client with an empty cache, so that both runs start cold
+    from spotify import SpotifyClient
+    searcher.spotify = searcher.batch.spotify = SpotifyClient("bench", "bench", cache_path=":memory:", api_url=url,
+                                                               accounts_url=url)
+
+
+def run_single(app, queries, args):
+    start = time.perf_counter()
+    episodes = []
+    for query in queries:
+        response = app.get("/search", query_string={"q": query, "length": args.length, "results": args.results,
+                                                    "openai": "false"})
+        episodes.append(response.get_json()["episodes"])
+    return time.perf_counter() - start, episodes
+
+
+def run_batch(app, queries, args):
+    start = time.perf_counter()
+    response = app.post("/search/batch", query_string={"length": args.length, "results": args.results},
+                        data="\n".join(queries))
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    return time.perf_counter() - start, [line.get("episodes") for line in lines]
+
+
+def measure(name, run, searcher, spotify, queries, args):
+    reset_spotify(searcher, spotify.url)
+    episode_requests, requested_ids = spotify.episode_requests, len(spotify.requested_ids)
+    seconds, episodes = run(searcher.app.test_client(), queries, args)
+    return {
+        "mode": name,
+        "seconds": round(seconds, 3),
+        "queries_per_second": round(len(queries) / seconds, 1),
+        "spotify_requests": spotify.episode_requests - episode_requests,
+        "spotify_ids": len(spotify.requested_ids) - requested_ids,
+    }, episodes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=500, help="queries of the query set")
+    parser.add_argument("--results", type=int, default=10, help="episodes per query")
+    parser.add_argument("--length", default="120", help="the clip length searched")
+    parser.add_argument("--chunk-size", type=int, default=100, help="queries per _msearch request")
+    parser.add_argument("--concurrency", type=int, default=4, help="_msearch requests in flight")
+    parser.add_argument("--es-url", help="an Elasticsearch cluster instead of the stand-in")
+    parser.add_argument("--es-latency", type=float, default=0.005, help="seconds added to every stand-in request")
+    parser.add_argument("--spotify-latency", type=float, default=0.05, help="seconds added to every Spotify request")
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=5, help="snippets per episode")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    queries = [" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 2))) for _ in range(args.queries)]
+    index = "podcast_" + args.length
+
+    with tempfile.TemporaryDirectory() as folder, FakeSpotify(latency=args.spotify_latency) as spotify:
+        data_folder = os.path.join(folder, "data")
+        os.makedirs(data_folder)
+        os.makedirs(os.path.join(folder, "app"))
+        episode_ids = write_metadata(os.path.join(data_folder, "metadata.tsv"), args.shows, args.episodes)
+        build_metadata_store(os.path.join(data_folder, "metadata.tsv"), os.path.join(data_folder, "metadata.sqlite"))
+
+        fake = None
+        if args.es_url:
+            es_url = args.es_url
+            collector = SnippetCollector()
+            index_snippets(collector, index, episode_ids, args.snippets, 300)
+            es = Elasticsearch(es_url, request_timeout=600)
+            es.options(ignore_status=404).indices.delete(index=index)
+            helpers.bulk(es, ({"_index": index, "_id": doc_id, **source}
+                              for doc_id, source in collector.documents.items()), refresh=True)
+        else:
+            fake = FakeElasticsearch(latency=args.es_latency).start()
+            index_snippets(fake, index, episode_ids, args.snippets, 300)
+            es_url = fake.url
+
+        os.environ.update(ELASTICSEARCH_URL=es_url, SPOTIFY_API_URL=spotify.url, SPOTIFY_ACCOUNTS_URL=spotify.url,
+                          SPOTIFY_CLIENT_ID="bench", SPOTIFY_CLIENT_SECRET="bench", SPOTIFY_CACHE_PATH=":memory:",
+                          LLM_CACHE_PATH=":memory:", OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench"),
+                          RESULT_CACHE="off", BATCH_CHUNK_SIZE=str(args.chunk_size),
+                          BATCH_CONCURRENCY=str(args.concurrency))
+        os.environ.pop("LOCAL_INDEX_PATH", None)
+        # The middle-ware opens ../data/metadata.sqlite relative to its working directory
+        os.chdir(os.path.join(folder, "app"))
+        import searcher
+
+        single, single_episodes = measure("single", run_single, searcher, spotify, queries, args)
+        batch, batch_episodes = measure("batch", run_batch, searcher, spotify, queries, args)
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        if fake is not None:
+            fake.stop()
+
+    summary = {
+        "queries": len(queries),
+        "backend": "elasticsearch" if args.es_url else "stand-in",
+        "runs": [single, batch],
+        "speedup": round(single["seconds"] / batch["seconds"], 2),
+        "identical": single_episodes == batch_episodes,
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,58 @@
+"""
+Compares segmenting a synthetic corpus from the JSON files with segmenting it from the preprocessed transcript cache.
+
+    python bench_cache.py --shows 20 --episodes 10 --document-size 120
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch
+
+from indexer import PodcastTranscriptIndexer
+from synthetic import write_corpus
+from transcript_cache import build_cache
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def segment_corpus(indexer):
+    start = time.perf_counter()
+    nr_snippets = sum(len(snippets) for _, _, snippets, _, _ in indexer.iter_processed_files())
+    return nr_snippets, round(time.perf_counter() - start, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=1800)
+    parser.add_argument("--document-size", type=int, default=120)
+    parser.add_argument("--overlap", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    client = Elasticsearch("http://localhost:9200")
+    with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as cache_dir:
+        write_corpus(folder, args.shows, args.episodes, args.duration)
+
+        start = time.perf_counter()
+        build_cache(folder, cache_dir)
+        build_seconds = round(time.perf_counter() - start, 3)
+
+        results = {"json_mb": round(folder_size(folder) / 2 ** 20, 1),
+                   "cache_mb": round(folder_size(cache_dir) / 2 ** 20, 1),
+                   "cache_build_seconds": build_seconds}
+        for source, cache in (("json", None), ("cache", cache_dir)):
+            indexer = PodcastTranscriptIndexer(None, None, folder, "benchmark", 0, args.document_size, args.overlap,
+                                               workers=args.workers, client=client, cache_dir=cache)
+            nr_snippets, seconds = segment_corpus(indexer)
+            results[source] = {"snippets": nr_snippets, "seconds": seconds}
+        print(json.dumps(results, indent=2))
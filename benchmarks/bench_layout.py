@@ -0,0 +1,132 @@
+"""
+Measures index layouts on an Elasticsearch cluster: for every layout (shards, analyzer, index_options and subfields)
+the synthetic snippets are loaded once into a plain index, searchable while it is loaded, and once with the bulk
+load of the indexer (no refreshes and replicas during the load, force-merge and alias swap at the end). Reported are
+the ingest rate, the time until the loaded snippets are searchable, the index size and segment count, and the search
+latency of intersection, phrase and wildcard queries afterwards. Phrase queries fail on layouts without positions,
+they are counted as errors. The benchmark indices (bench_layout*) are deleted before every load.
+
+    python bench_layout.py --es-url http://localhost:9200 --snippets 100
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import ApiError, Elasticsearch
+
+from index_layout import BulkLoad, index_body, IndexLayout, Subfield
+from uploader import BulkUploader
+from bench_local_index import make_queries, SnippetCollector
+# Found in the app folder, which uploader adds to the path
+from lexical_query import build_es_query
+from load_test import index_snippets, percentile
+from synthetic import write_metadata
+
+INDEX = "bench_layout"
+
+LAYOUTS = {
+    "default": IndexLayout(),
+    "one_shard": IndexLayout(shards=1),
+    "english_subfield": IndexLayout(subfields=(Subfield("english", "english", "freqs"),)),
+    "freqs_only": IndexLayout(index_options="freqs"),
+}
+
+
+def delete_benchmark_indices(client):
+    for name in client.indices.get(index=f"{INDEX}*"):
+        client.indices.delete(index=name)
+
+
+def load(client, layout, documents, bulk, args):
+    # Uploads the documents like the indexer and returns the timings and the number of uploaded snippets
+    delete_benchmark_indices(client)
+    bulk_load = BulkLoad(client, INDEX, layout) if bulk else None
+    if bulk:
+        bulk_load.create()
+    else:
+        client.indices.create(index=INDEX, **index_body(layout))
+    uploader = BulkUploader(client, INDEX, threads=args.upload_threads, chunk_size=args.chunk_size,
+                            index_names={INDEX: bulk_load.index_name} if bulk else None)
+    start = time.perf_counter()
+    uploader.start()
+    for doc_id, source in documents.items():
+        uploader.put(dict(source, _index=INDEX, _id=doc_id))
+    uploader.close()
+    upload_seconds = time.perf_counter() - start
+    if bulk:
+        bulk_load.finish()
+    else:
+        client.indices.refresh(index=INDEX)
+    return upload_seconds, time.perf_counter() - start, uploader.uploaded
+
+
+def search_latencies(client, queries, size):
+    results = {}
+    for shape, shape_queries in queries.items():
+        latencies = []
+        errors = 0
+        for query in shape_queries:
+            start = time.perf_counter()
+            try:
+                client.search(index=INDEX, query=build_es_query(query, "transcript_text")["query"], size=size)
+            except ApiError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        results[shape] = {
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "errors": errors,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--es-url", required=True, help="the Elasticsearch cluster, e.g. http://localhost:9200")
+    parser.add_argument("--layout", dest="layouts", action="append", choices=sorted(LAYOUTS),
+                        help="layouts to measure (can be repeated), all by default")
+    parser.add_argument("--queries", type=int, default=100, help="queries of every shape")
+    parser.add_argument("--results", type=int, default=10, help="size of every search")
+    parser.add_argument("--upload-threads", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--shows", type=int, default=100)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=30, help="snippets per episode")
+    parser.add_argument("--words", type=int, default=300, help="words per snippet")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    client = Elasticsearch(args.es_url, request_timeout=600)
+    collector = SnippetCollector()
+    with tempfile.TemporaryDirectory() as folder:
+        episode_ids = write_metadata(os.path.join(folder, "metadata.tsv"), args.shows, args.episodes)
+    index_snippets(collector, INDEX, episode_ids, args.snippets, args.words)
+    queries = make_queries(collector.documents, args.queries)
+
+    results = []
+    for name in args.layouts or list(LAYOUTS):
+        for bulk in [False, True]:
+            upload_seconds, searchable_seconds, uploaded = load(client, LAYOUTS[name], collector.documents, bulk, args)
+            stats = client.indices.stats(index=INDEX)["_all"]["primaries"]
+            results.append({
+                "layout": name,
+                "mode": "bulk_load" if bulk else "plain",
+                "snippets": uploaded,
+                "ingest_per_second": round(uploaded / upload_seconds, 1),
+                "searchable_seconds": round(searchable_seconds, 2),
+                "index_bytes": stats["store"]["size_in_bytes"],
+                "segments": stats["segments"]["count"],
+                "search": search_latencies(client, queries, args.results),
+            })
+            print(json.dumps(results[-1]))
+    delete_benchmark_indices(client)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,143 @@
+"""
+Compares the local inverted index with Elasticsearch on the same synthetic snippets: search latency per query shape
+(intersection, phrase and wildcard queries of build_es_query), the overlap of the top results and the index size.
+Without --es-url the local Elasticsearch stand-in is used, which scores by term frequency instead of BM25, so its
+overlap is only indicative.
+
+    python bench_local_index.py --queries 200 --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from elasticsearch import Elasticsearch, helpers
+
+from fake_elasticsearch import FakeElasticsearch
+from lexical_query import build_es_query
+from load_test import QUERY_TERMS, index_snippets, percentile
+from local_index import LocalIndexWriter, LocalSearchClient, tokenize
+from synthetic import write_metadata
+
+
+class SnippetCollector:
+    # Receives the documents of index_snippets, to write the same snippets to both backends
+    def __init__(self):
+        self.documents = {}
+
+    def add_documents(self, index, documents):
+        self.documents.update(documents)
+
+
+def make_queries(documents, nr_queries, seed=0):
+    # Queries of every shape build_es_query produces, phrases are taken from the snippets so that they match
+    rnd = random.Random(seed)
+    texts = [tokenize(source["transcript_text"]) for source in documents.values()]
+    queries = {"intersection": [], "phrase": [], "wildcard": []}
+    for _ in range(nr_queries):
+        queries["intersection"].append(" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 3))))
+        tokens = rnd.choice(texts)
+        start = rnd.randrange(max(1, len(tokens) - 3))
+        queries["phrase"].append('"' + " ".join(tokens[start:start + rnd.randint(2, 3)]) + '"')
+        term = rnd.choice(QUERY_TERMS)
+        queries["wildcard"].append(rnd.choice([term[:3] + "*", "*" + term[-3:], term[:2] + "?" + term[3:]]))
+    return queries
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def timed_searches(client, index, queries, size):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        response = client.search(index=index, query=build_es_query(query, "transcript_text")["query"], size=size)
+        latencies.append(time.perf_counter() - start)
+        results.append([hit["_id"] for hit in response["hits"]["hits"]])
+    return sorted(latencies), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--es-url", help="an Elasticsearch cluster to compare with instead of the stand-in")
+    parser.add_argument("--queries", type=int, default=100, help="queries per query shape")
+    parser.add_argument("--results", type=int, default=20, help="size of every search, the overlap is over the top k")
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=10, help="snippets per episode")
+    parser.add_argument("--words", type=int, default=300, help="words per snippet")
+    args = parser.parse_args()
+
+    index = "podcast_bench"
+    with tempfile.TemporaryDirectory() as folder:
+        episode_ids = write_metadata(os.path.join(folder, "metadata.tsv"), args.shows, args.episodes)
+        collector = SnippetCollector()
+        index_snippets(collector, index, episode_ids, args.snippets, args.words)
+
+        start = time.perf_counter()
+        writer = LocalIndexWriter(os.path.join(folder, "local", index))
+        for doc_id, source in collector.documents.items():
+            writer.add(doc_id, source)
+        writer.commit()
+        local_build_seconds = time.perf_counter() - start
+        local = LocalSearchClient(os.path.join(folder, "local"))
+
+        fake = None
+        if args.es_url:
+            es = Elasticsearch(args.es_url, request_timeout=60)
+            es.options(ignore_status=404).indices.delete(index=index)
+            es.indices.create(index=index, mappings={"properties": {
+                "show_id": {"type": "keyword", "index": False},
+                "episode_id": {"type": "keyword"},
+                "transcript_text": {"type": "text"},
+                "start_time": {"type": "float", "index": False},
+                "end_time": {"type": "float", "index": False},
+            }})
+            helpers.bulk(es, ({"_index": index, "_id": doc_id, **source}
+                              for doc_id, source in collector.documents.items()))
+            es.indices.refresh(index=index)
+        else:
+            fake = FakeElasticsearch().start()
+            fake.add_documents(index, collector.documents)
+            es = Elasticsearch(fake.url)
+
+        try:
+            results = []
+            for shape, queries in make_queries(collector.documents, args.queries).items():
+                # Warm up both backends (caches, connections) before measuring
+                timed_searches(local, index, queries[:5], args.results)
+                timed_searches(es, index, queries[:5], args.results)
+                local_latencies, local_ids = timed_searches(local, index, queries, args.results)
+                es_latencies, es_ids = timed_searches(es, index, queries, args.results)
+                overlaps = [len(set(a) & set(b)) / max(1, len(b)) for a, b in zip(local_ids, es_ids)]
+                results.append({
+                    "shape": shape,
+                    "local_p50_ms": round(percentile(local_latencies, 0.5) * 1000, 2),
+                    "local_p95_ms": round(percentile(local_latencies, 0.95) * 1000, 2),
+                    "es_p50_ms": round(percentile(es_latencies, 0.5) * 1000, 2),
+                    "es_p95_ms": round(percentile(es_latencies, 0.95) * 1000, 2),
+                    f"overlap_at_{args.results}": round(sum(overlaps) / len(overlaps), 3),
+                })
+            if args.es_url:
+                es_bytes = es.indices.stats(index=index)["_all"]["primaries"]["store"]["size_in_bytes"]
+            else:
+                es_bytes = None
+        finally:
+            if fake is not None:
+                fake.stop()
+
+        summary = {
+            "documents": len(collector.documents),
+            "local_build_seconds": round(local_build_seconds, 2),
+            "local_index_bytes": folder_size(os.path.join(folder, "local")),
+            "es_index_bytes": es_bytes,
+            "queries": results,
+        }
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,88 @@
+"""
+Compares the startup time, memory and lookup latency of the in-memory metadata dict with the SQLite metadata store.
+Every variant runs in a fresh process, like a newly forked Flask worker.
+
+    python bench_metadata.py --shows 2000 --episodes 50
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from metadata_store import InMemoryMetadata, MetadataStore, build_metadata_store, read_metadata
+from synthetic import write_metadata
+
+
+def rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(variant, tsv_path, db_path, episode_ids, lookups):
+    """Opens the metadata like a worker does and runs batches of 50 lookups, like one search request.
+
+    Returns:
+        dict: Startup time, RSS growth and lookup latency.
+    """
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if variant == "dict":
+        metadata = InMemoryMetadata(read_metadata(tsv_path))
+    else:
+        metadata = MetadataStore(db_path)
+    startup = time.perf_counter() - start
+
+    rnd = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        found = metadata.get_many(rnd.sample(episode_ids, 50))
+        assert len(found) == 50
+    lookup = (time.perf_counter() - start) / lookups
+
+    return {
+        "variant": variant,
+        "startup_ms": round(startup * 1000, 2),
+        "rss_growth_mb": round(rss_mb() - rss_before, 1),
+        "lookup_50_ms": round(lookup * 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=2000)
+    parser.add_argument("--episodes", type=int, default=50, help="episodes per show")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--measure", nargs=3, metavar=("VARIANT", "TSV", "DB"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        variant, tsv_path, db_path = args.measure
+        with open(tsv_path) as f:
+            next(f)
+            episode_ids = [line.rstrip("\n").split("\t")[-1] for line in f]
+        print(json.dumps(measure(variant, tsv_path, db_path, episode_ids, args.lookups)))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as folder:
+        tsv_path = os.path.join(folder, "metadata.tsv")
+        db_path = os.path.join(folder, "metadata.sqlite")
+        write_metadata(tsv_path, args.shows, args.episodes)
+
+        start = time.perf_counter()
+        build_metadata_store(tsv_path, db_path)
+        print(json.dumps({"episodes": args.shows * args.episodes,
+                          "tsv_mb": round(os.path.getsize(tsv_path) / 2 ** 20, 1),
+                          "db_mb": round(os.path.getsize(db_path) / 2 ** 20, 1),
+                          "build_seconds": round(time.perf_counter() - start, 2)}))
+
+        for variant in ("dict", "sqlite"):
+            output = subprocess.run([sys.executable, __file__, "--measure", variant, tsv_path, db_path,
+                                     "--lookups", str(args.lookups)], capture_output=True, text=True, check=True)
+            print(output.stdout.strip())
@@ -0,0 +1,152 @@
+"""
+Micro-benchmarks of the CPU bound steps of indexing and searching, without any I/O:
+- the segmentation of one synthetic episode into snippets with process_document and process_document_overlap,
+- build_es_query for every query shape, with and without the term dictionary of the index,
+- the grouping of the hits in /search (group_hits, group_collapsed_hits, add_spotify_info and format_results) and the
+  serialization of the response.
+Every case reports the best time per call over several repeats, like timeit. With --output the
+results are written as JSON, compare_results.py compares them with a baseline.
+
+    python bench_micro.py --output results/micro.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch
+
+from indexer import PodcastTranscriptIndexer
+from transcript_reader import segments_from_json
+# Found in the app folder, which the indexer adds to the path
+from lexical_query import build_es_query, build_highlight
+from search_results import add_spotify_info, format_results, group_collapsed_hits, group_hits
+from synthetic import VOCABULARY, WEIGHTS, generate_episode
+from term_dictionary import TermDictionary
+
+QUERIES = {
+    "intersection": "money travel coffee",
+    "stopwords": "the money of the travel",
+    "phrase": '"climate change"',
+    "wildcard": "clim* *ball",
+}
+
+
+def measure(function, repeat):
+    # The best time per call of repeat timed loops, every loop runs for at least 0.2 seconds
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return {"us_per_call": round(min(timer.repeat(repeat, number)) / number * 1e6, 3)}
+
+
+def synthetic_dictionary(nr_documents=100000):
+    # Document frequencies following the weights of the synthetic vocabulary, the frequent words are in every snippet
+    terms = sorted(set(VOCABULARY))
+    weights = dict(zip(VOCABULARY, WEIGHTS))
+    return TermDictionary(terms, [int(nr_documents * min(1.0, weights[term] * 3)) for term in terms], nr_documents)
+
+
+def synthetic_hits(nr_hits, nr_episodes, highlight, seed=0):
+    # Search hits with the fields of the indexed snippets, spread over nr_episodes episodes
+    rnd = random.Random(seed)
+    hits = []
+    for number in range(nr_hits):
+        episode = rnd.randrange(nr_episodes)
+        source = {"show_id": f"show{episode // 5}", "episode_id": f"episode{episode}",
+                  "start_time": 120.0 * number, "end_time": 120.0 * (number + 1)}
+        hit = {"_id": f"snippet{number}", "_score": 10.0 - number / nr_hits, "_source": source}
+        text = " ".join(rnd.choices(VOCABULARY, weights=WEIGHTS, k=300))
+        if highlight:
+            hit["highlight"] = {"transcript_text": [f"{text[:70]} <em>money</em> {text[70:140]}"] * 3}
+        else:
+            source["transcript_text"] = text
+        hits.append(hit)
+    return hits
+
+
+def collapse_hits(hits, nr_snippets):
+    # The response format of the grouped mode: the best hit of every episode with its best snippets as inner hits
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit["_source"]["episode_id"], []).append(hit)
+    return [dict(group[0], inner_hits={"snippets": {"hits": {"hits": group[:nr_snippets]}}})
+            for group in groups.values()]
+
+
+def episode_metadata(hits):
+    return {hit["_source"]["episode_id"]: {
+        "show_name": "Show", "show_description": "A show " * 20, "publisher": "Publisher",
+        "episode_name": "Episode", "episode_description": "An episode " * 40, "language": "en",
+        "rss_link": "https://example.com/rss", "duration": 42.0,
+    } for hit in hits}
+
+
+def spotify_info(episode_ids):
+    return {episode_id: {"picture_uri": "https://i.scdn.co/image/x", "release_date": "2020-01-01",
+                         "duration_ms": 2520000} for episode_id in episode_ids}
+
+
+def bench_segmentation(hours, document_sizes, repeat):
+    indexer = PodcastTranscriptIndexer(None, None, None, "benchmark", 0, 0, False,
+                                       client=Elasticsearch("http://localhost:9200"))
+    segments = segments_from_json(generate_episode(hours * 3600, random.Random(0)))
+    results = []
+    for method in ["process_document", "process_document_overlap"]:
+        for document_size in document_sizes:
+            snippets = []
+            getattr(indexer, method)(segments, snippets, "show_benchmark", "episode.json", document_size)
+            result = measure(lambda: getattr(indexer, method)(segments, [], "show_benchmark", "episode.json",
+                                                              document_size), repeat)
+            results.append(dict(name=f"{method}_{document_size}", snippets=len(snippets), **result))
+    return results
+
+
+def bench_queries(repeat):
+    dictionary = synthetic_dictionary()
+    results = []
+    for shape, query in QUERIES.items():
+        for name, term_dictionary in [(shape, None), (shape + "_dictionary", dictionary)]:
+            result = measure(lambda: build_es_query(query, "transcript_text", term_dictionary), repeat)
+            results.append(dict(name=f"build_es_query_{name}", **result))
+    return results
+
+
+def bench_grouping(nr_hits, repeat):
+    results = []
+    for mode in ["full", "highlight", "grouped"]:
+        hits = synthetic_hits(nr_hits * (3 if mode == "grouped" else 1), nr_hits // 2, mode != "full")
+        if mode == "grouped":
+            hits = collapse_hits(hits, 3)[:nr_hits]
+        metadata = episode_metadata(hits)
+        group = group_collapsed_hits if mode == "grouped" else group_hits
+
+        def respond():
+            episode_map, episode_ids = group(hits, metadata)
+            add_spotify_info(episode_map, spotify_info(episode_ids))
+            return json.dumps(format_results(episode_map))
+
+        results.append(dict(name=f"group_{mode}", hits=len(hits), **measure(lambda: group(hits, metadata), repeat)))
+        results.append(dict(name=f"respond_{mode}", bytes=len(respond()), **measure(respond, repeat)))
+    results.append(dict(name="build_highlight", **measure(lambda: build_highlight("transcript_text"), repeat)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1.0, help="length of the segmented episode")
+    parser.add_argument("--document-size", type=int, nargs="+", default=[30, 120, 300])
+    parser.add_argument("--hits", type=int, default=50, help="hits of the grouping benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = (bench_segmentation(args.hours, args.document_size, args.repeat) + bench_queries(args.repeat)
+               + bench_grouping(args.hits, args.repeat))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
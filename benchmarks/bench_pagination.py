@@ -0,0 +1,126 @@
+"""
+Measures paging through the results of /search: reading page k of a query with a cursor (a point in time and
+search_after on the last hit of page k - 1) against searching again with k times the page size and keeping the last
+page, which is what a client raising the results parameter does. Reports the latency and response size per page
+number and checks that both return the same hits. The local inverted index is searched, with --es-url also a
+cluster with the same snippets.
+
+    python bench_pagination.py --pages 20 --page-size 10 --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from bench_local_index import SnippetCollector
+from lexical_query import build_es_query
+from load_test import QUERY_TERMS, index_snippets, percentile
+from local_index import LocalIndexWriter, LocalSearchClient
+from pagination import search_page
+from search_results import search_options
+from synthetic import write_metadata
+
+
+def read_pages(client, index, query, page_size, pages, options):
+    # Latency, response size and hit ids of every page, read with a cursor and by searching again
+    cursor_pages = []
+    page = None
+    for _ in range(pages):
+        start = time.perf_counter()
+        response = search_page(client, index, query, page_size, options, page)
+        seconds = time.perf_counter() - start
+        hits = response["hits"]["hits"]
+        cursor_pages.append((seconds, len(json.dumps(hits)), [hit["_id"] for hit in hits]))
+        if len(hits) < page_size:
+            break
+        page = {"pit": response["pit_id"], "after": hits[-1]["sort"]}
+
+    resized_pages = []
+    for number in range(1, len(cursor_pages) + 1):
+        start = time.perf_counter()
+        response = client.search(index=index, query=query, size=number * page_size)
+        seconds = time.perf_counter() - start
+        hits = response["hits"]["hits"]
+        resized_pages.append((seconds, len(json.dumps(hits)), [hit["_id"] for hit in hits[-page_size:]]))
+    return cursor_pages, resized_pages
+
+
+def compare(client, index, queries, args):
+    options = search_options({})
+    by_page = {}
+    identical = True
+    for query in queries:
+        cursor_pages, resized_pages = read_pages(client, index, query, args.page_size, args.pages, options)
+        for number, (cursor_page, resized_page) in enumerate(zip(cursor_pages, resized_pages), start=1):
+            # Hits with the same score may be ordered differently by the two sorts, the set of a page is compared
+            identical = identical and (number == len(cursor_pages) or set(cursor_page[2]) == set(resized_page[2]))
+            by_page.setdefault(number, []).append((cursor_page, resized_page))
+
+    pages = []
+    for number, measurements in sorted(by_page.items()):
+        cursor_latencies = sorted(cursor[0] for cursor, _ in measurements)
+        resized_latencies = sorted(resized[0] for _, resized in measurements)
+        pages.append({
+            "page": number,
+            "queries": len(measurements),
+            "cursor_p50_ms": round(percentile(cursor_latencies, 0.5) * 1000, 2),
+            "resized_p50_ms": round(percentile(resized_latencies, 0.5) * 1000, 2),
+            "cursor_bytes": sum(cursor[1] for cursor, _ in measurements) // len(measurements),
+            "resized_bytes": sum(resized[1] for _, resized in measurements) // len(measurements),
+        })
+    return {"identical_pages": identical, "pages": pages}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=10, help="pages read per query")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--es-url", help="an Elasticsearch cluster to search as well")
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=10, help="snippets per episode")
+    parser.add_argument("--words", type=int, default=300, help="words per snippet")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    queries = [build_es_query(" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 2))), "transcript_text")["query"]
+               for _ in range(args.queries)]
+    index = "podcast_bench"
+    with tempfile.TemporaryDirectory() as folder:
+        episode_ids = write_metadata(os.path.join(folder, "metadata.tsv"), args.shows, args.episodes)
+        collector = SnippetCollector()
+        index_snippets(collector, index, episode_ids, args.snippets, args.words)
+        writer = LocalIndexWriter(os.path.join(folder, "local", index))
+        for doc_id, source in collector.documents.items():
+            writer.add(doc_id, source)
+        writer.commit()
+
+        backends = {"local": compare(LocalSearchClient(os.path.join(folder, "local")), index, queries, args)}
+        if args.es_url:
+            from elasticsearch import Elasticsearch, helpers
+            es = Elasticsearch(args.es_url, request_timeout=60)
+            es.options(ignore_status=404).indices.delete(index=index)
+            es.indices.create(index=index, mappings={"properties": {
+                "show_id": {"type": "keyword", "index": False},
+                "episode_id": {"type": "keyword"},
+                "transcript_text": {"type": "text"},
+                "start_time": {"type": "float", "index": False},
+                "end_time": {"type": "float", "index": False},
+            }})
+            helpers.bulk(es, ({"_index": index, "_id": doc_id, **source}
+                              for doc_id, source in collector.documents.items()))
+            es.indices.refresh(index=index)
+            backends["elasticsearch"] = compare(es, index, queries, args)
+
+    summary = {"documents": len(collector.documents), "page_size": args.page_size, "backends": backends}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
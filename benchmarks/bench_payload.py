@@ -0,0 +1,76 @@
+"""
+Compares the size and the serialization time of /search responses with the full transcript of every snippet against
+the highlight mode, which returns only the matched fragments, for the 30, 120 and 300 second indices.
+
+    python bench_payload.py --results 50 --queries 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from elasticsearch import Elasticsearch
+
+from fake_elasticsearch import FakeElasticsearch
+from lexical_query import build_es_query
+from load_test import QUERY_TERMS, index_snippets
+from metadata_store import InMemoryMetadata, read_metadata
+from search_results import format_results, group_search_hits, search_args, search_options
+from synthetic import write_metadata
+
+# Transcripts have about 2.5 words per second
+WORDS_PER_SECOND = 2.5
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=50, help="the results parameter of /search")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--shows", type=int, default=20)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=10, help="snippets per episode")
+    parser.add_argument("--fragment-size", type=int, default=150)
+    parser.add_argument("--fragments", type=int, default=3, help="fragments per snippet")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    queries = [" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 2))) for _ in range(args.queries)]
+    modes = {
+        "full": search_options({}),
+        "highlight": search_options({"highlight": "true", "fragment_size": args.fragment_size,
+                                     "fragments": args.fragments}),
+    }
+
+    results = []
+    with FakeElasticsearch() as fake, tempfile.TemporaryDirectory() as folder:
+        metadata_path = os.path.join(folder, "metadata.tsv")
+        episode_ids = write_metadata(metadata_path, args.shows, args.episodes)
+        metadata = InMemoryMetadata(read_metadata(metadata_path))
+        client = Elasticsearch(fake.url)
+
+        for length in [30, 120, 300]:
+            index = f"podcast_{length}"
+            index_snippets(fake, index, episode_ids, args.snippets, int(length * WORDS_PER_SECOND))
+            for name, options in modes.items():
+                total_bytes = 0
+                serialize_time = 0.0
+                for query in queries:
+                    search_result = client.search(index=index, query=build_es_query(query, "transcript_text")["query"],
+                                                  **search_args(args.results, **options))
+                    hits = search_result["hits"]["hits"]
+                    episode_map, _ = group_search_hits(
+                        hits, metadata.get_many(hit["_source"]["episode_id"] for hit in hits), options)
+
+                    start = time.perf_counter()
+                    body = json.dumps(format_results(episode_map, search_result)).encode("utf-8")
+                    serialize_time += time.perf_counter() - start
+                    total_bytes += len(body)
+                results.append({"length": length, "mode": name,
+                                "kb_per_response": round(total_bytes / len(queries) / 1024, 1),
+                                "serialize_ms": round(serialize_time / len(queries) * 1000, 3)})
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,147 @@
+"""
+Measures the query planner of lexical_query on intersection queries: search latency of the planned queries (frequent
+terms dropped or filtered, the rest fused into one match clause) against one scored match clause per term, the overlap
+of their top results and the time spent planning. The queries come from a query log with one query per line
+(--query-log) or are generated from the synthetic vocabulary, mixing stopwords, frequent and rare terms.
+The local inverted index is searched, with --es-url also a cluster with the same snippets.
+
+    python bench_planner.py --query-log ../data/query-log.txt --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from bench_local_index import SnippetCollector
+from lexical_query import plan_es_query
+from load_test import QUERY_TERMS, index_snippets, percentile
+from local_index import LocalIndexWriter, LocalSearchClient
+from synthetic import VOCABULARY, write_metadata
+
+
+def make_query_log(nr_queries, seed=0):
+    # Spoken queries: a content term or two with the frequent words around them ("the money of travel")
+    rnd = random.Random(seed)
+    frequent = VOCABULARY[:40]
+    queries = []
+    for _ in range(nr_queries):
+        terms = rnd.sample(QUERY_TERMS, rnd.randint(1, 2)) + rnd.sample(frequent, rnd.randint(1, 3))
+        rnd.shuffle(terms)
+        queries.append(" ".join(terms))
+    return queries
+
+
+def read_query_log(path):
+    # Phrase and wildcard queries are not planned, only the intersection queries of the log are kept
+    with open(path, encoding="utf-8") as f:
+        queries = [line.strip() for line in f]
+    return [query for query in queries if query and not query.startswith('"') and "*" not in query and "?" not in query]
+
+
+def timed_searches(client, index, queries, size):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        response = client.search(index=index, query=query["query"], size=size)
+        latencies.append(time.perf_counter() - start)
+        results.append([hit["_id"] for hit in response["hits"]["hits"]])
+    return sorted(latencies), results
+
+
+def check_without_terms(client, index, dictionary, queries=("-", "!!!", "... ?!")):
+    # Queries without a term have nothing to plan, they have to match the same (no) documents as unplanned
+    for query in queries:
+        hits = [client.search(index=index, query=plan_es_query(query, "transcript_text", term_dictionary)[0]["query"],
+                              size=1)["hits"]["total"]["value"] for term_dictionary in (None, dictionary)]
+        if hits[0] != hits[1]:
+            raise AssertionError(f"{query!r} matches {hits[1]} documents planned, {hits[0]} unplanned")
+    return len(queries)
+
+
+def compare(client, index, unplanned, planned, size):
+    # Warm up the backend (caches, connections) before measuring
+    timed_searches(client, index, unplanned[:5], size)
+    timed_searches(client, index, planned[:5], size)
+    unplanned_latencies, unplanned_ids = timed_searches(client, index, unplanned, size)
+    planned_latencies, planned_ids = timed_searches(client, index, planned, size)
+    overlaps = [len(set(a) & set(b)) / len(b) for a, b in zip(planned_ids, unplanned_ids) if b]
+    return {
+        "unplanned_p50_ms": round(percentile(unplanned_latencies, 0.5) * 1000, 2),
+        "unplanned_p95_ms": round(percentile(unplanned_latencies, 0.95) * 1000, 2),
+        "planned_p50_ms": round(percentile(planned_latencies, 0.5) * 1000, 2),
+        "planned_p95_ms": round(percentile(planned_latencies, 0.95) * 1000, 2),
+        f"overlap_at_{size}": round(sum(overlaps) / len(overlaps), 3) if overlaps else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query-log", help="a file with one query per line instead of the synthetic queries")
+    parser.add_argument("--queries", type=int, default=200, help="number of synthetic queries")
+    parser.add_argument("--es-url", help="an Elasticsearch cluster to search as well")
+    parser.add_argument("--results", type=int, default=20, help="size of every search, the overlap is over the top k")
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=10, help="snippets per episode")
+    parser.add_argument("--words", type=int, default=300, help="words per snippet")
+    args = parser.parse_args()
+
+    queries = read_query_log(args.query_log) if args.query_log else make_query_log(args.queries)
+    index = "podcast_bench"
+    with tempfile.TemporaryDirectory() as folder:
+        episode_ids = write_metadata(os.path.join(folder, "metadata.tsv"), args.shows, args.episodes)
+        collector = SnippetCollector()
+        index_snippets(collector, index, episode_ids, args.snippets, args.words)
+        writer = LocalIndexWriter(os.path.join(folder, "local", index))
+        for doc_id, source in collector.documents.items():
+            writer.add(doc_id, source)
+        writer.commit()
+        local = LocalSearchClient(os.path.join(folder, "local"))
+        # The local index has the same document frequencies as the term dictionary the indexer writes
+        dictionary = local.index(index).dictionary
+
+        start = time.perf_counter()
+        unplanned = [plan_es_query(query, "transcript_text")[0] for query in queries]
+        unplanned_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        plans = [plan_es_query(query, "transcript_text", dictionary) for query in queries]
+        planned_seconds = time.perf_counter() - start
+        planned = [query for query, _ in plans]
+        actions = {}
+        for _, explain in plans:
+            for term_plan in explain["terms"]:
+                actions[term_plan["action"]] = actions.get(term_plan["action"], 0) + 1
+
+        checked_without_terms = check_without_terms(local, index, dictionary)
+        backends = {"local": compare(local, index, unplanned, planned, args.results)}
+        if args.es_url:
+            from elasticsearch import Elasticsearch, helpers
+            es = Elasticsearch(args.es_url, request_timeout=60)
+            es.options(ignore_status=404).indices.delete(index=index)
+            es.indices.create(index=index, mappings={"properties": {
+                "show_id": {"type": "keyword", "index": False},
+                "episode_id": {"type": "keyword"},
+                "transcript_text": {"type": "text"},
+                "start_time": {"type": "float", "index": False},
+                "end_time": {"type": "float", "index": False},
+            }})
+            helpers.bulk(es, ({"_index": index, "_id": doc_id, **source}
+                              for doc_id, source in collector.documents.items()))
+            es.indices.refresh(index=index)
+            backends["elasticsearch"] = compare(es, index, unplanned, planned, args.results)
+
+    summary = {
+        "documents": len(collector.documents),
+        "queries": len(queries),
+        "term_actions": actions,
+        "checked_queries_without_terms": checked_without_terms,
+        "planning_overhead_us": round((planned_seconds - unplanned_seconds) / max(1, len(queries)) * 1e6, 1),
+        "backends": backends,
+    }
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,95 @@
+"""
+Compares the transcript readers of the indexer on synthetic files shaped like the dataset: parse time and peak memory.
+Every reader runs in its own process, so that the peak RSS of one reader does not hide the others.
+
+    python bench_reader.py --hours 0.5 1 3
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from synthetic import generate_episode
+from transcript_reader import READERS, get_reader
+
+
+def measure(reader_name, path, repeat):
+    """Measures one reader on one file in the current process.
+
+    Returns:
+        dict: The best parse time, the peak traced Python memory and the peak RSS of the process.
+    """
+    read_segments = get_reader(reader_name)
+    with open(path, "rb") as f:
+        content = f.read()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        segments = read_segments(content)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    read_segments(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "reader": reader_name,
+        "segments": len(segments),
+        "seconds": round(min(timings), 4),
+        "peak_traced_mb": round(peak / 2 ** 20, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, nargs="+", default=[0.5, 1, 3], help="episode lengths")
+    parser.add_argument("--readers", nargs="+", default=list(READERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--measure", nargs=2, metavar=("READER", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.repeat)))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for hours in args.hours:
+            path = os.path.join(folder, f"episode_{hours}h.json")
+            with open(path, "w") as f:
+                json.dump(generate_episode(hours * 3600, random.Random(0)), f)
+
+            reference = None
+            for reader_name in args.readers:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", reader_name, path, "--repeat", str(args.repeat)],
+                    capture_output=True, text=True,
+                )
+                if output.returncode != 0:
+                    print(json.dumps({"hours": hours, "reader": reader_name, "error": output.stderr.strip()[-200:]}))
+                    continue
+                result = json.loads(output.stdout)
+                result.update(hours=hours, file_mb=round(os.path.getsize(path) / 2 ** 20, 1))
+                print(json.dumps(result))
+
+            # The readers have to agree on the segments
+            with open(path, "rb") as f:
+                content = f.read()
+            outputs = []
+            for reader_name in args.readers:
+                try:
+                    outputs.append(get_reader(reader_name)(content))
+                except ValueError:
+                    continue
+            print(json.dumps({"hours": hours, "identical_segments": all(o == outputs[0] for o in outputs)}))
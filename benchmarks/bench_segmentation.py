@@ -0,0 +1,145 @@
+"""
+Measures process_document_overlap on synthetic episodes of growing length and checks that it produces the same
+snippets as the list based implementation it replaced. Also checks that the snippets cover every segment, including
+episodes with segments longer than a snippet, on which the legacy code fails.
+
+    python bench_segmentation.py --hours 1 2 4 8 --document-size 30 120 300
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch
+
+from indexer import PodcastTranscriptIndexer
+from transcript_reader import segments_from_json
+from synthetic import generate_episode
+
+
+def legacy_process_document_overlap(indexer, json_data, document_size):
+    # The implementation before the offset based window: list.pop(0) and a join for every snippet
+    snippets = []
+    doc_start_time_queue = []
+    doc_end_time = 0
+    doc_transcript_text_queue = []
+
+    for result in json_data["results"]:
+        alternative = result["alternatives"][0]
+        if "transcript" not in alternative:
+            continue
+
+        transcript_text = alternative["transcript"]
+        start_time = float(alternative["words"][0]["startTime"][:-1])
+        end_time = float(alternative["words"][-1]["endTime"][:-1])
+        time_len = end_time - start_time
+
+        if doc_transcript_text_queue == []:
+            doc_end_time = end_time
+            doc_transcript_text_queue.append(transcript_text)
+            doc_start_time_queue.append(start_time)
+            continue
+
+        doc_cur_size = doc_end_time - doc_start_time_queue[0]
+        if abs(document_size - doc_cur_size) < abs(document_size - doc_cur_size - time_len):
+            if time_len <= 15:
+                doc_start_time_queue.append(start_time)
+                doc_transcript_text_queue.append(transcript_text)
+                doc_end_time = end_time
+
+            indexer.append_snippets(snippets, "benchmark", "episode", doc_start_time_queue[0], doc_end_time,
+                                    ''.join(doc_transcript_text_queue))
+
+            if time_len > 15:
+                doc_end_time = end_time
+                doc_start_time_queue.append(start_time)
+                doc_transcript_text_queue.append(transcript_text)
+
+            doc_cur_size = doc_end_time - doc_start_time_queue[0]
+            while doc_start_time_queue != [] and doc_transcript_text_queue != [] and document_size < doc_cur_size:
+                doc_start_time_queue.pop(0)
+                doc_transcript_text_queue.pop(0)
+                doc_cur_size = doc_end_time - doc_start_time_queue[0]
+        else:
+            doc_start_time_queue.append(start_time)
+            doc_transcript_text_queue.append(transcript_text)
+
+        doc_end_time = end_time
+
+    doc_transcript_text = ''.join(doc_transcript_text_queue)
+    if doc_transcript_text != "":
+        indexer.append_snippets(snippets, "benchmark", "episode", doc_start_time_queue[0], doc_end_time,
+                                doc_transcript_text)
+    return snippets
+
+
+def covers_segments(snippets, segments):
+    # Whether the text of every segment is part of a snippet that spans its time
+    return all(any(snippet["start_time"] <= start_time and end_time <= snippet["end_time"] and
+                   text in snippet["transcript_text"] for snippet in snippets)
+               for start_time, end_time, text in segments)
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--document-size", type=int, nargs="+", default=[30, 120, 300])
+    parser.add_argument("--min-result-length", type=float, default=2.0,
+                        help="minimum result length in seconds, short results make the window hold more segments")
+    parser.add_argument("--max-result-length", type=float, default=20.0,
+                        help="maximum result length in seconds, the legacy code fails on results longer than a snippet")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    indexer = PodcastTranscriptIndexer(None, None, None, "benchmark", 0, 0, True,
+                                       client=Elasticsearch("http://localhost:9200"))
+    results = []
+    for hours in args.hours:
+        episode = generate_episode(hours * 3600, random.Random(0), min_result_length=args.min_result_length,
+                                   max_result_length=args.max_result_length)
+        for document_size in args.document_size:
+            def run_new():
+                snippets = []
+                indexer.process_document_overlap(segments_from_json(episode), snippets, "show_benchmark",
+                                                 "episode.json", document_size)
+                return snippets
+
+            def run_legacy():
+                return legacy_process_document_overlap(indexer, episode, document_size)
+
+            new = run_new()
+            legacy = run_legacy()
+
+            # Segments of up to twice the snippet length, which the legacy code cannot segment
+            long_segments = segments_from_json(generate_episode(hours * 3600, random.Random(0),
+                                                                max_result_length=2 * document_size))
+            long_snippets = []
+            indexer.process_document_overlap(long_segments, long_snippets, "show_benchmark", "episode.json",
+                                             document_size)
+
+            results.append({
+                "hours": hours,
+                "document_size": document_size,
+                "snippets": len(new),
+                "identical": new == legacy,
+                "covered": covers_segments(new, segments_from_json(episode)),
+                "covered_long_segments": covers_segments(long_snippets, long_segments),
+                "legacy_seconds": round(best_time(run_legacy, args.repeat), 4),
+                "new_seconds": round(best_time(run_new, args.repeat), 4),
+            })
+            # Linear scaling shows as a constant time per hour of audio
+            results[-1]["new_seconds_per_hour"] = round(results[-1]["new_seconds"] / hours, 4)
+            print(json.dumps(results[-1]))
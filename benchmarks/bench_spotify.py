@@ -0,0 +1,51 @@
+"""
+Measures the Spotify episode lookup of the middle-ware with a cold and a warm cache against a local fake Spotify API,
+and checks that warm lookups make no outbound requests.
+
+    python bench_spotify.py --queries 200 --latency 0.05
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from fake_spotify import FakeSpotify
+from spotify import SpotifyClient
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--episodes", type=int, default=2000, help="number of distinct episodes")
+    parser.add_argument("--hits", type=int, default=30, help="episodes per query")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every Spotify request")
+    parser.add_argument("--token-lifetime", type=float, default=3600)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    episode_ids = [f"{i:022x}" for i in range(args.episodes)]
+    queries = [rnd.sample(episode_ids, args.hits) for _ in range(args.queries)]
+
+    with FakeSpotify(latency=args.latency, token_lifetime=args.token_lifetime) as fake, \
+            tempfile.TemporaryDirectory() as folder:
+        cache_path = os.path.join(folder, "spotify-cache.sqlite")
+
+        def run(name, spotify):
+            requests_before = fake.episode_requests + fake.token_requests
+            start = time.perf_counter()
+            for episode_ids_of_query in queries:
+                spotify.get_episodes(episode_ids_of_query)
+            duration = time.perf_counter() - start
+            return {"name": name, "ms_per_query": round(duration / len(queries) * 1000, 2),
+                    "outbound_requests": fake.episode_requests + fake.token_requests - requests_before}
+
+        spotify = SpotifyClient("id", "secret", cache_path=cache_path, api_url=fake.url, accounts_url=fake.url)
+        results = [run("cold cache", spotify), run("warm memory cache", spotify)]
+        # A new process starts with an empty memory cache but finds the episodes on disk
+        restarted = SpotifyClient("id", "secret", cache_path=cache_path, api_url=fake.url, accounts_url=fake.url)
+        results.append(run("warm disk cache", restarted))
+        print(json.dumps(results, indent=2))
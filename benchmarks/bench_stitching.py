@@ -0,0 +1,149 @@
+"""
+Compares one index per clip length with clips stitched at query time from one index of base segments: the size of
+the indices and, for every longer clip length, the search latency of its index against stitching the clips from the
+base segments, and how many hits of the clip index overlap in time with a stitched clip of the same episode. The
+synthetic corpus is indexed into local inverted indices, with --es-url also into a cluster.
+
+    python bench_stitching.py --shows 20 --episodes 10 --lengths 30 120 300 --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch
+
+from bench_local_index import folder_size
+from indexer import IndexTarget, PodcastTranscriptIndexer
+# Found in the app folder, which the indexer adds to the path
+from lexical_query import build_es_query
+from local_index import LocalSearchClient
+from load_test import QUERY_TERMS, percentile
+from search_results import search_options
+from stitching import ClipStitcher
+from synthetic import VOCABULARY, write_corpus
+
+BASE_INDEX = "podcast_stitch_base"
+
+
+def make_queries(nr_queries, seed=0):
+    # Intersections of the rarer terms and phrases of two frequent words
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(nr_queries):
+        queries.append(" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 2))))
+        queries.append('"' + " ".join(rnd.sample(VOCABULARY[:40], 2)) + '"')
+    return [build_es_query(query, "transcript_text")["query"] for query in queries]
+
+
+def build_indices(corpus, targets, client=None, local_index=None):
+    indexer = PodcastTranscriptIndexer(None, None, corpus, BASE_INDEX, 10000, 0, False, client=client,
+                                       targets=targets, local_index=local_index, term_dictionary=None)
+    indexer.ensure_index_exists()
+    indexer.process_files()
+
+
+def overlaps(hit, clips):
+    # Whether a hit of a clip index overlaps in time with a stitched clip of its episode
+    source = hit["_source"]
+    return any(clip["_source"]["episode_id"] == source["episode_id"] and
+               clip["_source"]["start_time"] < source["end_time"] and source["start_time"] < clip["_source"]["end_time"]
+               for clip in clips)
+
+
+def compare(client, index_names, stitcher, queries, args):
+    options = search_options({})
+    results = []
+    for length in args.lengths:
+        if not stitcher.stitches(length):
+            continue
+        index_latencies, stitched_latencies, agreement = [], [], []
+        for query in queries[:5]:
+            client.search(index=index_names[length], query=query, size=args.results)
+            stitcher.search(client, query, str(length), args.results, options)
+        for query in queries:
+            start = time.perf_counter()
+            index_hits = client.search(index=index_names[length], query=query, size=args.results)["hits"]["hits"]
+            index_latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            clips = stitcher.search(client, query, str(length), args.results, options)["hits"]["hits"]
+            stitched_latencies.append(time.perf_counter() - start)
+            if index_hits:
+                agreement.append(sum(overlaps(hit, clips) for hit in index_hits) / len(index_hits))
+        index_latencies.sort()
+        stitched_latencies.sort()
+        stitched_p95 = percentile(stitched_latencies, 0.95) * 1000
+        results.append({
+            "length": length,
+            "index_p50_ms": round(percentile(index_latencies, 0.5) * 1000, 2),
+            "index_p95_ms": round(percentile(index_latencies, 0.95) * 1000, 2),
+            "stitched_p50_ms": round(percentile(stitched_latencies, 0.5) * 1000, 2),
+            "stitched_p95_ms": round(stitched_p95, 2),
+            "within_budget": stitched_p95 <= args.budget_ms,
+            f"agreement_at_{args.results}": round(sum(agreement) / len(agreement), 3) if agreement else None,
+        })
+    return results
+
+
+def storage(sizes, index_names):
+    clip_bytes = sum(sizes[index_names[length]] for length in index_names)
+    return {
+        "clip_index_bytes": {index_names[length]: sizes[index_names[length]] for length in index_names},
+        "base_index_bytes": sizes[BASE_INDEX],
+        "storage_ratio": round(clip_bytes / sizes[BASE_INDEX], 2) if sizes[BASE_INDEX] else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[30, 120, 300], help="clip lengths in seconds")
+    parser.add_argument("--base-seconds", type=int, default=30, help="length of the base segments")
+    parser.add_argument("--overlap", action="store_true", help="compare with clip indices with overlap")
+    parser.add_argument("--queries", type=int, default=50, help="queries of every shape")
+    parser.add_argument("--results", type=int, default=10, help="clips per search")
+    parser.add_argument("--budget-ms", type=float, default=100, help="p95 latency budget of a stitched search")
+    parser.add_argument("--es-url", help="an Elasticsearch cluster to measure as well")
+    parser.add_argument("--shows", type=int, default=20)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--duration", type=float, default=1800, help="length of every episode in seconds")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    prefix = "podcast_stitch_overlap_" if args.overlap else "podcast_stitch_"
+    index_names = {length: f"{prefix}{length}" for length in args.lengths}
+    targets = [IndexTarget(length, args.overlap, index_names[length]) for length in args.lengths]
+    targets.append(IndexTarget(args.base_seconds, False, BASE_INDEX, True))
+    stitcher = ClipStitcher(BASE_INDEX, args.base_seconds)
+    queries = make_queries(args.queries)
+
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = os.path.join(folder, "corpus")
+        write_corpus(corpus, args.shows, args.episodes, args.duration)
+        local_folder = os.path.join(folder, "local")
+        build_indices(corpus, targets, local_index=local_folder)
+        sizes = {target.index_name: folder_size(os.path.join(local_folder, target.index_name)) for target in targets}
+        local = LocalSearchClient(local_folder)
+        backends = {"local": dict(storage(sizes, index_names), lengths=compare(local, index_names, stitcher, queries,
+                                                                               args))}
+
+        if args.es_url:
+            es = Elasticsearch(args.es_url, request_timeout=600)
+            for target in targets:
+                es.options(ignore_status=404).indices.delete(index=target.index_name)
+            build_indices(corpus, targets, client=es)
+            es.indices.refresh(index=",".join(target.index_name for target in targets))
+            sizes = {target.index_name: es.indices.stats(index=target.index_name)["_all"]["primaries"]["store"]
+                     ["size_in_bytes"] for target in targets}
+            backends["elasticsearch"] = dict(storage(sizes, index_names),
+                                             lengths=compare(es, index_names, stitcher, queries, args))
+
+    summary = {"episodes": args.shows * args.episodes, "overlap": args.overlap, "backends": backends}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,149 @@
+"""
+Compares indices that store the text of every snippet with indices whose snippets only store the position of their
+text in a compressed text store of the episodes (indexer.py --text-store): the size of the indices (and of the text
+store), and the latency of fetching the hits of a search with their text, with highlights and of getting snippets by
+id. The synthetic corpus is indexed into local inverted indices, with --es-url also into a cluster. The text store is
+shared by the indices of both backends.
+
+    python bench_text_store.py --shows 20 --episodes 10 --lengths 30 120 300 --overlap --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch
+
+from bench_local_index import folder_size
+from bench_stitching import make_queries
+from indexer import IndexTarget, PodcastTranscriptIndexer
+# Found in the app folder, which the indexer adds to the path
+from local_index import LocalSearchClient
+from load_test import percentile
+from search_results import search_args, search_options, SNIPPET_TEXT_FIELDS
+from synthetic import write_corpus
+from text_store import TextStoreClient
+
+FETCHES = {
+    "text": search_options({}),
+    "highlight": search_options({"highlight": "true"}),
+}
+
+
+def build_indices(corpus, targets, client=None, local_index=None, text_store=None):
+    indexer = PodcastTranscriptIndexer(None, None, corpus, targets[0].index_name, 10000, 0, False, client=client,
+                                       targets=targets, local_index=local_index, term_dictionary=None,
+                                       text_store=text_store)
+    indexer.ensure_index_exists()
+    indexer.process_files()
+
+
+def summarize(latencies):
+    latencies.sort()
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+def fetch(client, index_name, queries, args):
+    # Latency of the searches of every query with the text or the highlights of the hits, and of the gets of their
+    # best snippets
+    results = {}
+    snippet_ids = []
+    for name, options in FETCHES.items():
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            response = client.search(index=index_name, query=query, **search_args(args.results, **options))
+            latencies.append(time.perf_counter() - start)
+            snippet_ids.extend(hit["_id"] for hit in response["hits"]["hits"][:1])
+        results[name] = summarize(latencies)
+    latencies = []
+    for snippet_id in snippet_ids:
+        start = time.perf_counter()
+        client.get(index=index_name, id=snippet_id, source=SNIPPET_TEXT_FIELDS)
+        latencies.append(time.perf_counter() - start)
+    results["get"] = summarize(latencies)
+    return results
+
+
+def compare(client, index_names, queries, args):
+    results = {}
+    for length, index_name in index_names.items():
+        for query in queries[:5]:
+            client.search(index=index_name, query=query, size=args.results)
+        results[length] = fetch(client, index_name, queries, args)
+    return results
+
+
+def measure(clients, sizes, text_store_bytes, index_names, queries, args):
+    # The sizes, and the fetches of the indices with the text against those with the text store, per clip length
+    stored = sum(sizes["stored"].values())
+    located = sum(sizes["text_store"].values())
+    fetches = {mode: compare(clients[mode], index_names[mode], queries, args) for mode in clients}
+    return {
+        "stored_index_bytes": sizes["stored"],
+        "text_store_index_bytes": sizes["text_store"],
+        "text_store_bytes": text_store_bytes,
+        "storage_ratio": round(stored / (located + text_store_bytes), 2),
+        "lengths": [dict({"length": length}, **{mode: fetches[mode][length] for mode in clients})
+                    for length in args.lengths],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[30, 120, 300], help="clip lengths in seconds")
+    parser.add_argument("--overlap", action="store_true", help="build the indices with overlap")
+    parser.add_argument("--queries", type=int, default=50, help="queries of every shape")
+    parser.add_argument("--results", type=int, default=10, help="hits per search")
+    parser.add_argument("--es-url", help="an Elasticsearch cluster to measure as well")
+    parser.add_argument("--shows", type=int, default=20)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--duration", type=float, default=1800, help="length of every episode in seconds")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    prefix = "bench_text_overlap_" if args.overlap else "bench_text_"
+    modes = {"stored": prefix, "text_store": prefix + "located_"}
+    index_names = {mode: {length: f"{modes[mode]}{length}" for length in args.lengths} for mode in modes}
+    targets = {mode: [IndexTarget(length, args.overlap, index_names[mode][length]) for length in args.lengths]
+               for mode in modes}
+    queries = make_queries(args.queries)
+
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = os.path.join(folder, "corpus")
+        write_corpus(corpus, args.shows, args.episodes, args.duration)
+        local_folder = os.path.join(folder, "local")
+        text_store = os.path.join(folder, "text-store")
+        build_indices(corpus, targets["stored"], local_index=local_folder)
+        build_indices(corpus, targets["text_store"], local_index=local_folder, text_store=text_store)
+        sizes = {mode: {name: folder_size(os.path.join(local_folder, name)) for name in index_names[mode].values()}
+                 for mode in modes}
+        local = LocalSearchClient(local_folder)
+        clients = {"stored": local, "text_store": TextStoreClient(local, text_store)}
+        backends = {"local": measure(clients, sizes, folder_size(text_store), index_names, queries, args)}
+
+        if args.es_url:
+            es = Elasticsearch(args.es_url, request_timeout=600)
+            for mode in modes:
+                for index_name in index_names[mode].values():
+                    es.options(ignore_status=404).indices.delete(index=index_name)
+                build_indices(corpus, targets[mode], client=es,
+                              text_store=text_store if mode == "text_store" else None)
+                es.indices.refresh(index=",".join(index_names[mode].values()))
+            sizes = {mode: {name: es.indices.stats(index=name)["_all"]["primaries"]["store"]["size_in_bytes"]
+                            for name in index_names[mode].values()} for mode in modes}
+            clients = {"stored": es, "text_store": TextStoreClient(es, text_store)}
+            backends["elasticsearch"] = measure(clients, sizes, folder_size(text_store), index_names, queries, args)
+
+    summary = {"episodes": args.shows * args.episodes, "overlap": args.overlap, "backends": backends}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
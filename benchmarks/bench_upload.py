@@ -0,0 +1,89 @@
+"""
+Compares the old synchronous batch upload with the pipelined uploader against a local stand-in bulk endpoint, and
+times a bulk load (--bulk-load of the indexer) with the parsing spread over --workers processes.
+
+    python bench_upload.py --shows 20 --episodes 10 --reject-rate 0.01 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer"))
+
+from elasticsearch import Elasticsearch, helpers
+
+from fake_elasticsearch import FakeElasticsearch
+from indexer import PodcastTranscriptIndexer
+from synthetic import write_corpus
+
+
+def run_batched(indexer, size_batch):
+    # The upload loop of the indexer before the pipelined uploader: parsing pauses for every bulk request
+    transcript_snippets = []
+    for _, _, snippets, _, _ in indexer.iter_processed_files():
+        transcript_snippets.extend(snippets)
+        if len(transcript_snippets) >= size_batch:
+            helpers.bulk(indexer.client, transcript_snippets, index=indexer.index_name)
+            transcript_snippets = []
+    if len(transcript_snippets) > 0:
+        helpers.bulk(indexer.client, transcript_snippets, index=indexer.index_name)
+
+
+def measure(name, function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"name": name, "seconds": round(duration, 3), "peak_mb": round(peak / 2 ** 20, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=1800)
+    parser.add_argument("--document-size", type=int, default=120)
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="fraction of bulk items rejected with 429")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every bulk request")
+    parser.add_argument("--size-batch", type=int, default=50000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--upload-threads", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=2, help="processes parsing the files of the bulk load")
+    args = parser.parse_args()
+    # Like on macOS and Windows, the workers are spawned, so the indexer has to be pickled to them
+    multiprocessing.set_start_method("spawn")
+
+    with tempfile.TemporaryDirectory() as folder, \
+            FakeElasticsearch(reject_rate=args.reject_rate, latency=args.latency) as fake:
+        write_corpus(folder, args.shows, args.episodes, args.duration)
+        client = Elasticsearch(fake.url)
+
+        def make_indexer(index_name, size_batch, **kwargs):
+            return PodcastTranscriptIndexer(None, None, folder, index_name, size_batch, args.document_size, True,
+                                            upload_threads=args.upload_threads, client=client, **kwargs)
+
+        results = []
+        if args.reject_rate == 0:
+            # helpers.bulk raises on the first rejected document, so the old loop can only run without rejections
+            batched = make_indexer("batched", args.size_batch)
+            results.append(measure("batched helpers.bulk", lambda: run_batched(batched, args.size_batch)))
+
+        pipelined = make_indexer("pipelined", args.queue_size)
+        results.append(measure("pipelined streaming_bulk", pipelined.process_files))
+
+        bulk_loaded = make_indexer("bulk_loaded", args.queue_size, bulk_load=True, workers=args.workers)
+        bulk_loaded.ensure_index_exists()
+        results.append(measure(f"bulk_loaded with {args.workers} workers", bulk_loaded.process_files))
+
+        for result in results:
+            index = result["name"].split()[0]
+            result["documents"] = len(fake.indices.get(fake.aliases.get(index, index), {}))
+        print(json.dumps({"bulk_requests": fake.bulk_requests, "rejected_items": fake.rejected,
+                          "results": results}, indent=2))
@@ -0,0 +1,174 @@
+"""
+Measures the semantic search on the CPU:
+- the embedding throughput of the model for snippets (batched) and the latency of embedding one query,
+- the vector index on clustered synthetic vectors: build time, size, and latency and recall@k of the IVF search for
+  several nprobe values against the exhaustive search,
+- the latency of the hybrid mode (lexical search, query embedding, vector search and fusion) against the lexical
+  search alone, on the local index of synthetic snippets.
+The hashing embedder runs without a model download, --model sentence-transformers/all-MiniLM-L6-v2 measures the model
+the indexer uses by default.
+
+    python bench_vector.py --vectors 200000 --model sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from bench_local_index import SnippetCollector, folder_size
+from embeddings import get_embedder, normalize, np
+from hybrid_search import hybrid_search
+from lexical_query import build_es_query
+from load_test import QUERY_TERMS, index_snippets, percentile
+from local_index import LocalIndexWriter, LocalSearchClient
+from search_results import search_options
+from synthetic import write_metadata
+from vector_index import VectorIndex, VectorIndexWriter
+
+
+def clustered_vectors(nr_vectors, dimensions, nr_topics, noise, seed=0):
+    # Normalized vectors between two random topic directions each, like embeddings of snippets touching a few of a
+    # limited set of topics, so that the vectors are spread continuously instead of in separated clusters
+    rng = np.random.default_rng(seed)
+    topics = normalize(rng.normal(size=(nr_topics, dimensions)).astype(np.float32))
+    weights = rng.random((nr_vectors, 1), dtype=np.float32)
+    vectors = (weights * topics[rng.integers(0, nr_topics, nr_vectors)]
+               + (1 - weights) * topics[rng.integers(0, nr_topics, nr_vectors)])
+    return normalize(vectors + noise * rng.normal(size=(nr_vectors, dimensions)).astype(np.float32))
+
+
+def milliseconds(latencies, fraction):
+    return round(percentile(sorted(latencies), fraction) * 1000, 3)
+
+
+def bench_embeddings(embedder, texts, queries, batch_size):
+    start = time.perf_counter()
+    for batch_start in range(0, len(texts), batch_size):
+        embedder.encode(texts[batch_start:batch_start + batch_size])
+    snippet_seconds = time.perf_counter() - start
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embedder.encode([query])
+        latencies.append(time.perf_counter() - start)
+    return {
+        "model": embedder.name,
+        "dimensions": embedder.dimensions,
+        "snippets_per_second": round(len(texts) / snippet_seconds, 1),
+        "query_p50_ms": milliseconds(latencies, 0.5),
+        "query_p95_ms": milliseconds(latencies, 0.95),
+    }
+
+
+def bench_ann(folder, args):
+    vectors = clustered_vectors(args.vectors + args.queries, args.dimensions, args.topics, args.noise)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+    start = time.perf_counter()
+    writer = VectorIndexWriter(os.path.join(folder, "ann"), "synthetic", args.dimensions,
+                               nr_clusters=args.clusters or int(np.sqrt(args.vectors)))
+    for number, vector in enumerate(vectors):
+        writer.add(str(number), vector)
+    writer.commit()
+    build_seconds = time.perf_counter() - start
+    index = VectorIndex(os.path.join(folder, "ann"))
+
+    exact = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        exact.append({doc_id for doc_id, _ in index.search(query, args.k, nprobe=len(index.centroids))})
+        latencies.append(time.perf_counter() - start)
+    searches = [{"nprobe": "exhaustive", "p50_ms": milliseconds(latencies, 0.5),
+                 "p95_ms": milliseconds(latencies, 0.95), f"recall_at_{args.k}": 1.0}]
+    for nprobe in args.nprobe:
+        latencies = []
+        recalls = []
+        for query, expected in zip(queries, exact):
+            start = time.perf_counter()
+            found = {doc_id for doc_id, _ in index.search(query, args.k, nprobe=nprobe)}
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(found & expected) / len(expected))
+        searches.append({"nprobe": nprobe, "p50_ms": milliseconds(latencies, 0.5),
+                         "p95_ms": milliseconds(latencies, 0.95),
+                         f"recall_at_{args.k}": round(sum(recalls) / len(recalls), 4)})
+    return {
+        "vectors": args.vectors,
+        "dimensions": args.dimensions,
+        "clusters": len(index.centroids),
+        "build_seconds": round(build_seconds, 2),
+        "index_bytes": folder_size(os.path.join(folder, "ann")),
+        "searches": searches,
+    }
+
+
+def bench_hybrid(folder, embedder, queries, args):
+    index = "podcast_bench"
+    episode_ids = write_metadata(os.path.join(folder, "metadata.tsv"), args.shows, args.episodes)
+    collector = SnippetCollector()
+    index_snippets(collector, index, episode_ids, args.snippets, args.words)
+    writer = LocalIndexWriter(os.path.join(folder, "local", index))
+    vector_writer = VectorIndexWriter(os.path.join(folder, "vectors", index), embedder.name, embedder.dimensions)
+    ids = list(collector.documents)
+    texts = [collector.documents[doc_id]["transcript_text"] for doc_id in ids]
+    for batch_start in range(0, len(ids), args.batch_size):
+        batch = slice(batch_start, batch_start + args.batch_size)
+        for doc_id, vector in zip(ids[batch], embedder.encode(texts[batch])):
+            vector_writer.add(doc_id, vector)
+    for doc_id, source in collector.documents.items():
+        writer.add(doc_id, source)
+    writer.commit()
+    vector_writer.commit()
+    client = LocalSearchClient(os.path.join(folder, "local"))
+    vector_index = VectorIndex(os.path.join(folder, "vectors", index))
+
+    results = {}
+    for mode in ["lexical", "hybrid"]:
+        options = search_options({"hybrid": "true" if mode == "hybrid" else "false"})
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            lexical_query = build_es_query(query, "transcript_text")["query"]
+            if mode == "hybrid":
+                hybrid_search(client, vector_index, index, lexical_query, query, args.k, options)
+            else:
+                client.search(index=index, query=lexical_query, size=args.k)
+            latencies.append(time.perf_counter() - start)
+        results[f"{mode}_p50_ms"] = milliseconds(latencies, 0.5)
+        results[f"{mode}_p95_ms"] = milliseconds(latencies, 0.95)
+    return dict(results, documents=len(ids)), texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="hashing", help="embedding model, see app/embeddings.py")
+    parser.add_argument("--batch-size", type=int, default=256, help="snippets embedded at once")
+    parser.add_argument("--vectors", type=int, default=100000, help="synthetic vectors of the ANN benchmark")
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=50, help="topic directions of the synthetic vectors")
+    parser.add_argument("--noise", type=float, default=0.03, help="spread of the vectors around their topic")
+    parser.add_argument("--clusters", type=int, help="IVF clusters, sqrt(vectors) by default")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--k", type=int, default=10, help="results per search, recall is measured at k")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--shows", type=int, default=20)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=10, help="snippets per episode")
+    parser.add_argument("--words", type=int, default=300, help="words per snippet")
+    args = parser.parse_args()
+
+    embedder = get_embedder(args.model)
+    rnd = random.Random(0)
+    queries = [" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 3))) for _ in range(args.queries)]
+    with tempfile.TemporaryDirectory() as folder:
+        hybrid, texts = bench_hybrid(folder, embedder, queries, args)
+        summary = {
+            "embeddings": bench_embeddings(embedder, texts, queries, args.batch_size),
+            "ann": bench_ann(folder, args),
+            "hybrid": hybrid,
+        }
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,106 @@
+"""
+Measures the expansion of typical wildcard patterns (prefix, leading wildcard, single character and infix) with the
+term dictionary against a scan of all terms, which is what a leading wildcard costs Elasticsearch on every request.
+With --es-url the same patterns are also sent to a cluster as raw wildcard queries and as expanded terms queries.
+
+    python bench_wildcard.py --terms 200000 --es-url http://localhost:9200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from fnmatch import fnmatchcase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from lexical_query import wildcard_query
+from load_test import percentile
+from term_dictionary import TermDictionary
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "ha", "ke", "li", "mo", "nu", "pa", "re", "si", "to", "vu", "wa",
+             "ing", "er", "ly", "th", "ar", "on", "st", "ea"]
+
+
+def synthetic_vocabulary(nr_terms, seed=0):
+    # Pseudo words of 1 to 5 syllables with Zipf distributed document frequencies
+    rnd = random.Random(seed)
+    terms = set()
+    while len(terms) < nr_terms:
+        terms.add("".join(rnd.choices(SYLLABLES, k=rnd.randint(1, 5))))
+    terms = sorted(terms)
+    ranks = list(range(1, len(terms) + 1))
+    rnd.shuffle(ranks)
+    return terms, [max(1, 1000000 // rank) for rank in ranks]
+
+
+def make_patterns(terms, nr_patterns, seed=0):
+    rnd = random.Random(seed)
+    patterns = {"prefix": [], "leading": [], "single": [], "infix": []}
+    for _ in range(nr_patterns):
+        term = rnd.choice([term for term in rnd.sample(terms, 20) if len(term) >= 5] or terms)
+        patterns["prefix"].append(term[:3] + "*")
+        patterns["leading"].append("*" + term[-4:])
+        patterns["single"].append(term[:2] + "?" + term[3:])
+        patterns["infix"].append("*" + term[1:4] + "*")
+    return patterns
+
+
+def timed(function, values):
+    latencies = []
+    results = []
+    for value in values:
+        start = time.perf_counter()
+        results.append(function(value))
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--terms", type=int, default=200000, help="size of the synthetic term dictionary")
+    parser.add_argument("--patterns", type=int, default=50, help="patterns per pattern type")
+    parser.add_argument("--max-expansions", type=int, default=1024)
+    parser.add_argument("--es-url", help="an Elasticsearch cluster with a podcast index to send the queries to")
+    parser.add_argument("--index", default="podcast_120", help="the index on the cluster")
+    parser.add_argument("--term-dictionary", help="the term dictionary of the index on the cluster, written by the "
+                                                  "indexer, instead of the synthetic one")
+    args = parser.parse_args()
+
+    if args.term_dictionary:
+        dictionary = TermDictionary.load(args.term_dictionary)
+    else:
+        dictionary = TermDictionary(*synthetic_vocabulary(args.terms))
+    # Build the reversed terms before measuring, like a middle-ware that served a request before
+    dictionary.matching_ordinals("*a")
+
+    es = None
+    if args.es_url:
+        from elasticsearch import Elasticsearch
+        es = Elasticsearch(args.es_url, request_timeout=60)
+
+    results = []
+    for pattern_type, patterns in make_patterns(dictionary.terms, args.patterns).items():
+        scan_latencies, scanned = timed(
+            lambda pattern: [term for term in dictionary.terms if fnmatchcase(term, pattern)], patterns)
+        expand_latencies, expanded = timed(lambda pattern: dictionary.expand(pattern, args.max_expansions), patterns)
+        result = {
+            "pattern_type": pattern_type,
+            "example": patterns[0],
+            "mean_terms": round(sum(len(terms) for terms in scanned) / len(scanned), 1),
+            "scan_p50_ms": round(percentile(scan_latencies, 0.5) * 1000, 3),
+            "expand_p50_ms": round(percentile(expand_latencies, 0.5) * 1000, 3),
+            "expand_p95_ms": round(percentile(expand_latencies, 0.95) * 1000, 3),
+            "truncated": sum(len(a) > len(b) for a, b in zip(scanned, expanded)),
+        }
+        if es is not None:
+            for name, term_dictionary in [("es_wildcard", None), ("es_expanded", dictionary)]:
+                latencies, _ = timed(lambda pattern: es.search(
+                    index=args.index, size=20,
+                    query=wildcard_query(pattern, "transcript_text", term_dictionary, args.max_expansions)), patterns)
+                result[f"{name}_p50_ms"] = round(percentile(latencies, 0.5) * 1000, 2)
+                result[f"{name}_p95_ms"] = round(percentile(latencies, 0.95) * 1000, 2)
+        results.append(result)
+
+    print(json.dumps(results, indent=2))
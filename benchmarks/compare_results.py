@@ -0,0 +1,135 @@
+"""
+Compares the JSON results of a benchmark run with a baseline and reports the metrics that got worse by more than a
+threshold. Works with the output of every benchmark in this folder (--output, or the printed JSON or JSON lines
+redirected to a file), or with two folders of result files with the same names. Latencies, times and sizes (_ms, _us,
+seconds, bytes) are better when lower, throughputs, recall and overlap when higher, and checks like "identical" must
+stay true.
+Exits with status 1 if a metric regressed, e.g. to fail a CI job.
+
+    python bench_micro.py --output results/micro.json
+    python compare_results.py baseline/micro.json results/micro.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import sys
+
+# Fields that identify an entry of a list of results, e.g. {"name": "group_full", ...} or {"hours": 2, ...}
+ID_FIELDS = ("name", "shape", "pattern_type", "server", "mode", "reader", "nprobe", "hours", "document_size",
+             "clip_length", "concurrency", "backend", "model")
+LOWER_IS_BETTER = ("_ms", "_us", "us_per_call", "seconds", "bytes", "errors", "rss", "memory")
+HIGHER_IS_BETTER = ("per_second", "recall", "overlap", "speedup", "hit_rate", "ratio")
+CHECKS = ("identical", "same", "equal")
+
+
+def entry_label(entry, position):
+    labels = [f"{field}={entry[field]}" for field in ID_FIELDS if field in entry]
+    return ",".join(labels) if labels else str(position)
+
+
+def flatten(result, path=""):
+    # The scalar metrics of a result with their paths, list entries are labelled by their identifying fields
+    if isinstance(result, dict):
+        for key, value in result.items():
+            yield from flatten(value, f"{path}.{key}" if path else key)
+    elif isinstance(result, list):
+        for position, value in enumerate(result):
+            label = entry_label(value, position) if isinstance(value, dict) else str(position)
+            yield from flatten(value, f"{path}[{label}]")
+    elif isinstance(result, (bool, int, float)):
+        yield path, result
+
+
+def direction(path):
+    # 1 if higher is better, -1 if lower is better, 0 for checks and None if the metric is not judged
+    name = path.rsplit(".", 1)[-1].lower()
+    if any(name.endswith(check) or name == check for check in CHECKS):
+        return 0
+    if any(pattern in name for pattern in HIGHER_IS_BETTER):
+        return 1
+    if any(pattern in name for pattern in LOWER_IS_BETTER):
+        return -1
+    return None
+
+
+def compare(baseline, current, threshold):
+    """Compares the metrics of two results.
+
+    Args:
+        baseline: The parsed JSON of the baseline run.
+        current: The parsed JSON of the current run.
+        threshold (float): The relative change that counts as a regression or an improvement.
+
+    Returns:
+        list: Dictionaries with the path, both values, the relative change and the status of every compared metric.
+    """
+    baseline_metrics = dict(flatten(baseline))
+    rows = []
+    for path, value in flatten(current):
+        if path not in baseline_metrics:
+            continue
+        before = baseline_metrics[path]
+        sign = direction(path)
+        if sign is None:
+            continue
+        if sign == 0:
+            status = "regressed" if before and not value else "ok"
+            rows.append({"metric": path, "baseline": before, "current": value, "change": None, "status": status})
+            continue
+        change = (value - before) / abs(before) if before else (0.0 if value == before else float("inf"))
+        if change * sign < -threshold:
+            status = "regressed"
+        elif change * sign > threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append({"metric": path, "baseline": before, "current": value, "change": round(change, 4),
+                     "status": status})
+    return rows
+
+
+def load_result(path):
+    # A JSON document, or JSON lines like the output of bench_segmentation.py and bench_reader.py
+    with open(path) as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def load_pairs(baseline_path, current_path):
+    # Pairs of (name, baseline, current) for two files or the files with the same name in two folders
+    if not os.path.isdir(baseline_path):
+        return [(os.path.basename(current_path), baseline_path, current_path)]
+    names = sorted(name for name in os.listdir(current_path)
+                   if name.endswith((".json", ".jsonl")) and os.path.exists(os.path.join(baseline_path, name)))
+    return [(name, os.path.join(baseline_path, name), os.path.join(current_path, name)) for name in names]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", help="the results of the baseline run, a JSON file or a folder of JSON files")
+    parser.add_argument("current", help="the results to check, a JSON file or a folder of JSON files")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change that counts as a regression, 0.1 is 10%%")
+    parser.add_argument("--all", action="store_true", help="print unchanged metrics as well")
+    parser.add_argument("--output", help="write the comparison as JSON to this file")
+    args = parser.parse_args()
+
+    report = {}
+    regressions = 0
+    for name, baseline_file, current_file in load_pairs(args.baseline, args.current):
+        rows = compare(load_result(baseline_file), load_result(current_file), args.threshold)
+        report[name] = rows
+        regressions += sum(row["status"] == "regressed" for row in rows)
+        for row in rows:
+            if args.all or row["status"] != "ok":
+                change = "" if row["change"] is None else f"{row['change']:+.1%}"
+                print(f"{row['status']:<10} {name}: {row['metric']}  {row['baseline']} -> {row['current']}  {change}")
+
+    print(f"{regressions} regressions in {sum(len(rows) for rows in report.values())} compared metrics")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if regressions else 0)
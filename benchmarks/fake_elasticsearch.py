@@ -0,0 +1,512 @@
+"""
+A local stand-in for the parts of the Elasticsearch REST API used by the indexer and the middle-ware, for benchmarks
+without a cluster.
+"""
+from collections import Counter
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+# The analyzer, highlighter and _source filtering are shared with the local index of the middle-ware
+from local_index import filter_source, highlight_fragments, query_terms, tokenize
+
+
+class StandInServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops connections when many clients connect at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeElasticsearch:
+    """
+    Serves cluster info, index creation (with _source excludes) and deletion, index settings, aliases, the _bulk
+    endpoint, document gets and a simple _search and _msearch from memory on localhost. Refreshes and force-merges are
+    acknowledged without doing anything. Searches support the match, match_phrase, wildcard, terms, ids and bool
+    queries of the middle-ware, scored by term frequency, with _source filtering, highlighting, collapse with inner
+    hits, cardinality aggregations and paging through points in time with search_after.
+    """
+
+    def __init__(self, port=0, reject_rate=0.0, latency=0.0, seed=0):
+        """Initializes a FakeElasticsearch instance.
+
+        Args:
+            port (int): The port to listen on, 0 picks a free port.
+            reject_rate (float): The fraction of bulk items rejected with 429 to exercise retries.
+            latency (float): Seconds every request is delayed, to simulate a remote cluster.
+            seed (int): The seed for the rejected items.
+        """
+        self.reject_rate = reject_rate
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.tokens = {}
+        self.postings = {}
+        self.wildcard_terms = {}
+        # Per point in time id the index and the position (_shard_doc) of every document when it was opened
+        self.points_in_time = {}
+        # The index of every alias and the settings every index was created or updated with
+        self.aliases = {}
+        self.settings = {}
+        # Per index the fields left out of _source by its mapping, they are indexed but not returned
+        self.source_excludes = {}
+        self.forcemerges = 0
+        self.bulk_requests = 0
+        self.search_requests = 0
+        self.rejected = 0
+        self.server = StandInServer(("127.0.0.1", port), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def bulk(self, default_index, body):
+        """Applies the actions of a bulk request.
+
+        Args:
+            default_index (str): The index from the URL, if any.
+            body (bytes): The NDJSON request body.
+
+        Returns:
+            dict: The bulk response.
+        """
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = []
+        position = 0
+        with self.lock:
+            self.bulk_requests += 1
+            while position < len(lines):
+                (op_type, meta), = lines[position].items()
+                position += 1
+                source = None
+                if op_type != "delete":
+                    source = lines[position]
+                    position += 1
+
+                index = self.aliases.get(meta.get("_index", default_index), meta.get("_index", default_index))
+                doc_id = meta.get("_id") or str(self.random.getrandbits(64))
+                documents = self.indices.setdefault(index, {})
+                item = {"_index": index, "_id": doc_id}
+                self.tokens.pop((index, doc_id), None)
+                self._drop_postings(index)
+
+                if self.random.random() < self.reject_rate:
+                    self.rejected += 1
+                    item.update(status=429, error={"type": "es_rejected_execution_exception",
+                                                   "reason": "rejected execution"})
+                elif op_type == "delete":
+                    found = documents.pop(doc_id, None) is not None
+                    item.update(status=200 if found else 404, result="deleted" if found else "not_found")
+                else:
+                    excludes = self.source_excludes.get(index, ())
+                    for field in excludes:
+                        self._tokens(index, doc_id, source, field)
+                    documents[doc_id] = {field: value for field, value in source.items() if field not in excludes}
+                    item.update(status=201, result="created")
+                items.append({op_type: item})
+
+        errors = any(item[op]["status"] >= 300 for item in items for op in item)
+        return {"took": 1, "errors": errors, "items": items}
+
+    def add_documents(self, index, documents):
+        """Stores documents without going through _bulk.
+
+        Args:
+            index (str): The index name.
+            documents (dict): Map of document id to source.
+        """
+        with self.lock:
+            self.indices.setdefault(index, {}).update(documents)
+            for doc_id in documents:
+                self.tokens.pop((index, doc_id), None)
+            self._drop_postings(index)
+
+    def _tokens(self, index, doc_id, source, field):
+        # Tokens are kept per document until it is replaced or deleted
+        fields = self.tokens.setdefault((index, doc_id), {})
+        if field not in fields:
+            tokens = tokenize(str(source.get(field, "")))
+            fields[field] = (" " + " ".join(tokens) + " ", Counter(tokens))
+        return fields[field]
+
+    def _drop_postings(self, index):
+        for key in [key for key in self.postings if key[0] == index]:
+            del self.postings[key]
+        for key in [key for key in self.wildcard_terms if key[0] == index]:
+            del self.wildcard_terms[key]
+
+    def _postings(self, index, field):
+        # Map of term to the ids of the documents containing it, built on the first search after a change
+        key = (index, field)
+        postings = self.postings.get(key)
+        if postings is None:
+            postings = {}
+            for doc_id, source in self.indices[index].items():
+                for term in self._tokens(index, doc_id, source, field)[1]:
+                    postings.setdefault(term, set()).add(doc_id)
+            self.postings[key] = postings
+        return postings
+
+    def _wildcard_terms(self, index, field, pattern):
+        key = (index, field, str(pattern).lower())
+        terms = self.wildcard_terms.get(key)
+        if terms is None:
+            terms = [term for term in self._postings(index, field) if fnmatchcase(term, key[2])]
+            self.wildcard_terms[key] = terms
+        return terms
+
+    def candidates(self, query, index):
+        """Returns the ids of the documents that can match a query, None for all documents."""
+        (query_type, clause), = query.items()
+        if query_type == "bool":
+            required = [self.candidates(must, index) for must in clause.get("must", []) + clause.get("filter", [])]
+            should = clause.get("should", [])
+            if should and int(clause.get("minimum_should_match", 0 if required else 1)) > 0:
+                alternatives = [self.candidates(query, index) for query in should]
+                required.append(None if None in alternatives else set().union(*alternatives))
+            required = [ids for ids in required if ids is not None]
+            return set.intersection(*required) if required else None
+        if query_type == "ids":
+            return set(clause["values"]) & set(self.indices[index])
+        if query_type not in ("match", "match_phrase", "wildcard", "terms"):
+            return None
+
+        (field, value), = clause.items()
+        any_term = not isinstance(value, dict) or value.get("operator", "or").lower() == "or"
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        postings = self._postings(index, field)
+        if query_type == "terms":
+            return set().union(*(postings.get(str(term).lower(), set()) for term in value))
+        if query_type == "wildcard":
+            return set().union(*(postings[term] for term in self._wildcard_terms(index, field, value)))
+        term_ids = [postings.get(term, set()) for term in tokenize(str(value))]
+        if not term_ids:
+            return set()
+        return set().union(*term_ids) if query_type == "match" and any_term else set.intersection(*term_ids)
+
+    def score(self, query, index, doc_id, source):
+        """Scores a document for a query.
+
+        Returns:
+            float: The score, None if the document does not match.
+        """
+        (query_type, clause), = query.items()
+        if query_type == "match_all":
+            return 1.0
+        if query_type == "bool":
+            total = 0.0
+            for must in clause.get("must", []) + clause.get("filter", []):
+                score = self.score(must, index, doc_id, source)
+                if score is None:
+                    return None
+                total += score
+            should = [self.score(should, index, doc_id, source) for should in clause.get("should", [])]
+            matched = [score for score in should if score is not None]
+            default_minimum = 1 if should and not clause.get("must") and not clause.get("filter") else 0
+            if len(matched) < int(clause.get("minimum_should_match", default_minimum)):
+                return None
+            return total + sum(matched)
+        if query_type == "ids":
+            return 1.0 if doc_id in clause["values"] else None
+
+        (field, value), = clause.items()
+        any_term = not isinstance(value, dict) or value.get("operator", "or").lower() == "or"
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        text, term_counts = self._tokens(index, doc_id, source, field)
+        if query_type == "match":
+            counts = [term_counts[term] for term in tokenize(str(value))]
+            return float(sum(counts)) if counts and (any(counts) if any_term else all(counts)) else None
+        if query_type == "match_phrase":
+            count = text.count(" " + " ".join(tokenize(str(value))) + " ")
+            return float(count) if count else None
+        if query_type == "wildcard":
+            count = sum(term_counts[term] for term in self._wildcard_terms(index, field, value))
+            return float(count) if count else None
+        if query_type == "terms":
+            count = sum(term_counts[str(term).lower()] for term in value)
+            return float(count) if count else None
+        raise ValueError(f"{query_type} queries are not supported by the fake")
+
+    def search(self, index, body, params):
+        """Runs a search request.
+
+        Args:
+            index (str): The index name.
+            body (bytes): The JSON request body.
+            params (dict): The query parameters.
+
+        Returns:
+            tuple: The status code and the search response.
+        """
+        request = json.loads(body) if body else {}
+        size = int(params.get("size", [request.get("size", 10)])[0])
+        query = request.get("query", {"match_all": {}})
+        with self.lock:
+            self.search_requests += 1
+            index = self.aliases.get(index, index)
+            positions = None
+            if "pit" in request:
+                if request["pit"]["id"] not in self.points_in_time:
+                    return 404, {"error": {"type": "search_context_missing_exception",
+                                           "reason": "No search context found"}, "status": 404}
+                index, positions = self.points_in_time[request["pit"]["id"]]
+            if index not in self.indices:
+                return 404, {"error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"},
+                             "status": 404}
+            start = time.perf_counter()
+            candidates = self.candidates(query, index)
+            documents = self.indices[index]
+            documents = list(documents.items()) if candidates is None else \
+                [(doc_id, documents[doc_id]) for doc_id in candidates]
+
+        hits = []
+        for doc_id, source in documents:
+            if positions is not None and doc_id not in positions:
+                continue
+            score = self.score(query, index, doc_id, source)
+            if score is not None:
+                hits.append({"_index": index, "_id": doc_id, "_score": score, "_source": source})
+        hits.sort(key=lambda hit: (-hit["_score"], hit["_id"]))
+        total = len(hits)
+        response = {"took": 0, "timed_out": False}
+        if positions is not None:
+            # Sorted by score and then _shard_doc, the position of the document when the point in time was opened
+            response["pit_id"] = request["pit"]["id"]
+            hits = [dict(hit, sort=[hit["_score"], positions[hit["_id"]]]) for hit in hits]
+            hits.sort(key=lambda hit: (-hit["sort"][0], hit["sort"][1]))
+            if "search_after" in request:
+                after = (-request["search_after"][0], request["search_after"][1])
+                hits = [hit for hit in hits if (-hit["sort"][0], hit["sort"][1]) > after]
+
+        if "aggs" in request:
+            response["aggregations"] = {
+                name: {"value": len({hit["_source"].get(aggregation["cardinality"]["field"]) for hit in hits})}
+                for name, aggregation in request["aggs"].items()
+            }
+        if "collapse" in request:
+            hits = self.collapse(hits, request["collapse"], query)
+
+        hits = [self.format_hit(hit, request.get("_source"), request.get("highlight"), query) for hit in hits[:size]]
+        response["took"] = int((time.perf_counter() - start) * 1000)
+        response["hits"] = {"total": {"value": total, "relation": "eq"},
+                            "max_score": hits[0]["_score"] if hits else None, "hits": hits}
+        return 200, response
+
+    def open_point_in_time(self, index):
+        with self.lock:
+            index = self.aliases.get(index, index)
+            if index not in self.indices:
+                return 404, {"error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"},
+                             "status": 404}
+            pit_id = f"pit{len(self.points_in_time)}-{self.random.getrandbits(32):08x}"
+            self.points_in_time[pit_id] = (index, {doc_id: position for position, doc_id
+                                                   in enumerate(self.indices[index])})
+        return 200, {"id": pit_id}
+
+    def collapse(self, hits, collapse, query):
+        # Keeps the best hit of every group, with the best hits of the group as inner hits
+        groups = {}
+        for hit in hits:
+            groups.setdefault(hit["_source"].get(collapse["field"]), []).append(hit)
+
+        collapsed = []
+        inner_hits = collapse.get("inner_hits")
+        for value, group in groups.items():
+            hit = dict(group[0], fields={collapse["field"]: [value]})
+            if inner_hits is not None:
+                members = [self.format_hit(member, inner_hits.get("_source"), inner_hits.get("highlight"), query)
+                           for member in group[:inner_hits.get("size", 3)]]
+                hit["inner_hits"] = {inner_hits["name"]: {"hits": {
+                    "total": {"value": len(group), "relation": "eq"},
+                    "max_score": group[0]["_score"],
+                    "hits": members,
+                }}}
+            collapsed.append(hit)
+        return collapsed
+
+    def get_document(self, index, doc_id, params):
+        """Gets a document by id.
+
+        Args:
+            index (str): The index name.
+            doc_id (str): The document id.
+            params (dict): The query parameters, _source is a comma separated list of fields.
+
+        Returns:
+            tuple: The status code and the get response.
+        """
+        with self.lock:
+            index = self.aliases.get(index, index)
+            source = self.indices.get(index, {}).get(doc_id)
+        if source is None:
+            return 404, {"_index": index, "_id": doc_id, "found": False}
+        hit = {"_index": index, "_id": doc_id, "_source": source}
+        if "_source" in params:
+            hit = self.format_hit(hit, params["_source"][0].split(","), None, None)
+        return 200, dict(hit, found=True)
+
+    def format_hit(self, hit, source_filter, highlight, query):
+        # Applies _source filtering and highlighting to a hit
+        hit = dict(hit)
+        source = hit["_source"]
+        if highlight is not None:
+            highlighted = {}
+            for field, options in highlight["fields"].items():
+                options = dict(highlight, **options)
+                fragments = highlight_fragments(str(source.get(field, "")), query_terms(query, field), options)
+                if fragments:
+                    highlighted[field] = fragments
+            if highlighted:
+                hit["highlight"] = highlighted
+
+        if source_filter is False:
+            del hit["_source"]
+        else:
+            hit["_source"] = filter_source(source, source_filter)
+        return hit
+
+    def msearch(self, index, body):
+        # The searches of an NDJSON _msearch body, header and search body lines alternating
+        lines = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+        responses = []
+        for header, request in zip(lines[::2], lines[1::2]):
+            status, response = self.search(header.get("index", index), json.dumps(request).encode("utf-8"), {})
+            responses.append(dict(response, status=status))
+        return {"took": sum(response.get("took", 0) for response in responses), "responses": responses}
+
+    def handle(self, method, path, body):
+        """Dispatches a request.
+
+        Returns:
+            tuple: The status code and the JSON response, None for an empty body.
+        """
+        url = urlsplit(path)
+        parts = [part for part in url.path.split("/") if part]
+
+        if not parts:
+            return 200, {"name": "fake", "cluster_name": "fake", "version": {"number": "8.12.0"},
+                         "tagline": "You Know, for Search"}
+        if parts[-1] == "_search" and len(parts) <= 2:
+            return self.search(parts[0] if len(parts) == 2 else None, body, parse_qs(url.query))
+        if parts[-1] == "_msearch" and len(parts) <= 2:
+            return 200, self.msearch(parts[0] if len(parts) == 2 else None, body)
+        if len(parts) == 2 and parts[1] == "_pit" and method == "POST":
+            return self.open_point_in_time(parts[0])
+        if parts == ["_pit"] and method == "DELETE":
+            with self.lock:
+                freed = self.points_in_time.pop(json.loads(body)["id"], None) is not None
+            return 200, {"succeeded": True, "num_freed": int(freed)}
+        if len(parts) == 3 and parts[1] == "_doc" and method == "GET":
+            return self.get_document(parts[0], parts[2], parse_qs(url.query))
+        if parts[-1] == "_bulk":
+            return 200, self.bulk(parts[0] if len(parts) > 1 else None, body)
+        if parts[0] in ("_alias", "_aliases"):
+            return self.handle_aliases(method, parts[1:], body)
+        if len(parts) == 2 and parts[1] in ("_refresh", "_forcemerge"):
+            with self.lock:
+                self.forcemerges += parts[1] == "_forcemerge"
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if len(parts) == 2 and parts[1] == "_stats":
+            with self.lock:
+                documents = self.indices.get(self.aliases.get(parts[0], parts[0]), {})
+                primaries = {"docs": {"count": len(documents)}, "segments": {"count": 1},
+                             "store": {"size_in_bytes": sum(len(json.dumps(source)) for source in documents.values())}}
+            return 200, {"_all": {"primaries": primaries, "total": primaries}}
+        if len(parts) == 2 and parts[1] == "_settings" and method == "PUT":
+            with self.lock:
+                self.settings.setdefault(parts[0], {}).update(json.loads(body).get("index", {}))
+            return 200, {"acknowledged": True}
+        if len(parts) == 1 and method == "HEAD":
+            return (200 if parts[0] in self.indices or parts[0] in self.aliases else 404), None
+        if len(parts) == 1 and method == "PUT":
+            request = json.loads(body) if body else {}
+            with self.lock:
+                self.indices.setdefault(parts[0], {})
+                self.settings[parts[0]] = dict(request.get("settings", {}).get("index", {}))
+                self.source_excludes[parts[0]] = request.get("mappings", {}).get("_source", {}).get("excludes", [])
+            return 200, {"acknowledged": True, "index": parts[0]}
+        if len(parts) == 1 and method == "GET":
+            with self.lock:
+                return 200, {name: {"aliases": {alias: {} for alias, index in self.aliases.items() if index == name},
+                                    "settings": {"index": self.settings.get(name, {})}}
+                             for name in self.indices if fnmatchcase(name, parts[0])}
+        if len(parts) == 1 and method == "DELETE":
+            with self.lock:
+                if self.indices.pop(parts[0], None) is None:
+                    return 404, {"error": {"type": "index_not_found_exception"}, "status": 404}
+                self.aliases = {alias: index for alias, index in self.aliases.items() if index != parts[0]}
+                self._drop_postings(parts[0])
+            return 200, {"acknowledged": True}
+        return 404, {"error": f"{method} {path} is not supported by the fake", "status": 404}
+
+    def handle_aliases(self, method, parts, body):
+        # HEAD and GET /_alias/<name>, and the atomic actions of POST /_aliases
+        with self.lock:
+            if method in ("HEAD", "GET"):
+                if parts[0] not in self.aliases:
+                    return 404, None if method == "HEAD" else {"error": "alias missing", "status": 404}
+                return 200, None if method == "HEAD" else {self.aliases[parts[0]]: {"aliases": {parts[0]: {}}}}
+            for action in json.loads(body)["actions"]:
+                (action_type, options), = action.items()
+                if action_type == "add":
+                    self.aliases[options["alias"]] = options["index"]
+                elif action_type == "remove":
+                    self.aliases.pop(options["alias"], None)
+                elif action_type == "remove_index":
+                    self.indices.pop(options["index"], None)
+                    self._drop_postings(options["index"])
+        return 200, {"acknowledged": True}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, response = fake.handle(self.command, self.path, body)
+
+                payload = json.dumps(response).encode("utf-8") if response is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
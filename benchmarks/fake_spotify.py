@@ -0,0 +1,124 @@
+"""
+A local stand-in for the Spotify accounts service and the /v1/episodes endpoint of the Web API.
+"""
+from http.server import BaseHTTPRequestHandler
+import json
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from fake_elasticsearch import StandInServer
+
+
+class FakeSpotify:
+    """
+    Issues client credential tokens and returns made up episodes for any id. Counts the requests, so tests can check
+    that cached episodes are not requested again.
+    """
+
+    def __init__(self, port=0, token_lifetime=3600, latency=0.0, unknown_ids=()):
+        """Initializes a FakeSpotify instance.
+
+        Args:
+            port (int): The port to listen on, 0 picks a free port.
+            token_lifetime (float): Seconds until an issued token is rejected with 401.
+            latency (float): Seconds every request is delayed, to simulate the remote API.
+            unknown_ids (iterable): Episode ids returned as null, like episodes that are not available.
+        """
+        self.token_lifetime = token_lifetime
+        self.latency = latency
+        self.unknown_ids = set(unknown_ids)
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.token_requests = 0
+        self.episode_requests = 0
+        self.requested_ids = []
+        self.server = StandInServer(("127.0.0.1", port), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @staticmethod
+    def episode(episode_id):
+        return {
+            "id": episode_id,
+            "name": f"Episode {episode_id}",
+            "release_date": "2020-01-01",
+            "duration_ms": 1800000,
+            "images": [{"url": f"https://i.scdn.co/image/{episode_id}/{size}", "height": size, "width": size}
+                       for size in (640, 300, 64)],
+        }
+
+    def handle(self, method, path, headers):
+        """Dispatches a request.
+
+        Returns:
+            tuple: The status code and the JSON response.
+        """
+        url = urlsplit(path)
+        with self.lock:
+            if method == "POST" and url.path == "/api/token":
+                self.token_requests += 1
+                token = uuid.uuid4().hex
+                self.tokens[token] = time.time() + self.token_lifetime
+                return 200, {"access_token": token, "token_type": "Bearer", "expires_in": self.token_lifetime}
+
+            if method == "GET" and url.path == "/v1/episodes":
+                self.episode_requests += 1
+                token = headers.get("Authorization", "").removeprefix("Bearer ")
+                if self.tokens.get(token, 0) < time.time():
+                    return 401, {"error": {"status": 401, "message": "The access token expired"}}
+
+                ids = parse_qs(url.query).get("ids", [""])[0].split(",")
+                if len(ids) > 50:
+                    return 400, {"error": {"status": 400, "message": "Too many ids requested"}}
+                self.requested_ids.extend(ids)
+                return 200, {"episodes": [None if episode_id in self.unknown_ids else self.episode(episode_id)
+                                          for episode_id in ids]}
+
+        return 404, {"error": {"status": 404, "message": "Service not found"}}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, response = fake.handle(self.command, self.path, self.headers)
+
+                payload = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,223 @@
+"""
+Load test of /search against local stand-ins for Elasticsearch and Spotify. Starts the middle-ware (the Flask app or
+the asyncio app) in a subprocess, sends requests from concurrent clients and reports throughput and latency
+percentiles.
+
+    python load_test.py --server async --concurrency 32 --requests 2000 --es-latency 0.05 --spotify-latency 0.1
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_FOLDER)
+
+import httpx
+
+from fake_elasticsearch import FakeElasticsearch
+from fake_spotify import FakeSpotify
+from metadata_store import build_metadata_store
+from synthetic import VOCABULARY, WEIGHTS, write_metadata
+
+# Words that make sensible queries, the most frequent words of the vocabulary are left out
+QUERY_TERMS = VOCABULARY[40:]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def index_snippets(es, index, episode_ids, snippets_per_episode, words_per_snippet, seed=0):
+    # Snippets with the fields written by the indexer, for the episodes of the synthetic metadata
+    rnd = random.Random(seed)
+    documents = {}
+    for episode_id in episode_ids:
+        show_id = f"{seed:04x}{int(episode_id[:11], 16):018x}"
+        for position in range(snippets_per_episode):
+            documents[f"{episode_id}-{position}"] = {
+                "show_id": "show_" + show_id,
+                "episode_id": episode_id,
+                "transcript_text": " ".join(rnd.choices(VOCABULARY, weights=WEIGHTS, k=words_per_snippet)),
+                "start_time": position * 120.0,
+                "end_time": (position + 1) * 120.0,
+            }
+    es.add_documents(index, documents)
+
+
+def serve_stand_in(kind, latency, index_options, connection):
+    # Runs in its own process, so that the stand-ins do not compete with the clients for the GIL
+    fake = FakeElasticsearch(latency=latency) if kind == "elasticsearch" else FakeSpotify(latency=latency)
+    with fake:
+        if index_options is not None:
+            index_snippets(fake, **index_options)
+        connection.send(fake.url)
+        connection.recv()
+
+
+def start_stand_in(kind, latency, index_options=None):
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve_stand_in, args=(kind, latency, index_options, child_connection),
+                                      daemon=True)
+    process.start()
+    return process, connection, connection.recv()
+
+
+def start_server(kind, port, env, workers):
+    if kind == "async":
+        command = [sys.executable, "-m", "uvicorn", "async_searcher:app", "--port", str(port),
+                   "--log-level", "warning", "--workers", str(workers)]
+    elif kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                   "searcher:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "searcher", "run", "--port", str(port)]
+    return subprocess.Popen(command, cwd=env["APP_CWD"], env=env, stdout=subprocess.DEVNULL)
+
+
+async def wait_until_ready(url, process, timeout=60):
+    async with httpx.AsyncClient() as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"The server exited with code {process.returncode}")
+            try:
+                if (await client.get(url + "/cache/stats")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"The server did not start within {timeout} seconds")
+
+
+async def run_load(url, queries, concurrency, length, nr_results):
+    latencies = []
+    errors = 0
+    next_query = iter(queries)
+
+    async def client_loop(client):
+        nonlocal errors
+        for query in next_query:
+            start = time.perf_counter()
+            try:
+                response = await client.get(url + "/search", params={"q": query, "length": length,
+                                                                     "results": nr_results, "openai": "false"})
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                response.json()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    # Every client has its own connection like independent users, the clients are created before the clock starts
+    clients = [httpx.AsyncClient(timeout=60) for _ in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop(client) for client in clients))
+    duration = time.perf_counter() - start
+    for client in clients:
+        await client.aclose()
+    return latencies, errors, duration
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(name, latencies, errors, duration):
+    latencies = sorted(latencies)
+    return {
+        "name": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(duration, 3),
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["flask", "gunicorn", "async"], action="append",
+                        help="servers to test, can be repeated (default: flask and async)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of gunicorn and uvicorn")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--results", type=int, default=20, help="the results parameter of /search")
+    parser.add_argument("--length", default="120", help="the length parameter of /search")
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--snippets", type=int, default=5, help="snippets per episode")
+    parser.add_argument("--es-latency", type=float, default=0.05, help="seconds added to every Elasticsearch request")
+    parser.add_argument("--spotify-latency", type=float, default=0.1, help="seconds added to every Spotify request")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    queries = [" ".join(rnd.sample(QUERY_TERMS, rnd.randint(1, 2))) for _ in range(args.requests)]
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = os.path.join(folder, "data")
+        os.makedirs(data_folder)
+        os.makedirs(os.path.join(folder, "app"))
+        episode_ids = write_metadata(os.path.join(data_folder, "metadata.tsv"), args.shows, args.episodes)
+        build_metadata_store(os.path.join(data_folder, "metadata.tsv"), os.path.join(data_folder, "metadata.sqlite"))
+        stand_ins = [
+            start_stand_in("elasticsearch", args.es_latency,
+                           {"index": "podcast_" + args.length, "episode_ids": episode_ids,
+                            "snippets_per_episode": args.snippets, "words_per_snippet": 300}),
+            start_stand_in("spotify", args.spotify_latency),
+        ]
+        es_url, spotify_url = stand_ins[0][2], stand_ins[1][2]
+
+        for kind in args.server or ["flask", "async"]:
+            port = free_port()
+            env = dict(
+                os.environ,
+                APP_CWD=os.path.join(folder, "app"),
+                PYTHONPATH=os.pathsep.join([APP_FOLDER] + os.environ.get("PYTHONPATH", "").split(os.pathsep)),
+                ELASTICSEARCH_URL=es_url,
+                ELASTICSEARCH_CONNECTIONS=str(args.concurrency),
+                SPOTIFY_API_URL=spotify_url,
+                SPOTIFY_ACCOUNTS_URL=spotify_url,
+                SPOTIFY_CLIENT_ID="load-test",
+                SPOTIFY_CLIENT_SECRET="load-test",
+                SPOTIFY_CACHE_PATH=os.path.join(data_folder, f"spotify-cache-{kind}.sqlite"),
+                LLM_CACHE_PATH=os.path.join(data_folder, "llm-cache.sqlite"),
+                OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "load-test"),
+                RESULT_CACHE="off",
+            )
+            process = start_server(kind, port, env, args.workers)
+            try:
+                url = f"http://127.0.0.1:{port}"
+                asyncio.run(wait_until_ready(url, process))
+                latencies, errors, duration = asyncio.run(
+                    run_load(url, queries, args.concurrency, args.length, args.results))
+                results.append(summarize(kind, latencies, errors, duration))
+            finally:
+                process.terminate()
+                process.wait()
+
+        for process, connection, _ in stand_ins:
+            connection.send("stop")
+            process.join()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,152 @@
+"""
+Generates synthetic podcast transcripts shaped like the Spotify Podcast Dataset (Google Speech-to-Text JSON).
+"""
+import argparse
+import json
+import os
+import random
+
+VOCABULARY = (
+    "the and to of a i that you it in is like so we know just this was for they but on have what be "
+    "with my not are think it's yeah do about people all one can there really if at me get so going "
+    "right don't your podcast time he or out up because she music show episode earth climate change "
+    "science kendrick flat space history football money health story family coffee movie game news "
+    "interview season book election planet water food travel business technology love life"
+).split()
+
+# Zipf-like weights so that a few terms are very frequent, like in spoken language
+WEIGHTS = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def generate_episode(duration, rnd, min_result_length=2.0, max_result_length=35.0, words_per_second=2.5):
+    """Generates the transcript of one episode.
+
+    Args:
+        duration (float): The length of the episode in seconds.
+        rnd (random.Random): The random generator to use.
+        min_result_length (float): The minimum length of one result in seconds.
+        max_result_length (float): The maximum length of one result in seconds.
+        words_per_second (float): The speaking rate.
+
+    Returns:
+        dict: The transcript in the format of the dataset.
+    """
+    results = []
+    all_words = []
+    current_time = 0.0
+    while current_time < duration:
+        result_length = rnd.uniform(min_result_length, max_result_length)
+        nr_words = max(1, int(result_length * words_per_second))
+        word_length = result_length / nr_words
+        words = []
+        for _ in range(nr_words):
+            words.append({
+                "startTime": f"{current_time:.3f}s",
+                "endTime": f"{current_time + word_length:.3f}s",
+                "word": rnd.choices(VOCABULARY, weights=WEIGHTS)[0],
+            })
+            current_time += word_length
+        results.append({
+            "alternatives": [{
+                "transcript": " ".join(word["word"] for word in words) + " ",
+                "confidence": round(rnd.uniform(0.7, 1.0), 4),
+                "words": words,
+            }]
+        })
+        all_words.extend(dict(word, speakerTag=1) for word in words)
+        current_time += rnd.uniform(0.0, 1.0)
+
+    # The dataset ends every transcript with a result that repeats all words with speaker tags
+    results.append({"alternatives": [{"words": all_words}]})
+    return {"results": results}
+
+
+def write_corpus(folder_path, nr_shows, episodes_per_show, duration, seed=0):
+    """Writes a synthetic corpus with the directory layout of the dataset.
+
+    Args:
+        folder_path (str): The folder to write the corpus to.
+        nr_shows (int): The number of shows.
+        episodes_per_show (int): The number of episodes per show.
+        duration (float): The length of every episode in seconds.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        list: The paths of the written transcript files.
+    """
+    rnd = random.Random(seed)
+    paths = []
+    for show in range(nr_shows):
+        show_id = f"{seed:04x}{show:018x}"
+        show_folder = os.path.join(folder_path, show_id[0], show_id[1], "show_" + show_id)
+        os.makedirs(show_folder, exist_ok=True)
+        for episode in range(episodes_per_show):
+            episode_id = f"{show:011x}{episode:011x}"
+            path = os.path.join(show_folder, episode_id + ".json")
+            with open(path, "w") as f:
+                json.dump(generate_episode(duration, rnd), f)
+            paths.append(path)
+    return paths
+
+
+METADATA_HEADER = [
+    "show_uri", "show_name", "show_description", "publisher", "language", "rss_link", "episode_uri",
+    "episode_name", "episode_description", "duration", "show_filename_prefix", "episode_filename_prefix",
+]
+
+
+def write_metadata(path, nr_shows, episodes_per_show, seed=0):
+    """Writes a metadata.tsv for the episodes of write_corpus with the same arguments.
+
+    Args:
+        path (str): The path of the metadata file.
+        nr_shows (int): The number of shows.
+        episodes_per_show (int): The number of episodes per show.
+        seed (int): The seed used for the corpus.
+
+    Returns:
+        list: The episode ids (episode_filename_prefix).
+    """
+    rnd = random.Random(seed)
+    episode_ids = []
+    with open(path, "w") as f:
+        f.write("\t".join(METADATA_HEADER) + "\n")
+        for show in range(nr_shows):
+            show_id = f"{seed:04x}{show:018x}"
+            show_description = " ".join(rnd.choices(VOCABULARY, k=60))
+            for episode in range(episodes_per_show):
+                episode_id = f"{show:011x}{episode:011x}"
+                row = [
+                    "spotify:show:" + show_id,
+                    f"Show {show}",
+                    show_description,
+                    f"Publisher {show % 97}",
+                    "['en']",
+                    f"https://anchor.fm/s/{show_id}/podcast/rss",
+                    "spotify:episode:" + episode_id,
+                    f"Episode {episode} of show {show}",
+                    " ".join(rnd.choices(VOCABULARY, k=80)),
+                    f"{rnd.uniform(5, 120):.6f}",
+                    "show_" + show_id,
+                    episode_id,
+                ]
+                f.write("\t".join(row) + "\n")
+                episode_ids.append(episode_id)
+    return episode_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic transcript corpus.")
+    parser.add_argument("folder", help="output folder, e.g. data/podcast-transcripts")
+    parser.add_argument("--shows", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=10, help="episodes per show")
+    parser.add_argument("--duration", type=float, default=1800, help="episode length in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metadata", help="also write a metadata.tsv for the corpus to this path")
+    args = parser.parse_args()
+
+    files = write_corpus(args.folder, args.shows, args.episodes, args.duration, args.seed)
+    print(f"Wrote {len(files)} transcripts to {args.folder}")
+    if args.metadata:
+        write_metadata(args.metadata, args.shows, args.episodes, args.seed)
+        print(f"Wrote metadata to {args.metadata}")
@@ -0,0 +1,139 @@
+import argparse
+import time
+from collections import namedtuple
+
+# The layout of the Elasticsearch indices of the transcripts (shards, replicas and the mapping of the transcript text)
+# and the bulk load of a new index behind an alias.
+
+# A subfield of transcript_text indexed with another analyzer, e.g. transcript_text.english with stemming. Subfields
+# are not used for phrase queries, so they can be indexed without positions ("freqs") to save space.
+Subfield = namedtuple("Subfield", ["name", "analyzer", "index_options"])
+
+# The layout of an index. index_options of transcript_text: "positions" (needed for phrase queries), "freqs" (only
+# term frequencies, no phrase queries) or "docs" (no scoring by term frequency either). Without store_text,
+# transcript_text is indexed but left out of _source, the snippets are then read from a text store.
+IndexLayout = namedtuple("IndexLayout", ["shards", "replicas", "analyzer", "index_options", "subfields",
+                                         "refresh_interval", "store_text"],
+                         defaults=[3, 0, "standard", "positions", (), "1s", True])
+
+INDEX_OPTIONS = ("docs", "freqs", "positions", "offsets")
+
+
+def parse_subfield(value):
+    # NAME:ANALYZER[:INDEX_OPTIONS], e.g. english:english:freqs
+    parts = value.split(":")
+    if len(parts) in (2, 3) and all(parts) and (len(parts) == 2 or parts[2] in INDEX_OPTIONS):
+        return Subfield(parts[0], parts[1], parts[2] if len(parts) == 3 else "freqs")
+    raise argparse.ArgumentTypeError(f"expected NAME:ANALYZER[:INDEX_OPTIONS], got {value!r}")
+
+
+def text_mapping(analyzer, index_options):
+    mapping = {"type": "text", "index": True}
+    if analyzer != "standard":
+        mapping["analyzer"] = analyzer
+    if index_options != "positions":
+        mapping["index_options"] = index_options
+    return mapping
+
+
+def index_body(layout):
+    """Builds the settings and mappings of a transcript index.
+
+    Args:
+        layout (IndexLayout): The layout of the index.
+
+    Returns:
+        dict: The settings and mappings arguments of indices.create.
+    """
+    transcript_text = text_mapping(layout.analyzer, layout.index_options)
+    if layout.subfields:
+        transcript_text["fields"] = {subfield.name: text_mapping(subfield.analyzer, subfield.index_options)
+                                     for subfield in layout.subfields}
+    body = {
+        "settings": {
+            "index": {"number_of_shards": layout.shards, "number_of_replicas": layout.replicas}
+        },
+        "mappings": {
+            "properties": {
+                "show_id": {"type": "keyword", "index": False},
+                # Indexed, so that searches can collapse and aggregate on the episode
+                "episode_id": {"type": "keyword"},
+                "transcript_text": transcript_text,
+                "start_time": {"type": "float", "index": False},
+                "end_time": {"type": "float", "index": False},
+                # The position of a snippet in its episode, in indices of base segments for stitching
+                "ordinal": {"type": "integer", "index": False},
+                # The position of the text of a snippet in the text of its episode in the text store
+                "text_start": {"type": "integer", "index": False},
+                "text_end": {"type": "integer", "index": False},
+            }
+        },
+    }
+    if not layout.store_text:
+        body["mappings"]["_source"] = {"excludes": ["transcript_text"]}
+    return body
+
+
+class BulkLoad:
+    """
+    Loads a new version of an index behind an alias. The new index is created without refreshes and replicas, so the
+    bulk requests do not compete with searches and do not produce many small segments. After the load it is
+    force-merged, its settings are restored and the alias is swapped to it in one atomic step, while the searches of
+    the middle-ware keep using the previous version. The previous version is deleted afterwards.
+    """
+
+    def __init__(self, client, alias, layout, max_num_segments=1):
+        """Initializes a BulkLoad instance.
+
+        Args:
+            client (Elasticsearch): The Elasticsearch client.
+            alias (str): The name the middle-ware searches, an alias of the loaded index after the swap.
+            layout (IndexLayout): The layout of the new index.
+            max_num_segments (int): The number of segments per shard after the force-merge.
+        """
+        self.client = client
+        self.alias = alias
+        self.layout = layout
+        self.max_num_segments = max_num_segments
+        self.index_name = f"{alias}-bulk-{time.strftime('%Y%m%d%H%M%S')}"
+
+    def create(self):
+        """
+        Creates the new index for the load. Indices of earlier loads that failed before the swap are deleted.
+        """
+        aliased = self.aliased_indices()
+        stale = [name for name in self.client.indices.get(index=f"{self.alias}-bulk-*") if name not in aliased]
+        for name in stale:
+            self.client.indices.delete(index=name)
+        body = index_body(self.layout)
+        body["settings"]["index"].update(number_of_replicas=0, refresh_interval="-1")
+        self.client.indices.create(index=self.index_name, **body)
+
+    def aliased_indices(self):
+        if not self.client.indices.exists_alias(name=self.alias):
+            return []
+        return list(self.client.indices.get_alias(name=self.alias))
+
+    def finish(self):
+        """
+        Force-merges the loaded index, restores its refresh interval and replicas and swaps the alias to it. An index
+        with the name of the alias (from a run without bulk load) is deleted in the same atomic step.
+        """
+        self.client.indices.refresh(index=self.index_name)
+        # Merged while there are no replicas yet, so the replicas copy the merged segments instead of merging again.
+        # Merging a large index takes longer than the default request timeout.
+        self.client.options(request_timeout=3600).indices.forcemerge(index=self.index_name,
+                                                                     max_num_segments=self.max_num_segments)
+        self.client.indices.put_settings(index=self.index_name, settings={"index": {
+            "refresh_interval": self.layout.refresh_interval,
+            "number_of_replicas": self.layout.replicas,
+        }})
+
+        previous = self.aliased_indices()
+        actions = [{"remove": {"index": name, "alias": self.alias}} for name in previous]
+        if not previous and self.client.indices.exists(index=self.alias):
+            actions.append({"remove_index": {"index": self.alias}})
+        actions.append({"add": {"index": self.index_name, "alias": self.alias}})
+        self.client.indices.update_aliases(actions=actions)
+        for name in previous:
+            self.client.indices.delete(index=name)
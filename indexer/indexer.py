@@ -1,17 +1,128 @@
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch
 import os
-import json
 import hashlib
 import time
+import argparse
+import sys
+from collections import Counter, namedtuple
+from multiprocessing import Pool
 from dotenv import load_dotenv
 
+# The local index, term dictionary, text store and embeddings are shared with the middle-ware, add the app folder to
+# the path before importing them
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from index_layout import BulkLoad, index_body, IndexLayout, INDEX_OPTIONS, parse_subfield
+from manifest import TranscriptManifest
+from transcript_cache import TranscriptCache
+from transcript_reader import get_reader
+from uploader import BulkUploader, EmbeddingUploader, LocalIndexUploader, TextStoreUploader
+# Found in the app folder
+from clip_ids import segment_id
+from embeddings import DEFAULT_MODEL, get_embedder
+from local_index import index_exists, tokenize
+from term_dictionary import TermDictionary, write_term_dictionary
+from text_store import text_offsets
+
+# A transcript file found in the folder, with the hash recorded in the manifest if it was indexed before
+TranscriptFile = namedtuple("TranscriptFile", ["root", "file_name", "path", "size", "mtime_ns", "sha256"])
+
+# An index built in the run, with its segmentation settings. The snippets of an index with ordinals are numbered in
+# their episode and get the id <episode id>-<ordinal>, so the middle-ware can stitch neighbouring snippets to clips.
+IndexTarget = namedtuple("IndexTarget", ["document_size", "allow_overlap", "index_name", "ordinals"],
+                         defaults=[False])
+
+
+class IndexingStats:
+    """
+    Accumulates processed items and busy time per indexing stage to print a throughput report at the end of a run.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.stages = {}
+
+    def add(self, stage, seconds, items):
+        """Adds the busy time and processed items of one unit of work to a stage.
+
+        Args:
+            stage (str): The name of the stage, e.g. "read" or "upload".
+            seconds (float): The time spent in the stage.
+            items (int): The number of items (files, snippets) processed in that time.
+        """
+        total_seconds, total_items = self.stages.get(stage, (0.0, 0))
+        self.stages[stage] = (total_seconds + seconds, total_items + items)
+
+    def report(self):
+        """Formats the throughput of every stage. With several workers the busy time of the worker stages is
+        summed over all processes, so it can exceed the wall time.
+
+        Returns:
+            str: A multi-line report.
+        """
+        wall_time = time.time() - self.start_time
+        lines = [f"Throughput report ({wall_time:.1f}s wall time):"]
+        for stage, (seconds, items) in self.stages.items():
+            rate = items / seconds if seconds > 0 else 0.0
+            lines.append(f"  {stage:<8} {items:>10} items  {seconds:10.1f}s busy  {rate:12.1f} items/s")
+        return "\n".join(lines)
+
+    def write_metrics(self, path):
+        """Writes the busy time and items of every stage in the Prometheus text format, e.g. for the textfile
+        collector of the node exporter. The file is replaced atomically.
+
+        Args:
+            path (str): The metrics file.
+        """
+        lines = [
+            "# HELP indexer_stage_seconds Busy time of each indexing stage in the last run.",
+            "# TYPE indexer_stage_seconds gauge",
+        ]
+        lines += [f'indexer_stage_seconds{{stage="{stage}"}} {seconds}' for stage, (seconds, _) in self.stages.items()]
+        lines += [
+            "# HELP indexer_stage_items Items processed by each indexing stage in the last run.",
+            "# TYPE indexer_stage_items gauge",
+        ]
+        lines += [f'indexer_stage_items{{stage="{stage}"}} {items}' for stage, (_, items) in self.stages.items()]
+        lines += [
+            "# HELP indexer_wall_seconds Wall time of the last run.",
+            "# TYPE indexer_wall_seconds gauge",
+            f"indexer_wall_seconds {time.time() - self.start_time}",
+            "# HELP indexer_last_run_timestamp_seconds End of the last run.",
+            "# TYPE indexer_last_run_timestamp_seconds gauge",
+            f"indexer_last_run_timestamp_seconds {time.time()}",
+        ]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+# The processing method of the indexer in a worker process, set by _init_worker
+_worker_process = None
+
+
+def _init_worker(process):
+    global _worker_process
+    _worker_process = process
+
+
+def _process_in_worker(item):
+    return _worker_process(item)
+
 
 class PodcastTranscriptIndexer:
     """
     Class used to index podcast transcripts into an Elasticsearch index from JSON formatted transcript files.
     """
 
-    def __init__(self, cloud_endpoint, api_key, folder_path, index_name, size_batch, document_size, allow_overlap):
+    def __init__(self, cloud_endpoint, api_key, folder_path, index_name, size_batch, document_size, allow_overlap,
+                 workers=1, upload_threads=2, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024, max_retries=5,
+                 client=None, manifest_path=None, targets=None, reader="json", cache_dir=None, generation_file=None,
+                 local_index=None, term_dictionary=None, vector_index=None, embedding_model=DEFAULT_MODEL,
+                 metrics_file=None, layout=None, bulk_load=False, text_store=None):
         """Initializes a PodcastTranscriptIndexer instance with parameters to set up Elasticsearch connectivity, 
         indexing preferences, and document processing.
 
@@ -20,41 +131,154 @@ class PodcastTranscriptIndexer:
             api_key (str): The API key used for authentication with the Elasticsearch service.
             folder_path (str): The local system path to the folder containing JSON files with podcast transcripts.
             index_name (str): The name of the Elasticsearch index where the transcripts will be stored.
-            size_batch (int): The number of transcript snippets to accumulate before performing a bulk upload to Elasticsearch.
+            size_batch (int): The maximum number of transcript snippets queued between parsing and uploading. Bounds
+                the memory used for documents that are not uploaded yet.
             document_size (int): The size in seconds for each document indexed.
             allow_overlap (bool): A flag to enable or disable the inclusion of overlapping text between 2 documents. 
+            workers (int): The number of processes used to parse and segment transcript files. With 1 every file is
+                processed in the main process.
+            upload_threads (int): The number of threads sending bulk requests to Elasticsearch concurrently.
+            chunk_size (int): The maximum number of documents in one bulk request.
+            max_chunk_bytes (int): The maximum size in bytes of one bulk request.
+            max_retries (int): How often documents rejected with 429 (Too Many Requests) are retried with backoff.
+            client (Elasticsearch): An existing client to use instead of connecting to the cloud endpoint, e.g. for a
+                local cluster.
+            manifest_path (str): The path of a SQLite manifest of indexed files. If set, only new or changed files are
+                processed and the snippets that changed files no longer produce are deleted.
+            targets (list): Tuples of (document_size, allow_overlap, index_name[, ordinals]) to build several indices
+                from a single read of every file. Defaults to the one index given by index_name, document_size and
+                allow_overlap.
+            reader (str): The transcript reader: "json", "orjson" (faster parsing) or "stream" (incremental parsing
+                with ijson that never builds the word level arrays).
+            cache_dir (str): A transcript cache written by transcript_cache.py. If set, the segments are read from the
+                cache instead of parsing the JSON files in folder_path. Cannot be combined with a manifest.
+            generation_file (str): A file rewritten after every successful run, so that the search middle-ware drops
+                its cached results.
+            local_index (str): A folder of local inverted indices (app/local_index.py), one subfolder per index, to
+                write the snippets to instead of Elasticsearch.
+            term_dictionary (str): A folder to write the term dictionary (terms and document frequencies) of every
+                index to, which the middle-ware uses to expand wildcards. Incremental runs add the terms of the new
+                snippets to the previous dictionary, full runs rebuild it. Not written for Elasticsearch indices with
+                another analyzer than standard.
+            vector_index (str): A folder of local vector indices (app/vector_index.py), one subfolder per index, to
+                write the embeddings of the snippets to, for the hybrid search of the middle-ware.
+            embedding_model (str): The model embedding the snippets, a sentence-transformers model or "hashing".
+            metrics_file (str): A file to write the time and items of every stage (read, hash, parse, segment,
+                upload, ...) to at the end of a run, in the Prometheus text format.
+            layout (IndexLayout): The shards, replicas and text mapping of the Elasticsearch indices the indexer
+                creates, by default 3 shards, no replicas and the standard analyzer.
+            bulk_load (bool): Loads every index into a new Elasticsearch index without refreshes and replicas, which
+                is force-merged at the end of the run and replaces the previous index behind an alias with the index
+                name. Always indexes all files, it cannot be combined with a manifest.
+            text_store (str): A folder to write the texts of the episodes to, compressed and shared by all targets
+                (app/text_store.py). The snippets then only store the position of their text in the text of their
+                episode, the text is indexed but not stored.
         """
-        self.client = Elasticsearch(cloud_id=cloud_endpoint, api_key=api_key)
+        if cache_dir is not None and manifest_path is not None:
+            raise ValueError("Indexing from a transcript cache always indexes all episodes, it does not use a manifest")
+        if bulk_load and (manifest_path is not None or local_index is not None):
+            raise ValueError("A bulk load rebuilds Elasticsearch indices, it does not use a manifest or local indices")
+
+        if client is None and local_index is None:
+            client = Elasticsearch(cloud_id=cloud_endpoint, api_key=api_key)
+        self.client = client
+        self.local_index = local_index
+        self.term_dictionary = term_dictionary
+        self.vector_index = vector_index
+        self.embedding_model = embedding_model
+        self.metrics_file = metrics_file
+        self.layout = layout or IndexLayout()
+        self.text_store = text_store
+        if text_store is not None:
+            self.layout = self.layout._replace(store_text=False)
+        # The term dictionary is tokenized like the standard analyzer and the local index. With another analyzer, e.g.
+        # english with stemming, its terms and document frequencies do not match the index, so none is written
+        self.standard_terms = local_index is not None or self.layout.analyzer == "standard"
+        if term_dictionary is not None and not self.standard_terms:
+            print(f"No term dictionary is written for the {self.layout.analyzer} analyzer.")
+        self.bulk_load = bulk_load
+        self.bulk_loads = []
+        self.document_frequencies = {}
+        self.document_counts = Counter()
         self.folder_path = folder_path
-        self.index_name = index_name
         self.size_batch = size_batch
-        self.document_size = document_size
-        self.allow_overlap = allow_overlap
+        if targets is None:
+            targets = [(document_size, allow_overlap, index_name)]
+        self.targets = [IndexTarget(*target) for target in targets]
+        # The first target is used by default, e.g. as document size of process_document
+        self.document_size, self.allow_overlap, self.index_name = self.targets[0][:3]
+        self.workers = workers
+        # Resolve the reader early to fail before indexing if its package is missing
+        get_reader(reader)
+        self.reader = reader
+        self.cache_dir = cache_dir
+        self.cache = None
+        self.generation_file = generation_file
+        self.upload_threads = upload_threads
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.manifest = TranscriptManifest(manifest_path) if manifest_path else None
+        self.known_files = {}
+        self.deleted_snippets = {}
+        self.skipped_files = 0
+        self.stats = IndexingStats()
+
+        if self.manifest is not None:
+            for target in self.targets:
+                settings = f"document_size={target.document_size} overlap={target.allow_overlap}"
+                self.manifest.use_settings(target.index_name, settings + (" ordinals=True" if target.ordinals else ""))
+
+    def __getstate__(self):
+        # The Elasticsearch client, the bulk loads holding it and the manifest cannot be pickled and are not needed in
+        # the worker processes, neither are the results of the run, which are collected in the main process
+        state = self.__dict__.copy()
+        state["client"] = None
+        state["bulk_loads"] = []
+        state["manifest"] = None
+        state["known_files"] = {}
+        state["deleted_snippets"] = {}
+        state["cache"] = None
+        state["document_frequencies"] = {}
+        state["document_counts"] = Counter()
+        state["stats"] = None
+        return state
 
     def ensure_index_exists(self):
         """
-        If the Elasticsearch index doesn't exists, create it with specific settings and mappings for storing transcripts.
+        If the Elasticsearch indices don't exist, create them with specific settings and mappings for storing transcripts.
+        A bulk load creates new indices instead.
         """
+        if self.bulk_load:
+            self.bulk_loads = [BulkLoad(self.client, target.index_name, self.layout) for target in self.targets]
+            for bulk_load in self.bulk_loads:
+                bulk_load.create()
+            return
+        for target in self.targets:
+            self.ensure_target_index_exists(target.index_name)
+
+    def ensure_target_index_exists(self, index_name):
+        """If the Elasticsearch index doesn't exists, create it with specific settings and mappings for storing transcripts.
+        A local index is created by its uploader.
 
-        if not self.client.indices.exists(index=self.index_name):
+        Args:
+            index_name (str): The name of the index.
+        """
+
+        if self.local_index is not None:
+            exists = index_exists(os.path.join(self.local_index, index_name))
+        else:
+            exists = self.client.indices.exists(index=index_name)
+
+        if not exists:
             # Create the index with specific settings
-            self.client.indices.create(
-                index=self.index_name,
-                body={
-                    "settings": {
-                        "index": {"number_of_shards": 3, "number_of_replicas": 0}
-                    },
-                    "mappings": {
-                        "properties": {
-                            "show_id": {"type": "keyword", "index": False},
-                            "episode_id": {"type": "keyword", "index": False},
-                            "transcript_text": {"type": "text", "index": True},
-                            "start_time": {"type": "float", "index": False},
-                            "end_time": {"type": "float", "index": False},
-                        }
-                    },
-                },
-            )
+            if self.local_index is None:
+                self.client.indices.create(index=index_name, **index_body(self.layout))
+
+            # Files recorded for a previous index of the same name have to be indexed again
+            if self.manifest is not None:
+                self.manifest.forget_index(index_name)
+                self.manifest.commit()
 
     @staticmethod
     def generate_unique_id(show_id, episode_id, start_time, end_time):
@@ -72,41 +296,364 @@ class PodcastTranscriptIndexer:
         unique_string = f"{show_id}_{episode_id}_{start_time}_{end_time}"
         return hashlib.sha256(unique_string.encode("utf-8")).hexdigest()
 
-    def process_files(self):
+    def list_files(self):
+        """Walks the specified directory in a sorted, reproducible order. Files whose size and modification time
+        match the manifest for every target are skipped.
+
+        Yields:
+            TranscriptFile: Every new or possibly changed json file.
         """
-        Processes json files from the specified directory, and uploads them in batches to Elasticsearch.
+        for root, dirs, files in os.walk(self.folder_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.endswith(".json"):
+                    continue
+
+                full_path = os.path.join(root, file_name)
+                path = os.path.relpath(full_path, self.folder_path)
+                file_stat = os.stat(full_path)
+                known = [self.known_files.get(target.index_name, {}).get(path) for target in self.targets]
+                if all(k is not None and k[:2] == (file_stat.st_size, file_stat.st_mtime_ns) for k in known):
+                    self.skipped_files += 1
+                    continue
+
+                # The content only has to be compared if all targets were built from the same content
+                known_hashes = {k[2] if k is not None else None for k in known}
+                yield TranscriptFile(root, file_name, path, file_stat.st_size, file_stat.st_mtime_ns,
+                                     known_hashes.pop() if len(known_hashes) == 1 else None)
+
+    def process_file(self, transcript_file):
+        """Reads, hashes and parses one transcript file once and segments it for every target. Runs in the worker
+        processes when workers > 1.
+
+        Args:
+            transcript_file (TranscriptFile): The json file.
+
+        Returns:
+            tuple: The file, the SHA-256 hash of its content, its transcript snippets for all targets with their
+                index in "_index" (None if the content did not change since the last run), their term counts (see
+                count_terms) and a dictionary of (seconds, items) per stage.
+        """
+        root, file_name = transcript_file.root, transcript_file.file_name
+
+        start = time.perf_counter()
+        with open(os.path.join(root, file_name), "rb") as f:
+            content = f.read()
+        read_done = time.perf_counter()
+        digest = hashlib.sha256(content).hexdigest()
+        hash_done = time.perf_counter()
+        timings = {
+            "read": (read_done - start, 1),
+            "hash": (hash_done - read_done, 1),
+        }
+        if digest == transcript_file.sha256:
+            return transcript_file, digest, None, None, timings
+
+        segments = get_reader(self.reader)(content)
+        parse_done = time.perf_counter()
+        transcript_snippets = self.segment(segments, root, file_name)
+        segment_done = time.perf_counter()
+        term_counts = self.count_terms(transcript_snippets)
+
+        timings["parse"] = (parse_done - hash_done, 1)
+        timings["segment"] = (segment_done - parse_done, len(transcript_snippets))
+        if term_counts is not None:
+            timings["terms"] = (time.perf_counter() - segment_done, len(transcript_snippets))
+        return transcript_file, digest, transcript_snippets, term_counts, timings
+
+    def process_cached_episode(self, episode_number):
+        """Reads the segments of one episode from the transcript cache and segments them. Runs in the worker
+        processes when workers > 1.
+
+        Args:
+            episode_number (int): The position of the episode in the cache.
+
+        Returns:
+            tuple: Like process_file, without a file and hash.
+        """
+        if self.cache is None:
+            self.cache = TranscriptCache(self.cache_dir)
+
+        start = time.perf_counter()
+        segments = self.cache.segments(episode_number)
+        read_done = time.perf_counter()
+        root, file_name = self.cache.episode(episode_number)
+        transcript_snippets = self.segment(segments, root, file_name)
+        segment_done = time.perf_counter()
+        term_counts = self.count_terms(transcript_snippets)
+
+        timings = {
+            "read": (read_done - start, 1),
+            "segment": (segment_done - read_done, len(transcript_snippets)),
+        }
+        if term_counts is not None:
+            timings["terms"] = (time.perf_counter() - segment_done, len(transcript_snippets))
+        return None, None, transcript_snippets, term_counts, timings
+
+    def segment(self, segments, root, file_name):
+        """Segments one episode for every target.
+
+        Args:
+            segments (list): Tuples of (start_time, end_time, transcript_text) of the episode.
+            root (str): The directory of the JSON file of the episode.
+            file_name (str): The name of the JSON file of the episode.
+
+        Returns:
+            list: The transcript snippets of all targets with their index in "_index".
         """
         transcript_snippets = []
-        for root, _, files in os.walk(self.folder_path):
-            # Loop over all json files in the folder
-            for file_name in files:
-                if file_name.endswith(".json"):
-                    with open(os.path.join(root, file_name)) as f:
-                        # Read content of file
-                        json_data = json.load(f)
-                        if self.allow_overlap:
-                            self.process_document_overlap(json_data, transcript_snippets, root, file_name)
-                        else:
-                            self.process_document(json_data, transcript_snippets, root, file_name)
-
-                        if len(transcript_snippets) >= self.size_batch:
-                            self.bulk_upload_documents(transcript_snippets)
-                            transcript_snippets = []
-
-        # Upload any remaining documents
-        if len(transcript_snippets) > 0:
-            self.bulk_upload_documents(transcript_snippets)
-
-    def process_document(self, json_data, transcript_snippets, root, file_name):
+        if self.text_store is not None:
+            episode_text = "".join(transcript_text for _, _, transcript_text in segments)
+        for target in self.targets:
+            target_snippets = []
+            if target.allow_overlap:
+                self.process_document_overlap(segments, target_snippets, root, file_name, target.document_size)
+            else:
+                self.process_document(segments, target_snippets, root, file_name, target.document_size)
+            if self.text_store is not None:
+                text_offsets(episode_text, target_snippets)
+            for ordinal, snippet in enumerate(target_snippets):
+                snippet["_index"] = target.index_name
+                if target.ordinals:
+                    snippet.update(_id=segment_id(snippet["episode_id"], ordinal), ordinal=ordinal)
+            transcript_snippets.extend(target_snippets)
+        return transcript_snippets
+
+    def iter_processed_files(self):
+        """Processes all new or changed json files (or all episodes of the transcript cache), either in the main
+        process or in a pool of worker processes.
+        The results are yielded in the order of list_files in both cases, so the uploaded documents are the same.
+
+        Yields:
+            tuple: The results of process_file.
+        """
+        if self.cache_dir is not None:
+            process, items = self.process_cached_episode, range(len(TranscriptCache(self.cache_dir)))
+        else:
+            process, items = self.process_file, self.list_files()
+
+        if self.workers <= 1:
+            for item in items:
+                yield process(item)
+            return
+
+        # The indexer is sent to every worker once, so the transcript cache is opened once per worker process
+        with Pool(self.workers, initializer=_init_worker, initargs=(process,)) as pool:
+            yield from pool.imap(_process_in_worker, items, chunksize=8)
+
+    def process_files(self):
+        """
+        Processes json files from the specified directory, and uploads them to Elasticsearch while parsing continues.
+        With a manifest, unchanged files are skipped and snippets of changed or removed files that no longer exist
+        are deleted from the index.
+        """
+        self.stats = IndexingStats()
+        self.document_frequencies = {}
+        self.document_counts = Counter()
+        self.known_files = {}
+        self.deleted_snippets = {}
+        if self.manifest is not None:
+            self.known_files = {target.index_name: self.manifest.files(target.index_name) for target in self.targets}
+        self.skipped_files = 0
+        uploader = self.create_uploader()
+        uploader.start()
+
+        for transcript_file, digest, snippets, term_counts, timings in self.iter_processed_files():
+            for stage, (seconds, items) in timings.items():
+                self.stats.add(stage, seconds, items)
+
+            if snippets is not None:
+                for snippet in snippets:
+                    uploader.put(snippet)
+                if term_counts is not None:
+                    self.add_term_counts(snippets, term_counts)
+
+            if self.manifest is not None:
+                self.record_file(uploader, transcript_file, digest, snippets)
+
+        # Delete the snippets of files that were removed from the folder
+        for index_name, known_files in self.known_files.items():
+            for path in known_files:
+                if not os.path.exists(os.path.join(self.folder_path, path)):
+                    self.delete_snippets(uploader, index_name, path, self.manifest.snippet_ids(index_name, path))
+                    self.manifest.remove(index_name, path)
+
+        # Wait for the remaining documents
+        uploader.close()
+        self.stats.add("upload", uploader.busy_seconds, uploader.uploaded)
+        if self.vector_index is not None:
+            self.stats.add("embed", uploader.embedding_seconds, uploader.embedded)
+        if self.bulk_loads:
+            start = time.perf_counter()
+            for bulk_load in self.bulk_loads:
+                bulk_load.finish()
+            self.stats.add("merge", time.perf_counter() - start, len(self.bulk_loads))
+        if self.manifest is not None:
+            self.retry_failed_files(uploader.failed)
+            self.manifest.commit()
+            print(f"Skipped {self.skipped_files} unchanged files.")
+        if self.term_dictionary is not None:
+            self.write_term_dictionaries()
+        self.bump_generation()
+        print(self.stats.report())
+        if self.metrics_file is not None:
+            self.stats.write_metrics(self.metrics_file)
+
+    def count_terms(self, snippets):
+        """Counts the snippets of one episode containing every term, per index. Runs in the worker processes when
+        workers > 1, so that the main process only adds up the counts.
+
+        Args:
+            snippets (list): Transcript snippets with their index in "_index".
+
+        Returns:
+            dict: Map of index name to a Counter of the snippets containing every term, None without a term dictionary.
+        """
+        if self.term_dictionary is None or not self.standard_terms:
+            return None
+        term_counts = {}
+        for snippet in snippets:
+            term_counts.setdefault(snippet["_index"], Counter()).update(set(tokenize(snippet["transcript_text"])))
+        return term_counts
+
+    def add_term_counts(self, snippets, term_counts):
+        """Adds the term counts of one episode to the document frequencies of the run.
+
+        Args:
+            snippets (list): The transcript snippets of the episode with their index in "_index".
+            term_counts (dict): Their term counts, as returned by count_terms.
+        """
+        for index_name, counts in term_counts.items():
+            self.document_frequencies.setdefault(index_name, Counter()).update(counts)
+        self.document_counts.update(snippet["_index"] for snippet in snippets)
+
+    def write_term_dictionaries(self):
+        """
+        Writes the term dictionary of every target. If files of the index were known before the run, the terms of the
+        new snippets are added to the previous dictionary, which keeps the terms of deleted snippets. Without the
+        standard analyzer, the dictionaries of previous runs are removed.
+        """
+        for target in self.targets:
+            path = os.path.join(self.term_dictionary, target.index_name + ".tsv")
+            if not self.standard_terms:
+                # The dictionary of a previous run does not match the index either, the middle-ware falls back to
+                # wildcard queries and unplanned queries without it
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            counts = self.document_frequencies.get(target.index_name, Counter())
+            nr_documents = self.document_counts[target.index_name]
+            if self.known_files.get(target.index_name) and os.path.exists(path):
+                previous = TermDictionary.load(path)
+                counts.update(dict(zip(previous.terms, previous.document_frequencies)))
+                nr_documents += previous.nr_documents or 0
+            write_term_dictionary(path, counts, nr_documents)
+
+    def bump_generation(self):
+        """
+        Writes a new generation to the generation file, which invalidates the result cache of the search middle-ware.
+        """
+        if self.generation_file is None:
+            return
+        directory = os.path.dirname(self.generation_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.generation_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{time.time():.6f}\n")
+        os.replace(tmp_path, self.generation_file)
+
+    def record_file(self, uploader, transcript_file, digest, snippets):
+        """Records a processed file in the manifest for every target and deletes the snippets it no longer produces.
+
+        Args:
+            uploader (BulkUploader): The uploader of the run.
+            transcript_file (TranscriptFile): The processed file.
+            digest (str): The SHA-256 hash of the file content.
+            snippets (list): The snippets of the file for all targets, None if the content did not change.
+        """
+        for target in self.targets:
+            snippet_ids = None
+            if snippets is not None:
+                snippet_ids = {snippet["_id"] for snippet in snippets if snippet["_index"] == target.index_name}
+                stale_ids = self.manifest.snippet_ids(target.index_name, transcript_file.path) - snippet_ids
+                self.delete_snippets(uploader, target.index_name, transcript_file.path, stale_ids)
+            self.manifest.record(target.index_name, transcript_file.path, transcript_file.size,
+                                 transcript_file.mtime_ns, digest, snippet_ids)
+
+    def delete_snippets(self, uploader, index_name, path, snippet_ids):
+        """Queues the deletion of snippets that are no longer produced by their file.
+
+        Args:
+            uploader (BulkUploader): The uploader of the run.
+            index_name (str): The index of the snippets.
+            path (str): The path of their file relative to the transcript folder.
+            snippet_ids (iterable): The ids of the snippets to delete.
+        """
+        for snippet_id in sorted(snippet_ids):
+            self.deleted_snippets[(index_name, snippet_id)] = path
+            uploader.put({"_op_type": "delete", "_index": index_name, "_id": snippet_id})
+
+    def retry_failed_files(self, failed):
+        """Marks the files of failed uploads and deletions as changed in the manifest, so that they are not skipped
+        by the next run.
+
+        Args:
+            failed (list): The error infos of the failed bulk actions, e.g. {"index": {"_index": ..., "_id": ...}}.
+        """
+        for info in failed:
+            op_type, item = next(iter(info.items()))
+            index_name, snippet_id = item.get("_index"), item.get("_id")
+            if op_type == "delete":
+                path = self.deleted_snippets.get((index_name, snippet_id))
+                if path is not None:
+                    self.manifest.retry_snippet(index_name, snippet_id, path)
+            else:
+                self.manifest.retry_snippet(index_name, snippet_id)
+        if failed:
+            print(f"The files of {len(failed)} failed documents will be indexed again by the next run.")
+
+    def create_uploader(self):
+        """Creates the uploader that streams the transcript snippets to Elasticsearch (or the local indices).
+
+        Returns:
+            BulkUploader: An uploader that sends every snippet to the index of its target, with a text store also
+                stores the text of its episode and with a vector index also embeds it.
+        """
+        if self.local_index is not None:
+            uploader = LocalIndexUploader(self.local_index, self.index_name, store_text=self.layout.store_text)
+        else:
+            uploader = BulkUploader(
+                self.client,
+                self.index_name,
+                queue_size=self.size_batch,
+                threads=self.upload_threads,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                max_retries=self.max_retries,
+                index_names={bulk_load.alias: bulk_load.index_name for bulk_load in self.bulk_loads},
+            )
+        if self.text_store is not None:
+            uploader = TextStoreUploader(uploader, self.text_store)
+        if self.vector_index is not None:
+            uploader = EmbeddingUploader(uploader, self.vector_index, get_embedder(self.embedding_model))
+        return uploader
+
+    def process_document(self, segments, transcript_snippets, root, file_name, document_size=None):
         """Processes each JSON document to extract transcript snippets based on the specified document size.
 
         Args:
-            json_data (dict): The JSON data extracted from a transcript file.
+            segments (list): Tuples of (start_time, end_time, transcript_text) of the transcript file, as returned by
+                the transcript readers.
             transcript_snippets (list): A list of transcript snippets to which new snippets will be added.
             root (str): The root directory path where the JSON file is located.
             file_name (str): The name of the JSON file being processed.
+            document_size (int): The size in seconds of the snippets, defaults to the document size of the indexer.
 
         """
+        if document_size is None:
+            document_size = self.document_size
+
         doc_start_time = 0
         doc_end_time = 0
         doc_transcript_text = ""
@@ -114,19 +661,8 @@ class PodcastTranscriptIndexer:
         show_id = root.split("/")[-1].split("show_")[-1]
         episode_id = file_name.split(".json")[0]
 
-        # Loop over array elements in results
-        for i, result in enumerate(json_data["results"]):
-            # Extract the transcript text
-            alternative = result["alternatives"][0]
-
-            if "transcript" not in alternative:
-                continue
-
-            transcript_text = alternative["transcript"]
-
-            # Get start time of first word and end time of last word - is in seconds -> Remove the 's' at the end
-            start_time = float(alternative["words"][0]["startTime"][:-1])
-            end_time = float(alternative["words"][-1]["endTime"][:-1])
+        # Loop over the transcribed segments
+        for start_time, end_time, transcript_text in segments:
             time_len = end_time - start_time
 
             if doc_transcript_text == "":
@@ -136,7 +672,7 @@ class PodcastTranscriptIndexer:
 
             doc_cur_size = doc_end_time - doc_start_time
             # generate and append to the list when the gap increases
-            if abs(self.document_size - doc_cur_size) < abs(self.document_size - doc_cur_size - time_len):
+            if abs(document_size - doc_cur_size) < abs(document_size - doc_cur_size - time_len):
                 # check size podcast: if the size is less than half, merge it with previous one. 
                 # If it's bigger then we make a new document.
                 if time_len <= 15:
@@ -177,94 +713,99 @@ class PodcastTranscriptIndexer:
                 doc_transcript_text,
             )
     
-    def process_document_overlap(self, json_data, transcript_snippets, root, file_name):
+    def process_document_overlap(self, segments, transcript_snippets, root, file_name, document_size=None):
         """Processes each JSON document to extract transcript snippets based on the specified document size with different start timing.
 
         Args:
-            json_data (dict): The JSON data extracted from a transcript file.
+            segments (list): Tuples of (start_time, end_time, transcript_text) of the transcript file, as returned by
+                the transcript readers.
             transcript_snippets (list): A list of transcript snippets to which new snippets will be added.
             root (str): The root directory path where the JSON file is located.
             file_name (str): The name of the JSON file being processed.
+            document_size (int): The size in seconds of the snippets, defaults to the document size of the indexer.
 
         """
-        #keep two sliding windows, one for start time, one for transcript text
-        doc_start_time_queue = []
-        doc_end_time = 0
-        doc_transcript_text_queue = []
+        if document_size is None:
+            document_size = self.document_size
 
         show_id = root.split("/")[-1].split("show_")[-1]
         episode_id = file_name.split(".json")[0]
 
-        # Loop over array elements in results
-        for i, result in enumerate(json_data["results"]):
-            # Extract the transcript text
-            alternative = result["alternatives"][0]
-
-            if "transcript" not in alternative:
-                continue
+        # Keep the text of the whole episode in one buffer, every snippet is a slice of it.
+        # text_offsets[i] is the position of the text of segment i in the buffer.
+        episode_text = "".join(transcript_text for _, _, transcript_text in segments)
+        text_offsets = [0]
+        for _, _, transcript_text in segments:
+            text_offsets.append(text_offsets[-1] + len(transcript_text))
 
-            transcript_text = alternative["transcript"]
+        # The sliding window covers the segments [window_start, window_end)
+        window_start = 0
+        window_end = 0
+        doc_end_time = 0
 
-            # Get start time of first word and end time of last word - is in seconds -> Remove the 's' at the end
-            start_time = float(alternative["words"][0]["startTime"][:-1])
-            end_time = float(alternative["words"][-1]["endTime"][:-1])
+        for i, (start_time, end_time, transcript_text) in enumerate(segments):
             time_len = end_time - start_time
 
-            if doc_transcript_text_queue == []:
+            if window_start == window_end:
                 #initiate the window
                 doc_end_time = end_time
-                doc_transcript_text_queue.append(transcript_text)
-                doc_start_time_queue.append(start_time)
+                window_start, window_end = i, i + 1
                 continue
 
-            doc_cur_size = doc_end_time - doc_start_time_queue[0]
+            doc_cur_size = doc_end_time - segments[window_start][0]
             # generate and append to the list when the gap increases
-            if abs(self.document_size - doc_cur_size) < abs(self.document_size - doc_cur_size - time_len):
+            if abs(document_size - doc_cur_size) < abs(document_size - doc_cur_size - time_len):
                 # check size podcast: if the size is less than 15, merge it with previous one. 
                 if time_len <= 15:
-                    doc_start_time_queue.append(start_time)
-                    doc_transcript_text_queue.append(transcript_text)
+                    window_end = i + 1
                     doc_end_time = end_time
-                
-                doc_transcript_text = ''.join(doc_transcript_text_queue)
 
                 self.append_snippets(
                     transcript_snippets,
                     show_id,
                     episode_id,
-                    doc_start_time_queue[0],
+                    segments[window_start][0],
                     doc_end_time,
-                    doc_transcript_text,
+                    episode_text[text_offsets[window_start]:text_offsets[window_end]],
                 )
 
                 # If it's bigger then we add it later.
                 if time_len > 15:
                     doc_end_time = end_time
-                    doc_start_time_queue.append(start_time)
-                    doc_transcript_text_queue.append(transcript_text)
+                    window_end = i + 1
 
-                doc_cur_size = doc_end_time - doc_start_time_queue[0]
                 #remove the begining part until the size of window is smaller than document size
-                while doc_start_time_queue != [] and doc_transcript_text_queue != [] and self.document_size < doc_cur_size:
-                    #pop the first element in the queue
-                    doc_start_time_queue.pop(0)
-                    doc_transcript_text_queue.pop(0)
-                    doc_cur_size = doc_end_time - doc_start_time_queue[0]
+                doc_cur_size = doc_end_time - segments[window_start][0]
+                while document_size < doc_cur_size:
+                    if window_start == window_end - 1:
+                        # a single segment longer than the document size is a snippet of its own, the next segment
+                        # starts a new window
+                        self.append_snippets(
+                            transcript_snippets,
+                            show_id,
+                            episode_id,
+                            segments[window_start][0],
+                            doc_end_time,
+                            episode_text[text_offsets[window_start]:text_offsets[window_end]],
+                        )
+                        window_start = window_end
+                        break
+                    window_start += 1
+                    doc_cur_size = doc_end_time - segments[window_start][0]
             else:
-                doc_start_time_queue.append(start_time)
-                doc_transcript_text_queue.append(transcript_text)
+                window_end = i + 1
 
             # keep the last end time as the document end time
             doc_end_time = end_time
 
         # if the remaining snippets cannot reach document size, still generate a document and append
-        doc_transcript_text = ''.join(doc_transcript_text_queue)
+        doc_transcript_text = episode_text[text_offsets[window_start]:text_offsets[window_end]]
         if doc_transcript_text != "":
             self.append_snippets(
                 transcript_snippets,
                 show_id,
                 episode_id,
-                doc_start_time_queue[0],
+                segments[window_start][0],
                 doc_end_time,
                 doc_transcript_text,
             )
@@ -296,17 +837,93 @@ class PodcastTranscriptIndexer:
 
         transcript_snippets.append(snippet)
 
-    def bulk_upload_documents(self, documents):
-        """Uploads a batch of transcript snippets to the Elasticsearch index.
 
-        Args:
-            documents (list): A list of documents formatted as dictionary items ready for bulk uploading.
-        """
-        helpers.bulk(self.client, documents, index=self.index_name)
-        print("Bulk upload done.")
+def parse_target(value):
+    """Parses a --target argument of the form document_size:allow_overlap:index_name.
+
+    Args:
+        value (str): The argument, e.g. "120:true:podcast_overlap_120".
+
+    Returns:
+        IndexTarget: The parsed target.
+    """
+    try:
+        document_size, allow_overlap, index_name = value.split(":")
+        return IndexTarget(int(document_size), allow_overlap.lower() in ("true", "1", "yes"), index_name)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected SIZE:OVERLAP:INDEX, got {value!r}")
+
+
+def parse_base_target(value):
+    """Parses a --base-target argument of the form document_size:index_name.
+
+    Args:
+        value (str): The argument, e.g. "30:podcast_30".
+
+    Returns:
+        IndexTarget: A target without overlap whose snippets are numbered for stitching.
+    """
+    try:
+        document_size, index_name = value.split(":")
+        return IndexTarget(int(document_size), False, index_name, True)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected SIZE:INDEX, got {value!r}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index podcast transcripts into Elasticsearch.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to parse and segment the transcript files")
+    parser.add_argument("--upload-threads", type=int, default=2,
+                        help="number of threads sending bulk requests concurrently")
+    parser.add_argument("--chunk-size", type=int, default=500, help="maximum number of documents per bulk request")
+    parser.add_argument("--chunk-bytes", type=int, default=10 * 1024 * 1024,
+                        help="maximum size in bytes of a bulk request")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="retries with exponential backoff for documents rejected with 429")
+    parser.add_argument("--manifest", default="data/index-manifest.sqlite",
+                        help="SQLite manifest of indexed files used to index only new or changed files")
+    parser.add_argument("--full", action="store_true", help="index all files without using the manifest")
+    parser.add_argument("--reader", choices=["json", "orjson", "stream"], default="json",
+                        help="transcript parser, orjson is faster and stream uses the least memory")
+    parser.add_argument("--from-cache", metavar="CACHE_DIR",
+                        help="read the segments from a cache written by transcript_cache.py instead of the JSON files")
+    parser.add_argument("--generation-file", default="../data/index-generation",
+                        help="file rewritten after every run to invalidate the result cache of the middle-ware")
+    parser.add_argument("--local-index", metavar="DIR",
+                        help="write local inverted indices to DIR instead of Elasticsearch, see LOCAL_INDEX_PATH")
+    parser.add_argument("--term-dictionary", default="../data/term-dictionary",
+                        help="folder for the term dictionaries used by the middle-ware to expand wildcards")
+    parser.add_argument("--vector-index", metavar="DIR",
+                        help="write the embeddings of the snippets to local vector indices in DIR for the hybrid "
+                             "search, see VECTOR_INDEX_PATH")
+    parser.add_argument("--embedding-model", default=DEFAULT_MODEL,
+                        help="sentence-transformers model embedding the snippets, or hashing (no model download)")
+    parser.add_argument("--shards", type=int, default=3, help="primary shards of the Elasticsearch indices")
+    parser.add_argument("--replicas", type=int, default=0, help="replicas of the Elasticsearch indices")
+    parser.add_argument("--analyzer", default="standard", help="analyzer of transcript_text, e.g. english")
+    parser.add_argument("--index-options", choices=INDEX_OPTIONS, default="positions",
+                        help="index_options of transcript_text, phrase queries need positions")
+    parser.add_argument("--subfield", dest="subfields", action="append", type=parse_subfield, default=[],
+                        metavar="NAME:ANALYZER[:INDEX_OPTIONS]",
+                        help="subfield of transcript_text with another analyzer, e.g. english:english:freqs (can be "
+                             "repeated)")
+    parser.add_argument("--bulk-load", action="store_true",
+                        help="load all files into new indices without refreshes and replicas, force-merge them and "
+                             "swap them in behind aliases with the index names")
+    parser.add_argument("--text-store", metavar="DIR",
+                        help="store the texts of the episodes compressed in DIR and only the position of their text in "
+                             "the snippets, see TEXT_STORE_PATH")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="write the time and items of every indexing stage to FILE in the Prometheus text format")
+    parser.add_argument("--target", dest="targets", action="append", type=parse_target, metavar="SIZE:OVERLAP:INDEX",
+                        help="index to build in the same run, e.g. 30:false:podcast_30 (can be repeated)")
+    parser.add_argument("--base-target", dest="targets", action="append", type=parse_base_target,
+                        metavar="SIZE:INDEX",
+                        help="index of numbered snippets without overlap the middle-ware stitches longer clips from, "
+                             "e.g. 30:podcast_30, see STITCH_BASE_INDEX")
+    args = parser.parse_args()
+
     load_dotenv()
     start_time_program = time.time()
     
@@ -314,7 +931,7 @@ if __name__ == "__main__":
     API_KEY = os.getenv("API_KEY")
     folder_path = "data/podcast-transcripts"
     index_name = "podcast_overlap_300"
-    size_batch = 50000
+    size_batch = 10000  # maximum number of snippets waiting for upload
 
     # Parameters to play around for experiments
     allow_overlap = True
@@ -329,6 +946,24 @@ if __name__ == "__main__":
         size_batch,
         document_size,
         allow_overlap,
+        workers=args.workers,
+        upload_threads=args.upload_threads,
+        chunk_size=args.chunk_size,
+        max_chunk_bytes=args.chunk_bytes,
+        max_retries=args.max_retries,
+        manifest_path=None if args.full or args.from_cache or args.bulk_load else args.manifest,
+        targets=args.targets,
+        reader=args.reader,
+        cache_dir=args.from_cache,
+        generation_file=args.generation_file,
+        local_index=args.local_index,
+        term_dictionary=args.term_dictionary,
+        vector_index=args.vector_index,
+        embedding_model=args.embedding_model,
+        metrics_file=args.metrics_file,
+        layout=IndexLayout(args.shards, args.replicas, args.analyzer, args.index_options, tuple(args.subfields)),
+        bulk_load=args.bulk_load,
+        text_store=args.text_store,
     )
 
     indexer.ensure_index_exists()
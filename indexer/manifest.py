@@ -0,0 +1,160 @@
+import sqlite3
+
+
+class TranscriptManifest:
+    """
+    Local SQLite record of the indexed transcript files and the snippet ids they produced, used to index only new or
+    changed files on a rerun.
+    """
+
+    def __init__(self, path):
+        """Opens or creates the manifest.
+
+        Args:
+            path (str): The path of the SQLite database file.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS indices (
+                index_name TEXT PRIMARY KEY,
+                settings TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                index_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (index_name, path)
+            );
+            CREATE TABLE IF NOT EXISTS snippets (
+                index_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                snippet_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS snippets_by_file ON snippets (index_name, path);
+            """
+        )
+
+    def use_settings(self, index_name, settings):
+        """Registers the segmentation settings of an index. If they differ from the recorded ones, all files of the
+        index are marked as changed, so that they are segmented again and their old snippets are deleted.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+            settings (str): A description of the segmentation settings, e.g. the document size.
+        """
+        row = self.connection.execute(
+            "SELECT settings FROM indices WHERE index_name = ?", (index_name,)
+        ).fetchone()
+        if row is not None and row[0] != settings:
+            self.connection.execute("UPDATE files SET size = -1, sha256 = '' WHERE index_name = ?", (index_name,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO indices (index_name, settings) VALUES (?, ?)", (index_name, settings)
+        )
+
+    def forget_index(self, index_name):
+        """Removes all files of an index, e.g. because the index was (re)created empty.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+        """
+        self.connection.execute("DELETE FROM files WHERE index_name = ?", (index_name,))
+        self.connection.execute("DELETE FROM snippets WHERE index_name = ?", (index_name,))
+
+    def files(self, index_name):
+        """Loads the recorded files of an index.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+
+        Returns:
+            dict: Map of file path to (size, mtime_ns, sha256).
+        """
+        rows = self.connection.execute(
+            "SELECT path, size, mtime_ns, sha256 FROM files WHERE index_name = ?", (index_name,)
+        )
+        return {path: (size, mtime_ns, sha256) for path, size, mtime_ns, sha256 in rows}
+
+    def snippet_ids(self, index_name, path):
+        """Returns the snippet ids a file produced in its last run.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+            path (str): The path of the file relative to the transcript folder.
+
+        Returns:
+            set: The snippet ids.
+        """
+        rows = self.connection.execute(
+            "SELECT snippet_id FROM snippets WHERE index_name = ? AND path = ?", (index_name, path)
+        )
+        return {row[0] for row in rows}
+
+    def record(self, index_name, path, size, mtime_ns, sha256, snippet_ids):
+        """Records the current state of a file and the snippet ids it produced.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+            path (str): The path of the file relative to the transcript folder.
+            size (int): The size of the file in bytes.
+            mtime_ns (int): The modification time of the file in nanoseconds.
+            sha256 (str): The SHA-256 hash of the file content.
+            snippet_ids (iterable): The ids of the snippets produced from the file, None to keep the recorded ids.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (index_name, path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+            (index_name, path, size, mtime_ns, sha256),
+        )
+        if snippet_ids is not None:
+            self.connection.execute("DELETE FROM snippets WHERE index_name = ? AND path = ?", (index_name, path))
+            self.connection.executemany(
+                "INSERT INTO snippets (index_name, path, snippet_id) VALUES (?, ?, ?)",
+                ((index_name, path, snippet_id) for snippet_id in snippet_ids),
+            )
+
+    def remove(self, index_name, path):
+        """Removes a file that no longer exists.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+            path (str): The path of the file relative to the transcript folder.
+        """
+        self.connection.execute("DELETE FROM files WHERE index_name = ? AND path = ?", (index_name, path))
+        self.connection.execute("DELETE FROM snippets WHERE index_name = ? AND path = ?", (index_name, path))
+
+    def retry_snippet(self, index_name, snippet_id, path=None):
+        """Marks the file of a snippet that could not be uploaded or deleted as changed, so that the next run
+        processes it again instead of skipping it.
+
+        Args:
+            index_name (str): The name of the Elasticsearch index.
+            snippet_id (str): The id of the failed snippet.
+            path (str): The path of the file of a failed deletion, whose snippet id is no longer recorded. None to
+                look up the file of a failed upload.
+        """
+        if path is None:
+            self.connection.execute(
+                "UPDATE files SET size = -1, sha256 = '' WHERE index_name = ? AND path IN "
+                "(SELECT path FROM snippets WHERE index_name = ? AND snippet_id = ?)",
+                (index_name, index_name, snippet_id),
+            )
+            return
+        # Recording the id again makes the next run delete it as stale, or with the file if it was removed
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (index_name, path, size, mtime_ns, sha256) VALUES (?, ?, -1, 0, '')",
+            (index_name, path),
+        )
+        self.connection.execute(
+            "INSERT INTO snippets (index_name, path, snippet_id) VALUES (?, ?, ?)", (index_name, path, snippet_id)
+        )
+
+    def commit(self):
+        """
+        Persists all changes of the run. Called after the files of failed uploads were marked with retry_snippet.
+        """
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
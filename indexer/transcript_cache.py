@@ -0,0 +1,147 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+
+from transcript_reader import get_reader
+
+# One record per segment: episode number, start time, end time and the byte offset of its text in the text blob
+SEGMENT_RECORD = struct.Struct("<IddQ")
+
+EPISODES_FILE = "episodes.json"
+SEGMENTS_FILE = "segments.bin"
+TEXT_FILE = "text.bin"
+
+
+def build_cache(folder_path, cache_dir, reader="json"):
+    """Parses all transcript files once and writes their segments to a compact cache.
+
+    The cache consists of episodes.json (the path, first segment and number of segments of every episode),
+    segments.bin (fixed size segment records) and text.bin (the UTF-8 text of all segments, concatenated).
+
+    Args:
+        folder_path (str): The folder containing the JSON transcript files.
+        cache_dir (str): The folder to write the cache to.
+        reader (str): The transcript reader used to parse the files.
+
+    Returns:
+        int: The number of cached episodes.
+    """
+    read_segments = get_reader(reader)
+    os.makedirs(cache_dir, exist_ok=True)
+    # A rebuild removes the episodes of the previous build first, they would point into the rewritten files
+    episodes_path = os.path.join(cache_dir, EPISODES_FILE)
+    if os.path.exists(episodes_path):
+        os.remove(episodes_path)
+
+    episodes = []
+    nr_segments = 0
+    text_offset = 0
+    with open(os.path.join(cache_dir, SEGMENTS_FILE), "wb") as segments_file, \
+            open(os.path.join(cache_dir, TEXT_FILE), "wb") as text_file:
+        for root, dirs, files in os.walk(folder_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.endswith(".json"):
+                    continue
+
+                with open(os.path.join(root, file_name), "rb") as f:
+                    segments = read_segments(f.read())
+
+                episode_number = len(episodes)
+                for start_time, end_time, transcript_text in segments:
+                    encoded_text = transcript_text.encode("utf-8")
+                    segments_file.write(SEGMENT_RECORD.pack(episode_number, start_time, end_time, text_offset))
+                    text_file.write(encoded_text)
+                    text_offset += len(encoded_text)
+
+                path = os.path.relpath(os.path.join(root, file_name), folder_path)
+                episodes.append([path, nr_segments, len(segments)])
+                nr_segments += len(segments)
+
+    # Written last, so an interrupted build leaves no usable cache behind
+    with open(episodes_path, "w") as f:
+        json.dump(episodes, f)
+    return len(episodes)
+
+
+class TranscriptCache:
+    """
+    Read access to a cache written by build_cache. The segment records and the text are memory-mapped, so opening the
+    cache is cheap and the operating system page cache is shared between processes.
+    """
+
+    def __init__(self, cache_dir):
+        """Opens a cache.
+
+        Args:
+            cache_dir (str): The folder of the cache.
+        """
+        with open(os.path.join(cache_dir, EPISODES_FILE)) as f:
+            self.episodes = json.load(f)
+        self.segment_records = self._map(os.path.join(cache_dir, SEGMENTS_FILE))
+        self.text = self._map(os.path.join(cache_dir, TEXT_FILE))
+
+    @staticmethod
+    def _map(path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def episode(self, episode_number):
+        """Returns the location of an episode in the transcript folder, as expected by the segmenters.
+
+        Args:
+            episode_number (int): The position of the episode in the cache.
+
+        Returns:
+            tuple: The directory (relative to the transcript folder) and the file name of the episode.
+        """
+        path = self.episodes[episode_number][0]
+        return os.path.dirname(path), os.path.basename(path)
+
+    def segments(self, episode_number):
+        """Reads the segments of an episode.
+
+        Args:
+            episode_number (int): The position of the episode in the cache.
+
+        Returns:
+            list: Tuples of (start_time, end_time, transcript_text), as returned by the transcript readers.
+        """
+        _, first_segment, nr_segments = self.episodes[episode_number]
+        if nr_segments == 0:
+            return []
+
+        start = first_segment * SEGMENT_RECORD.size
+        end = start + nr_segments * SEGMENT_RECORD.size
+        records = list(SEGMENT_RECORD.iter_unpack(self.segment_records[start:end]))
+
+        # The text of a segment ends where the text of the next segment (possibly of the next episode) starts
+        if end < len(self.segment_records):
+            text_end = SEGMENT_RECORD.unpack_from(self.segment_records, end)[3]
+        else:
+            text_end = len(self.text)
+        text_offsets = [record[3] for record in records] + [text_end]
+
+        return [
+            (start_time, end_time, self.text[text_offsets[i]:text_offsets[i + 1]].decode("utf-8"))
+            for i, (_, start_time, end_time, _) in enumerate(records)
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess the transcript corpus into a compact segment cache.")
+    parser.add_argument("folder", nargs="?", default="data/podcast-transcripts", help="folder with the JSON files")
+    parser.add_argument("cache", nargs="?", default="data/transcript-cache", help="folder to write the cache to")
+    parser.add_argument("--reader", choices=["json", "orjson", "stream"], default="json")
+    args = parser.parse_args()
+
+    nr_episodes = build_cache(args.folder, args.cache, args.reader)
+    print(f"Cached {nr_episodes} episodes in {args.cache}")
@@ -0,0 +1,119 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def segments_from_json(json_data):
+    """Extracts the transcribed segments of a parsed transcript file.
+
+    Args:
+        json_data (dict): The JSON data extracted from a transcript file.
+
+    Returns:
+        list: Tuples of (start_time, end_time, transcript_text) of every result with a transcript.
+    """
+    segments = []
+    for result in json_data["results"]:
+        alternative = result["alternatives"][0]
+
+        if "transcript" not in alternative:
+            continue
+
+        # Get start time of first word and end time of last word - is in seconds -> Remove the 's' at the end
+        start_time = float(alternative["words"][0]["startTime"][:-1])
+        end_time = float(alternative["words"][-1]["endTime"][:-1])
+        segments.append((start_time, end_time, alternative["transcript"]))
+    return segments
+
+
+def read_segments_json(content):
+    """Parses a transcript file with the json module.
+
+    Args:
+        content (bytes): The content of the transcript file.
+
+    Returns:
+        list: Tuples of (start_time, end_time, transcript_text).
+    """
+    return segments_from_json(json.loads(content))
+
+
+def read_segments_orjson(content):
+    """Parses a transcript file with orjson, which builds the same objects as json several times faster.
+
+    Args:
+        content (bytes): The content of the transcript file.
+
+    Returns:
+        list: Tuples of (start_time, end_time, transcript_text).
+    """
+    return segments_from_json(orjson.loads(content))
+
+
+def read_segments_stream(content):
+    """Parses a transcript file incrementally with ijson. Only the transcript and the first and last timestamp of
+    every result are kept, the word arrays are never built in memory.
+
+    Args:
+        content (bytes): The content of the transcript file.
+
+    Returns:
+        list: Tuples of (start_time, end_time, transcript_text).
+    """
+    segments = []
+    alternative_index = -1
+    transcript_text = first_start_time = last_end_time = None
+
+    for prefix, event, value in ijson.parse(content):
+        if prefix == "results.item":
+            if event == "start_map":
+                alternative_index = -1
+                transcript_text = first_start_time = last_end_time = None
+            elif event == "end_map" and transcript_text is not None:
+                segments.append((float(first_start_time[:-1]), float(last_end_time[:-1]), transcript_text))
+        elif prefix == "results.item.alternatives.item" and event == "start_map":
+            alternative_index += 1
+        elif alternative_index != 0:
+            # Only the first alternative is indexed
+            continue
+        elif prefix == "results.item.alternatives.item.transcript":
+            transcript_text = value
+        elif prefix == "results.item.alternatives.item.words.item.startTime":
+            if first_start_time is None:
+                first_start_time = value
+        elif prefix == "results.item.alternatives.item.words.item.endTime":
+            last_end_time = value
+    return segments
+
+
+READERS = {
+    "json": read_segments_json,
+    "orjson": read_segments_orjson,
+    "stream": read_segments_stream,
+}
+
+
+def get_reader(name):
+    """Returns a transcript reader by name.
+
+    Args:
+        name (str): One of "json", "orjson" or "stream".
+
+    Returns:
+        function: A function that turns the content of a transcript file into its segments.
+    """
+    if name not in READERS:
+        raise ValueError(f"Unknown transcript reader {name!r}, choose one of {', '.join(READERS)}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson reader requires the orjson package: pip install orjson")
+    if name == "stream" and ijson is None:
+        raise ValueError("The stream reader requires the ijson package: pip install ijson")
+    return READERS[name]
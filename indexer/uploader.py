@@ -0,0 +1,382 @@
+from elasticsearch import helpers
+import os
+import queue
+import sys
+import threading
+import time
+
+# The local index format is shared with the middle-ware, which searches it
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from local_index import LocalIndexWriter
+from text_store import merge_pieces, TextStoreWriter
+from vector_index import VectorIndexWriter
+
+# Marks the end of the action stream for one upload thread
+_END = object()
+
+
+class BulkUploader:
+    """
+    Uploads bulk actions to Elasticsearch in background threads while the producer keeps parsing. Actions are passed
+    through a bounded queue, so the producer blocks as soon as the uploader falls behind.
+    """
+
+    def __init__(self, client, index_name, queue_size=10000, threads=2, chunk_size=500,
+                 max_chunk_bytes=10 * 1024 * 1024, max_retries=5, initial_backoff=2, max_backoff=60, index_names=None):
+        """Initializes a BulkUploader instance.
+
+        Args:
+            client (Elasticsearch): The Elasticsearch client used for the bulk requests.
+            index_name (str): The default index of the actions.
+            queue_size (int): The maximum number of actions waiting to be uploaded.
+            threads (int): The number of threads sending bulk requests concurrently.
+            chunk_size (int): The maximum number of actions in one bulk request.
+            max_chunk_bytes (int): The maximum size in bytes of one bulk request.
+            max_retries (int): How often documents rejected with 429 (Too Many Requests) are retried.
+            initial_backoff (float): Seconds to wait before the first retry, doubled for every further retry.
+            max_backoff (float): The maximum number of seconds to wait between retries.
+            index_names (dict): The index actions are written to instead of the index they name, e.g. the new index of
+                a bulk load instead of its alias.
+        """
+        self.client = client
+        self.index_name = index_name
+        self.index_names = index_names or {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.error = None
+        self.uploaded = 0
+        self.failed = []
+        self.busy_seconds = 0.0
+
+    def start(self):
+        """
+        Starts the upload threads.
+        """
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, action):
+        """Queues a bulk action, blocking while the queue is full.
+
+        Args:
+            action (dict): A document or bulk action as accepted by helpers.streaming_bulk.
+        """
+        if self.error is not None:
+            raise self.error
+        self._put(action)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Waits until all queued actions are uploaded and stops the threads. Raises the first error of an upload thread.
+        """
+        for _ in self.threads:
+            self._put(_END)
+        for thread in self.threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+        if len(self.failed) > 0:
+            print(f"{len(self.failed)} documents could not be uploaded, e.g. {self.failed[0]}")
+
+    def _put(self, action):
+        # Blocks while the queue is full, unless an upload thread failed and the threads stop taking actions
+        while True:
+            try:
+                self.queue.put(action, timeout=1)
+                return
+            except queue.Full:
+                if self.stopped.is_set():
+                    return
+
+    def _actions(self, waited):
+        # Drain the queue until the end marker or the error of another thread, keeping track of the time spent
+        # waiting for the producer
+        while True:
+            start = time.perf_counter()
+            try:
+                action = self.queue.get(timeout=1)
+            except queue.Empty:
+                action = None
+            waited[0] += time.perf_counter() - start
+            if action is _END or self.stopped.is_set():
+                return
+            if action is None:
+                continue
+            if action.get("_index") in self.index_names:
+                action = dict(action, _index=self.index_names[action["_index"]])
+            yield action
+
+    def _run(self):
+        waited = [0.0]
+        start = time.perf_counter()
+        uploaded = 0
+        failed = []
+        try:
+            for ok, info in helpers.streaming_bulk(
+                self.client,
+                self._actions(waited),
+                index=self.index_name,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                max_retries=self.max_retries,
+                initial_backoff=self.initial_backoff,
+                max_backoff=self.max_backoff,
+                raise_on_error=False,
+            ):
+                if ok:
+                    uploaded += 1
+                elif info.get("delete", {}).get("status") == 404:
+                    # The document to delete was already gone
+                    continue
+                else:
+                    failed.append(info)
+        except Exception as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+            # The producer raises the error with its next action, the other threads stop at their next action
+            self.stopped.set()
+        finally:
+            with self.lock:
+                self.uploaded += uploaded
+                self.failed.extend(failed)
+                self.busy_seconds += time.perf_counter() - start - waited[0]
+
+
+class LocalIndexUploader:
+    """
+    Writes the bulk actions to local indices (app/local_index.py) instead of Elasticsearch, with the interface of
+    BulkUploader. The documents are collected while the producer is parsing, and every index is written once when the
+    uploader is closed.
+    """
+
+    def __init__(self, path, index_name, store_text=True):
+        """Initializes a LocalIndexUploader instance.
+
+        Args:
+            path (str): The folder of the local indices, every index is a subfolder.
+            index_name (str): The default index of the actions.
+            store_text (bool): Whether new indices keep the transcript text in the sources, see LocalIndexWriter.
+        """
+        self.path = path
+        self.index_name = index_name
+        self.store_text = store_text
+        self.writers = {}
+        self.uploaded = 0
+        self.failed = []
+        self.busy_seconds = 0.0
+
+    def start(self):
+        pass
+
+    def put(self, action):
+        """Adds a document to its index or deletes it.
+
+        Args:
+            action (dict): A document or bulk action as accepted by BulkUploader.put.
+        """
+        start = time.perf_counter()
+        index_name = action.get("_index", self.index_name)
+        writer = self.writers.get(index_name)
+        if writer is None:
+            writer = self.writers[index_name] = LocalIndexWriter(os.path.join(self.path, index_name),
+                                                                 store_field=self.store_text)
+
+        if action.get("_op_type") == "delete":
+            writer.delete(action["_id"])
+        else:
+            writer.add(action["_id"], {field: value for field, value in action.items() if not field.startswith("_")})
+        self.uploaded += 1
+        self.busy_seconds += time.perf_counter() - start
+
+    def close(self):
+        """
+        Writes all indices.
+        """
+        start = time.perf_counter()
+        for writer in self.writers.values():
+            writer.commit()
+        self.busy_seconds += time.perf_counter() - start
+
+
+class EmbeddingUploader:
+    """
+    Wraps an uploader to also write the embeddings of the snippets to local vector indices (app/vector_index.py). The
+    snippets are embedded in batches while they pass through, deletions are applied to the vector indices as well, and
+    the vector indices are written when the uploader is closed.
+    """
+
+    def __init__(self, uploader, path, embedder, batch_size=256, field="transcript_text"):
+        """Initializes an EmbeddingUploader instance.
+
+        Args:
+            uploader (BulkUploader): The uploader of the snippets (BulkUploader or LocalIndexUploader).
+            path (str): The folder of the vector indices, every index is a subfolder.
+            embedder: The embedder of the snippets, see app/embeddings.py.
+            batch_size (int): The number of snippets embedded at once.
+            field (str): The field of the snippets that is embedded.
+        """
+        self.uploader = uploader
+        self.path = path
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.field = field
+        self.writers = {}
+        self.pending = {}
+        self.embedded = 0
+        self.embedding_seconds = 0.0
+
+    @property
+    def uploaded(self):
+        return self.uploader.uploaded
+
+    @property
+    def failed(self):
+        return self.uploader.failed
+
+    @property
+    def busy_seconds(self):
+        return self.uploader.busy_seconds
+
+    def start(self):
+        self.uploader.start()
+
+    def writer(self, index_name):
+        writer = self.writers.get(index_name)
+        if writer is None:
+            writer = self.writers[index_name] = VectorIndexWriter(os.path.join(self.path, index_name),
+                                                                  self.embedder.name, self.embedder.dimensions)
+        return writer
+
+    def put(self, action):
+        """Passes an action to the uploader and adds the snippet to the next batch to embed, or deletes its vector.
+
+        Args:
+            action (dict): A document or bulk action as accepted by BulkUploader.put.
+        """
+        self.uploader.put(action)
+        index_name = action.get("_index", self.uploader.index_name)
+        if action.get("_op_type") == "delete":
+            self.pending.pop((index_name, action["_id"]), None)
+            self.writer(index_name).delete(action["_id"])
+            return
+        self.pending[(index_name, action["_id"])] = str(action.get(self.field, ""))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Embeds the pending snippets.
+        """
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        vectors = self.embedder.encode(list(self.pending.values()))
+        for (index_name, doc_id), vector in zip(self.pending, vectors):
+            self.writer(index_name).add(doc_id, vector)
+        self.embedded += len(self.pending)
+        self.pending = {}
+        self.embedding_seconds += time.perf_counter() - start
+
+    def close(self):
+        """
+        Waits for the uploader, embeds the remaining snippets and writes the vector indices.
+        """
+        self.uploader.close()
+        self.flush()
+        start = time.perf_counter()
+        for writer in self.writers.values():
+            writer.commit()
+        self.embedding_seconds += time.perf_counter() - start
+
+
+class TextStoreUploader:
+    """
+    Wraps an uploader to also write the texts of the episodes to a text store (app/text_store.py). The text of an
+    episode is put together from the snippets that pass through (with text_start and text_end), which arrive one
+    episode after the other, and compressed when the next episode starts. The store is written when the uploader is
+    closed. Texts of episodes whose snippets are deleted stay in the store.
+    """
+
+    def __init__(self, uploader, path, field="transcript_text"):
+        """Initializes a TextStoreUploader instance.
+
+        Args:
+            uploader (BulkUploader): The uploader of the snippets (BulkUploader or LocalIndexUploader).
+            path (str): The folder of the text store.
+            field (str): The text field of the snippets.
+        """
+        self.uploader = uploader
+        self.path = path
+        self.field = field
+        self.writer = None
+        self.episode_id = None
+        self.pieces = []
+        self.stored_seconds = 0.0
+
+    @property
+    def index_name(self):
+        return self.uploader.index_name
+
+    @property
+    def uploaded(self):
+        return self.uploader.uploaded
+
+    @property
+    def failed(self):
+        return self.uploader.failed
+
+    @property
+    def busy_seconds(self):
+        return self.uploader.busy_seconds + self.stored_seconds
+
+    def start(self):
+        self.writer = TextStoreWriter(self.path)
+        self.uploader.start()
+
+    def put(self, action):
+        """Passes an action to the uploader and keeps the text of a snippet for the text of its episode.
+
+        Args:
+            action (dict): A document or bulk action as accepted by BulkUploader.put.
+        """
+        self.uploader.put(action)
+        if "text_start" not in action:
+            return
+        if action["episode_id"] != self.episode_id:
+            self.flush()
+            self.episode_id = action["episode_id"]
+        self.pieces.append((action["text_start"], action[self.field]))
+
+    def flush(self):
+        """
+        Compresses the text of the current episode.
+        """
+        if not self.pieces:
+            return
+        start = time.perf_counter()
+        self.writer.add(self.episode_id, merge_pieces(self.pieces))
+        self.pieces = []
+        self.stored_seconds += time.perf_counter() - start
+
+    def close(self):
+        """
+        Waits for the uploader and writes the text store.
+        """
+        self.uploader.close()
+        self.flush()
+        start = time.perf_counter()
+        self.writer.commit()
+        self.stored_seconds += time.perf_counter() - start